@@ -7,25 +7,53 @@ rainfall data (rain gauge and gauage-adjusted radar rainfall data).
 '''
 
 # standard library
+import cProfile
+import csv
+import math
 import os
+from contextlib import contextmanager
 # framework
-from flask import Flask, render_template, redirect, url_for
+from flask import Flask, Response, after_this_request, g, request, render_template, redirect, url_for, stream_with_context
 # API
-from flask_restful import Resource, Api, reqparse, inputs
+from flask_restful import Resource, Api, reqparse, inputs, abort
+from flask_restful.representations.json import output_json
 from flasgger import Swagger, swag_from
+# command line
+import click
 # web requests
 import requests
+from urllib.parse import urlencode
 # date/time parsing
 from datetime import datetime, timedelta
-from dateutil.parser import parse
-from dateutil import tz
 import timeit
 # HTML parsing
 import bs4
 from bs4 import BeautifulSoup
+from rainfall.admission import CellBudget
+from rainfall.aioclient import AsyncTeragonClient, UpstreamError, UpstreamInvalid, UpstreamTimeout
+from rainfall.client import TeragonClient
+from rainfall.coalesce import SingleFlight
+from rainfall.engine import UpstreamEngine
 # data transformation
-import petl as etl
-from sortedcontainers import SortedDict
+from rainfall.aggregate import AGGREGATES, parse_duration, resample
+from rainfall.basins import BASIN_AGGREGATES, BasinIndex
+from rainfall.events import EventStore, load_catalog
+from rainfall import formats
+from rainfall.features import FeatureTemplates
+from rainfall.geo import StaticLayer
+from rainfall.ingest import IngestLog, watch_rows, watermark
+from rainfall.live import LiveCache
+from rainfall.matrix import RainfallMatrix, decode_lines, iter_csv
+from rainfall import metrics
+from rainfall.metrics import Metrics, count_bucket, record_bytes, stage
+from rainfall.pages import decode_cursor, encode_cursor, location_page, request_token, time_page, time_span
+from rainfall.pixels import PixelTable, encode as pixel_code
+from rainfall.spatial import PixelIndex
+from rainfall.store import RainfallStore
+from rainfall.streaming import json_chunks
+from rainfall.teragon import STEPS, payload_cells, payload_ids, payload_key, payload_window, payload_with_window, fan_out, split_payload
+from rainfall.timestamps import gettz, parse_datetime
+from rainfall.workers import TransformPool
 # geojson spec
 # from geojson import Point, Feature, FeatureCollection
 import json
@@ -45,6 +73,96 @@ application.config['URL_GARR'] = "http://web.3riverswetweather.org/trp:API.pixel
 # global parameter to set data response format. This may be exposed to user in the future
 application.config['INDEXED'] = True
 
+# local store of historical rainfall data, so that it is only requested from
+# Teragon once. Data newer than STORE_SETTLE_DAYS may still be revised, and
+# is always requested. Set STORE_PATH to None to disable the store.
+application.config['STORE_PATH'] = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "store")
+application.config['STORE_SETTLE_DAYS'] = 30
+
+# large requests are split into sub-requests of at most FANOUT_MAX_STEPS time
+# steps (one week of 15-minute data) and FANOUT_MAX_IDS locations, which are
+# sent to Teragon FANOUT_PARALLELISM at a time
+application.config['FANOUT_MAX_STEPS'] = 672
+application.config['FANOUT_MAX_IDS'] = 600
+application.config['FANOUT_PARALLELISM'] = 4
+
+# the HTTP client used for Teragon: connections are kept alive in a pool of
+# UPSTREAM_POOL_SIZE connections; requests that fail to connect or return a
+# server error are retried UPSTREAM_RETRIES times (with exponential backoff)
+application.config['UPSTREAM_POOL_SIZE'] = 16
+application.config['UPSTREAM_CONNECT_TIMEOUT'] = 5
+application.config['UPSTREAM_READ_TIMEOUT'] = 120
+application.config['UPSTREAM_RETRIES'] = 2
+application.config['UPSTREAM_BACKOFF'] = 0.5
+
+# how Teragon tables are fetched. "async": requests are made on an asyncio
+# event loop, up to UPSTREAM_ASYNC_CONNECTIONS at a time, so that waiting on
+# Teragon holds neither a thread nor a pooled connection, and the responses
+# are parsed as they arrive by UPSTREAM_PARSE_WORKERS threads (responses
+# beyond those are buffered until a thread is free). "threads": each request
+# blocks a thread on the pooled client above, and is parsed as it arrives.
+# Streamed responses always use the pooled client.
+application.config['UPSTREAM_ENGINE'] = "async"
+application.config['UPSTREAM_ASYNC_CONNECTIONS'] = 256
+application.config['UPSTREAM_PARSE_WORKERS'] = 4
+
+# large tables (of at least TRANSFORM_PROCESS_MIN_CELLS values) are parsed
+# from Teragon's response, rendered as JSON and encoded in a pool of
+# TRANSFORM_PROCESSES worker processes, on other cores and outside the GIL, so
+# that they don't hold up the other requests of the process. 0 turns the pool
+# off.
+application.config['TRANSFORM_PROCESSES'] = os.cpu_count() or 1
+application.config['TRANSFORM_PROCESS_MIN_CELLS'] = 200000
+
+# recent ("live") windows, such as the default last 24 hours, are cached in
+# memory (up to LIVE_CACHE_MAX_CELLS values, including the responses rendered
+# from them) and served from there for LIVE_CACHE_TTL seconds, by interval.
+# After that only their newest hour is requested from Teragon again, which a
+# background thread does every LIVE_CACHE_REFRESH seconds for windows in use.
+# Set LIVE_CACHE_MAX_CELLS to 0 to disable the cache.
+application.config['LIVE_CACHE_MAX_CELLS'] = 2000000
+application.config['LIVE_CACHE_TTL'] = {
+    "Daily": 3600,
+    "Hourly": 600,
+    "15-minute": 300
+}
+application.config['LIVE_CACHE_REFRESH'] = 60
+
+# the cost of a request is estimated as the number of values it asks for (time
+# steps × locations). Requests costing more than MAX_REQUEST_CELLS are
+# rejected; JSON requests keyed by time costing more than CHUNK_CELLS are
+# streamed, fetching and sending at most CHUNK_CELLS values at a time, rather
+# than held in memory whole. Each worker requests at most INFLIGHT_CELLS values
+# from Teragon at once; requests wait up to INFLIGHT_WAIT seconds for room,
+# and are then turned away. Set INFLIGHT_CELLS to None to disable the limit.
+application.config['MAX_REQUEST_CELLS'] = 50000000
+application.config['CHUNK_CELLS'] = 2000000
+application.config['INFLIGHT_CELLS'] = 10000000
+application.config['INFLIGHT_WAIT'] = 30
+
+# identical requests that arrive while one is already being handled wait for
+# it and share its data, rather than each requesting it from Teragon
+application.config['COALESCE'] = True
+
+# each request's time is broken down by stage (parsing the arguments, waiting
+# for Teragon, parsing its CSV, aggregating, transforming and serializing) and
+# published at /metrics. Requests slower than SLOW_REQUEST_SECONDS have their
+# breakdown logged; if PROFILE_DIR is set, they're also profiled, and their
+# profiles are saved there (profiling slows every request down, so it's off by
+# default).
+application.config['SLOW_REQUEST_SECONDS'] = 10
+application.config['PROFILE_DIR'] = None
+
+# the GARR and rain gauge data of the events in data/db.json are precomputed
+# (with `flask build-events`) and kept in EVENTS_PATH, along with summary
+# statistics of each event
+application.config['EVENTS_PATH'] = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "events")
+
+# how long clients may cache the static geojson layers, in seconds
+application.config['GEOJSON_MAX_AGE'] = 86400
+
 # ReST-ful API via Flask-Restful
 api = Api(application)
 
@@ -80,43 +198,171 @@ swag = Swagger(
 # HELPERS
 
 
-# get a lookup dictionary of pixels by basin, read in from file on disk.
-pixel_lookup = {}
+# the worker processes of rainfall.workers are spawned, so they re-import the
+# script the app was started with (as __mp_main__). They only run the
+# functions of rainfall.workers, so they skip loading the app's data and
+# starting its services.
+SERVING = __name__ != "__mp_main__"
+
+if SERVING:
+    # get a lookup dictionary of pixels by basin, read in from file on disk.
+    pixel_lookup = {}
+
+    basin_lookup_file = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "data", "lookup_basins_revised.json"
+    )
+    with open(basin_lookup_file, mode='r') as fp:
+        pixel_lookup = json.load(fp)
+
+    # generate a list of all pixels, including those not in basins, in "123-456" format
+    all_pixels = []
+    # generate a list of all pixels, excluding those not in basins, in "123-456" format
+    all_basin_pixels = []
+
+    for k, v in pixel_lookup.items():
+        for i in v:
+            all_pixels.append(i)
+            if k != "other":
+                all_basin_pixels.append(i)
+
+    # index of the basin each pixel belongs to, for aggregating pixels by basin
+    basin_index = BasinIndex(pixel_lookup)
+
+    # spatial index of the GARR grid, for selecting pixels by point, bbox, or
+    # polygon
+    pixel_index = PixelIndex(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "data", "grid.csv"))
+
+    # the GARR pixels by integer code (see rainfall.pixels), with their ids in
+    # each format
+    pixel_table = PixelTable(pixel_index.codes)
+
+    # the Teragon pixels argument of each basin (and of all pixels, and all
+    # basin pixels), built once rather than for every request
+    basin_pixel_args = {
+        basin: pixel_table.to_teragon(map(pixel_code, ids))
+        for basin, ids in pixel_lookup.items()
+    }
+    all_pixels_arg = pixel_table.to_teragon(map(pixel_code, all_pixels))
+    all_basin_pixels_arg = pixel_table.to_teragon(map(pixel_code, all_basin_pixels))
+
+    # the catalog of notable events, and their precomputed data
+    event_store = EventStore(
+        load_catalog(os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "data", "db.json")),
+        application.config['EVENTS_PATH']
+    )
+
+    # the static geojson layers, loaded once and kept pre-serialized and
+    # compressed, ready to be sent to clients
+    static_layers = {}
+    for layer in ["grid.geojson", "grid_centroids.geojson", "gauges.geojson"]:
+        static_layers[layer] = StaticLayer(os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "data", layer))
+
+    # the same layers as templates, serialized a feature at a time, for
+    # embedding rainfall data in their features (by the property holding each
+    # location id)
+    feature_templates = {}
+    for layer, id_property in [("grid.geojson", "id"), ("grid_centroids.geojson", "pixel"), ("gauges.geojson", "ID")]:
+        feature_templates[layer] = FeatureTemplates(static_layers[layer].data, id_property)
+
+
+def static_layer_response(layer):
+    """build the response for a static geojson layer. Clients get the
+    smallest encoding they accept, and conditional requests for a layer they
+    already have are answered with 304 Not Modified.
 
-basin_lookup_file = os.path.join(
-    os.path.dirname(os.path.abspath(__file__)),
-    "data", "lookup_basins_revised.json"
-)
-with open(basin_lookup_file, mode='r') as fp:
-    pixel_lookup = json.load(fp)
+    Arguments:
+        layer {StaticLayer} -- the layer
 
-# generate a list of all pixels, including those not in basins, in "123-456" format
-all_pixels = []
-# generate a list of all pixels, excluding those not in basins, in "123-456" format
-all_basin_pixels = []
+    Returns:
+        {Response} -- the response
+    """
+    body, encoding, etag = layer.representation(request.accept_encodings)
+    response = Response(body, mimetype="application/json")
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.public = True
+    response.cache_control.max_age = application.config['GEOJSON_MAX_AGE']
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+# the pooled HTTP client for Teragon
+teragon = TeragonClient(
+    pool_size=application.config['UPSTREAM_POOL_SIZE'],
+    connect_timeout=application.config['UPSTREAM_CONNECT_TIMEOUT'],
+    read_timeout=application.config['UPSTREAM_READ_TIMEOUT'],
+    retries=application.config['UPSTREAM_RETRIES'],
+    backoff=application.config['UPSTREAM_BACKOFF']
+)
 
-for k, v in pixel_lookup.items():
-    for i in v:
-        all_pixels.append(i)
-        if k != "other":
-            all_basin_pixels.append(i)
+# the worker processes for large tables
+transform_pool = None
+if SERVING and application.config['TRANSFORM_PROCESSES']:
+    transform_pool = TransformPool(application.config['TRANSFORM_PROCESSES'])
+
+# the event loop fetching Teragon tables, if UPSTREAM_ENGINE is "async"
+engine = None
+if SERVING and application.config['UPSTREAM_ENGINE'] == "async":
+    engine = UpstreamEngine(
+        AsyncTeragonClient(
+            pool_size=application.config['UPSTREAM_ASYNC_CONNECTIONS'],
+            connect_timeout=application.config['UPSTREAM_CONNECT_TIMEOUT'],
+            read_timeout=application.config['UPSTREAM_READ_TIMEOUT'],
+            retries=application.config['UPSTREAM_RETRIES'],
+            backoff=application.config['UPSTREAM_BACKOFF']
+        ),
+        parse_workers=application.config['UPSTREAM_PARSE_WORKERS']
+    )
+
+# calls in flight, shared by concurrent identical requests
+flights = SingleFlight()
+
+# the values being requested from Teragon at once
+budget = None
+if application.config['INFLIGHT_CELLS']:
+    budget = CellBudget(application.config['INFLIGHT_CELLS'])
+
+# the stage timings of handled requests, published at /metrics
+request_metrics = Metrics()
+
+# the newest data received from Teragon, for the watermarks of responses
+ingest_log = IngestLog()
+
+# the cache of recent windows
+live_cache = None
+if SERVING and application.config['LIVE_CACHE_MAX_CELLS']:
+    live_cache = LiveCache(
+        lambda url, data: fetch_shared_matrix(url, data),
+        ttl=application.config['LIVE_CACHE_TTL'],
+        max_cells=application.config['LIVE_CACHE_MAX_CELLS']
+    )
+    live_cache.start_refresher(application.config['LIVE_CACHE_REFRESH'])
+
+# the local store of historical rainfall data
+store = None
+if SERVING and application.config['STORE_PATH']:
+    store = RainfallStore(
+        application.config['STORE_PATH'],
+        settle=timedelta(days=application.config['STORE_SETTLE_DAYS'])
+    )
 
 
 def handle_utc(datestring, direction="to_local", local_zone='America/New_York'):
     """ parse from a date/time string
     """
 
-    # METHOD 1: Hardcode zones:
-    from_zone = tz.gettz('UTC')
-    to_zone = tz.gettz(local_zone)
-
-    # METHOD 2: Auto-detect zones:
-    # from_zone = tz.tzutc()
-    # to_zone = tz.tzlocal()
+    # hardcoded zones (looked up once, then cached)
+    from_zone = gettz('UTC')
+    to_zone = gettz(local_zone)
 
     # parse the ISO 8601-formatted, UTC (zulu) string into a datetime object.
     # e.g., '2017-03-03T17:00:00Z'
-    t = parse(datestring)
+    t = parse_datetime(datestring)
 
     if direction == "to_local" or direction == "from_utc":
         # Tell the datetime object that it's in UTC time zone since
@@ -170,35 +416,55 @@ def parse_pixels_to_args(list_of_ids):
         ['123-456','654-321'] => "123,456;654,321"
 
     The dashed pixel id format is provided by both the Teragon API
-    *responses* and the geojson grid that this API provides for viz and lookups
+    *responses* and the geojson grid that this API provides for viz and lookups.
+    Pixel codes (e.g. 123456) are accepted too.
     '''
-    return ";".join(["{0},{1}".format(*i.split("-")) for i in list_of_ids])
+    return pixel_table.to_teragon(map(pixel_code, list_of_ids))
 
 
 def parse_pixel_basin_args(args):
-    """parse requested pixel ids vs basin selection
+    """parse requested pixel ids vs spatial (polygon, bbox, or point) vs basin
+    selection
     """
-    pixels = ''
+    pixel_args = ''
     # if no pixel ids are provided
     if not args['ids']:
+        # if a geometry is provided, use the pixels it covers
+        if args['polygon'] or args['bbox'] or args['point']:
+            # the first of them given is used
+            name = next(n for n in ['polygon', 'bbox', 'point'] if args[n])
+            try:
+                if name == 'polygon':
+                    selected = pixel_index.within(args['polygon'])
+                elif name == 'bbox':
+                    selected = pixel_index.within_bbox(*args['bbox'])
+                else:
+                    selected = pixel_index.at(*args['point'])
+            except ValueError as e:
+                abort(400, message="{0}: {1}".format(name, e))
+            if not selected:
+                abort(400, message="The requested geometry does not cover any GARR pixels.")
+            pixel_args = pixel_table.to_teragon(selected)
         # if a basin not provided
-        if not args['basin']:
+        elif not args['basin']:
             # then use all pixels
-            pixels = parse_pixels_to_args(all_pixels)
+            pixel_args = all_pixels_arg
         # if a basin argument is provided
         else:
             # if the basin argument is for 'all basins'
             if args['basin'] == 'all basins':
-                # make a list of all pixels, excluding those not in basins
-                pixels = parse_pixels_to_args(all_basin_pixels)
+                # all pixels, excluding those not in basins
+                pixel_args = all_basin_pixels_arg
             else:
                 # otherwise, use the basin lookup
-                pixels = parse_pixels_to_args(
-                    pixel_lookup[args['basin']])
+                pixel_args = basin_pixel_args[args['basin']]
     else:
         # use all pixels
-        pixels = parse_pixels_to_args(args['ids'].split(","))
-    return pixels
+        try:
+            pixel_args = parse_pixels_to_args(args['ids'].split(","))
+        except ValueError:
+            abort(400, message="ids must be GARR pixel ids, e.g. 123-456.")
+    return pixel_args
 
 
 """
@@ -271,8 +537,8 @@ def transform_teragon_csv(teragon_csv, transpose=False, indexed=False):
     which mirrors the JSON response we want to provide to API clients
 
     Arguments:
-        teragon_csv {reference} -- reference to a CSV table on disk
-        or in memory
+        teragon_csv {reference} -- CSV content (text or bytes) or an
+        iterable of lines, e.g. an open file
         transpose {boolean} -- transpose Teragon table
         indexed {boolean} -- return dictionary in indexed format or as records
 
@@ -281,84 +547,18 @@ def transform_teragon_csv(teragon_csv, transpose=False, indexed=False):
         for ease of use in spatial/temporal data vizualation
     """
 
-    petl_table = etl.fromcsv(teragon_csv)
-    # print(petl_table)
-    # get iterable of column pairs (minus 'Timestamp')
-    # this is used to group the double columns representing a single
-    # data point in Teragon's CSV
-
-    h = list(etl.header(petl_table))
-    xy_cols = zip(* [iter(h[1:])] * 2)
-
-    # make a new header row
-    new_header = ['Timestamp']
-    fields_to_cut = []
-    for each in xy_cols:
-        # print(each)
-        # correct id, assembled from columns
-        id_col, note_col = each[0], each[1]
-        # assemble new id column, to replace of PX column (which has data)
-        # id_col = "{0}{1}".format(px[:3], px[4:])
-        # assemble new notes column, to replace of PY column (which has notes)
-        notes_col = "{0}-n".format(id_col)
-        # add those to our new header (array)
-        new_header.extend([id_col, notes_col])
-        # track fields that we might want to remove
-        fields_to_cut.append(notes_col)
-
-    # transform the table
-    table = etl \
-        .setheader(petl_table, new_header) \
-        .cutout(*tuple(fields_to_cut))  \
-        .select('Timestamp', lambda v: v.upper() != 'TOTAL')  \
-        .convert('Timestamp', lambda t: parse(t).isoformat())  \
-        .replaceall('N/D', None)
-
-    # transpose the table, so that rows are cells/gauges and columns are times
-    # (note that this operation can take a while)
-    if transpose:
-        table = etl.transpose(table)
+    # parse the table once into a timestamp x location matrix
+    matrix = RainfallMatrix.from_csv(teragon_csv)
 
     # if indexed: format data where cells/gauges or times are keys, and
     # rainfall amounts are values
     # otherwise, format as nested records (arrays of dicts)
-
+    # if transposed, the data is keyed by cells/gauges and then by times,
+    # read one column of the matrix at a time
     if indexed:
-        data = SortedDict()
-        for row in etl.dicts(table):
-            inside = SortedDict()
-            for d in row.items():
-                if d[0] != 'Timestamp':
-                    if d[1]:
-                        v = float(d[1])
-                    else:
-                        v = d[1]
-                    inside[d[0]] = v
-            data[row['Timestamp']] = inside
-        return data
-
+        return matrix.to_indexed(by_location=transpose)
     else:
-        rows = []
-        # create a nested dictionary from the table
-        for row in etl.dicts(table):
-            data = []
-            for d in row.items():
-                if d[0] != 'Timestamp':
-                    if d[1]:
-                        v = float(d[1])
-                    else:
-                        v = d[1]
-                    data.append({
-                        'id': d[0],
-                        'v': v
-                    })
-            rows.append({
-                "id": row['Timestamp'],
-                "d": data
-            })
-        # print(rows)
-        # print(json.dumps(rows, indent=2))
-        return rows
+        return matrix.to_records(by_location=transpose)
 
 
 def parse_common_teragon(args):
@@ -408,31 +608,982 @@ def parse_common_teragon(args):
     }
 
 
-def etl_data_from_teragon(url, data, tranpose, indexed):
-    """handles making request to the teragon service and transform the response
+def parse_resample_args(args, payload):
+    """handles parsing the temporal aggregation arguments
+
+    Arguments:
+        args {obj} -- Flask-Restful args parser object
+        payload {dict} -- payload for the Teragon API
+
+    Returns:
+        {function} -- a function that aggregates a RainfallMatrix as
+        requested, or None if no aggregation was requested
+    """
+    if not args['bucket'] and not args['intensity']:
+        return None
+
+    # buckets and intensity windows are in multiples of the interval's time
+    # step; a bucket of "total" covers the whole request
+    step = STEPS[payload['interval']]
+    width = None
+    if args['bucket'] and args['bucket'] != "total":
+        width = parse_duration(args['bucket'])
+        if not width or width % step:
+            abort(400, message="bucket must be 'total', or an ISO 8601 duration (e.g., PT6H) that is a multiple of the interval.")
+    intensity = None
+    if args['intensity']:
+        intensity = parse_duration(args['intensity'])
+        if not intensity or intensity % step:
+            abort(400, message="intensity must be an ISO 8601 duration (e.g., PT1H) that is a multiple of the interval.")
+
+    start, end = payload_window(payload)
+    how = args['agg'] or "sum"
+    return lambda matrix: resample(matrix, start, end, width, how, step, intensity)
+
+
+def parse_basin_agg_args(args):
+    """handles parsing the basin aggregation argument
+
+    Arguments:
+        args {obj} -- Flask-Restful args parser object
+
+    Returns:
+        {function} -- a function that aggregates a RainfallMatrix of pixels by
+        basin, or None if no aggregation was requested
+    """
+    if not args['basin_agg']:
+        return None
+    return lambda matrix: basin_index.aggregate(matrix, args['basin_agg'])
+
+
+def link_next_page(cursor):
+    """add the cursor of the next page to the response, in the X-Next-Cursor
+    header and as a link to the next page in the Link header
+
+    Arguments:
+        cursor {str} -- the next page's cursor
+    """
+    query = [(k, v) for k, v in request.values.items(multi=True) if k != "cursor"]
+    url = request.base_url + "?" + urlencode(query + [("cursor", cursor)])
+
+    @after_this_request
+    def add_headers(response):
+        if response.status_code == 200:
+            response.headers['Link'] = '<{0}>; rel="next"'.format(url)
+            response.headers['X-Next-Cursor'] = cursor
+        return response
+
+
+def parse_since_args(args, payload):
+    """handles the since argument, for polling clients: only the time steps
+    from since on are returned. Outside of live windows (which the live cache
+    refreshes a little at a time anyway), only that part of the window is
+    requested from Teragon.
+
+    Arguments:
+        args {obj} -- Flask-Restful args parser object
+        payload {dict} -- payload for the Teragon API
+
+    Returns:
+        {tuple} -- (payload, and a function trimming the data to the time
+        steps from since on, or None)
+    """
+    if not args['since']:
+        return payload, None
+    try:
+        since = parse_datetime(args['since'])
+    except (TypeError, ValueError):
+        abort(400, message="since must be an ISO 8601 date-time, e.g. the X-Watermark of a previous response.")
+    if since.tzinfo is not None:
+        since = since.astimezone(gettz('America/New_York')).replace(tzinfo=None)
+    if args['bucket'] or args['intensity']:
+        abort(400, message="since can't be combined with bucket or intensity.")
+
+    start, end = payload_window(payload)
+    if since <= start:
+        return payload, None
+    if live_cache is None or not is_live(payload):
+        # the window's start is on the hour
+        hour = min(since, end).replace(minute=0, second=0, microsecond=0)
+        payload = payload_with_window(payload, max(hour, start), end)
+    return payload, lambda matrix: matrix.take_rows(since.isoformat())
+
+
+def mark_watermark(url, data):
+    """add the response's watermark to it, in the X-Watermark header: the
+    first of its time steps that may be new or revised the next time it's
+    requested (for any of its locations), to be passed back as since
+
+    Arguments:
+        url {str} -- Teragon API endpoint
+        data {dict} -- request payload
+    """
+    @after_this_request
+    def add_header(response):
+        if response.status_code == 200:
+            start, end = payload_window(data)
+            _, ids = payload_ids(data)
+            response.headers['X-Watermark'] = watermark(
+                start, end, data['interval'],
+                ingest_log.latest(url, data['interval'], ids)
+            ).isoformat()
+        return response
+
+
+def parse_page_args(args, payload, by_location=False):
+    """handles the cursor and page_size arguments. Paginated requests are
+    split into pages of page_size time steps (or locations, by_location), and
+    get a single page, along with the cursor of the next one.
+
+    Arguments:
+        args {obj} -- Flask-Restful args parser object
+        payload {dict} -- payload for the Teragon API, for the whole request
+        by_location {bool} -- page over locations rather than time
+
+    Returns:
+        {tuple} -- (payload for the page, and a function trimming the page's
+        data to the page, or None)
+    """
+    if not args['cursor'] and not args['page_size']:
+        return payload, None
+
+    position, size = None, args['page_size']
+    if args['cursor']:
+        try:
+            position, cursor_size, cursor_token, window = decode_cursor(args['cursor'])
+        except ValueError:
+            abort(400, message="cursor is not valid.")
+        # the pages are of the window resolved for the first page: dates that
+        # were given must be the same, and a relative window (the default
+        # last 24 hours) stays where it was
+        if args['dates'] and payload_window(payload) != window:
+            abort(400, message="cursor is for a different request: repeat the other parameters of the first request (including dates) unchanged.")
+        payload = payload_with_window(payload, *window)
+        if cursor_token != request_token(payload):
+            abort(400, message="cursor is for a different request: repeat the other parameters of the first request (including dates) unchanged.")
+        size = size or cursor_size
+    token = request_token(payload)
+    window = payload_window(payload)
+
+    trim = None
+    if by_location:
+        # pages of locations
+        count = len(payload_ids(payload)[1])
+        offset = position or 0
+        if not isinstance(offset, int) or not 0 <= offset < max(count, 1):
+            abort(400, message="cursor is not valid.")
+        payload, following = location_page(payload, offset, size)
+    else:
+        # pages of time, which don't split aggregation buckets
+        if args['bucket'] == "total" or args['intensity']:
+            abort(400, message="bucket=total and intensity apply to the whole request, and can't be paginated over time.")
+        width = parse_duration(args['bucket']) if args['bucket'] else None
+        span = time_span(payload, size, width)
+        start, end = payload_window(payload)
+        at = start
+        if position is not None:
+            try:
+                at = parse_datetime(position)
+            except (TypeError, ValueError):
+                abort(400, message="cursor is not valid.")
+            if not start <= at < end:
+                abort(400, message="cursor is not valid.")
+        payload, page_end, following = time_page(payload, at, span)
+        if following is not None:
+            # rows at the end of the page (in case Teragon includes the end of
+            # the window) belong to the next page
+            trim = lambda matrix: matrix.take_rows(at.isoformat(), page_end.isoformat())
+            following = following.isoformat()
+
+    if following is not None:
+        link_next_page(encode_cursor(following, size, token, window))
+    return payload, trim
+
+
+def label_request(data):
+    """label the current request's metrics with its interval and number of
+    locations, once its payload has been assembled; the time taken up to that
+    point is recorded as the "parse" stage
+
+    Arguments:
+        data {dict} -- request payload
+    """
+    timings = metrics.current.get()
+    if timings is None:
+        return
+    timings.add("parse", timings.elapsed())
+    timings.labels["interval"] = data['interval']
+    timings.labels["locations"] = count_bucket(len(payload_ids(data)[1]))
+
+
+def admit(data):
+    """estimate the cost of a request, rejecting it if it's too large
+
+    Arguments:
+        data {dict} -- request payload
+
+    Returns:
+        {int} -- the number of values requested
+    """
+    cells = payload_cells(data)
+    limit = application.config['MAX_REQUEST_CELLS']
+    if limit is not None and cells > limit:
+        abort(413, message=(
+            "This request is for {0:,} values, more than the {1:,} allowed. Request "
+            "fewer locations, a shorter period, or a longer interval, or split it "
+            "into several requests.").format(cells, limit))
+    return cells
+
+
+def reserve(data):
+    """reserve room in the in-flight budget for a payload's values, waiting
+    for other requests if needed
+
+    Arguments:
+        data {dict} -- request payload
+
+    Returns:
+        {function} -- releases the reservation
+    """
+    if budget is None:
+        return lambda: None
+    with stage("queue"):
+        cells = budget.acquire(payload_cells(data), application.config['INFLIGHT_WAIT'])
+    if cells is None:
+        abort(503, message="The server is busy with other requests; try again shortly.")
+    return lambda: budget.release(cells)
+
+
+@contextmanager
+def reserved(data):
+    """reserve room in the in-flight budget for the duration of a block"""
+    release = reserve(data)
+    try:
+        yield
+    finally:
+        release()
+
+
+def post_teragon(url, data, stream=False):
+    """make a request to the Teragon service
 
     Arguments:
         url {str} -- Teragon API endpoint
         data {dict} -- request payload (always sent as data via POST)
-        tranpose {bool} --  transpose the resulting table (default: False)
+        stream {bool} -- don't wait for the body of the response
 
     Returns:
-        {dict} -- Teragon API response transformed into a nested dictionary, ready to be transmitted as JSON
+        {requests.Response} -- Teragon's response
     """
-    # get the data
     start_time = timeit.default_timer()
-    response = requests.post(url, data=data)
+    try:
+        with stage("upstream"):
+            response = teragon.post(url, data=data, stream=stream)
+            if not stream:
+                record_bytes(len(response.content))
+    except requests.Timeout:
+        abort(504, message="The Teragon rainfall service did not respond in time.")
+    except requests.RequestException:
+        abort(502, message="The Teragon rainfall service could not be reached.")
     elapsed = timeit.default_timer() - start_time
-    print("response received in {0} seconds".format(elapsed))
+    application.logger.debug(
+        "response received in %.3f seconds %s", elapsed, teragon.stats())
+    return response
+
+
+def pooled(cells):
+    """check whether a table is large enough to be handled in the transform
+    pool
 
-    # post-process and return the response
+    Arguments:
+        cells {int} -- the number of values in the table
+
+    Returns:
+        {bool}
+    """
+    return transform_pool is not None \
+        and cells >= application.config['TRANSFORM_PROCESS_MIN_CELLS']
+
+
+def pooled_parser(data):
+    """how a payload's response is parsed: large responses are read whole,
+    and parsed in the transform pool
+
+    Arguments:
+        data {dict} -- request payload
+
+    Returns:
+        {function} -- parses a whole body (bytes, encoding) into a
+        RainfallMatrix, or None if the response is parsed as it's received
+    """
+    if pooled(payload_cells(data)):
+        return transform_pool.parse_csv
+    return None
+
+
+def in_workers(fn, *args):
+    """run some work in the transform pool, recording the stages it went
+    through in the request's timings (the time spent handing it over and
+    waiting for a worker counts towards the first)
+
+    Arguments:
+        fn {function} -- a method of transform_pool
+        args -- its arguments
+
+    Returns:
+        the result of the work
+    """
     start_time = timeit.default_timer()
-    table = etl.MemorySource(response.text.encode())
-    result = transform_teragon_csv(table, tranpose, indexed)
+    result, stages = fn(*args)
+    waited = timeit.default_timer() - start_time - sum(stages.values())
+    timings = metrics.current.get()
+    if timings is not None:
+        for name, seconds in stages.items():
+            timings.add(name, seconds + waited)
+            waited = 0
+    return result
+
+
+def json_settings():
+    """the keyword arguments of json.dumps for JSON responses, as in
+    flask_restful's output_json
+
+    Returns:
+        {dict}
+    """
+    settings = dict(application.config.get('RESTFUL_JSON', {}))
+    if application.debug:
+        settings.setdefault('indent', 4)
+        settings.setdefault('sort_keys', False)
+    return settings
+
+
+def wait_upstream(future):
+    """wait for a fetch made by the upstream engine
+
+    Arguments:
+        future {Future} -- from engine.fetch or engine.fetch_all
+
+    Returns:
+        the result of the fetch
+    """
+    start_time = timeit.default_timer()
+    try:
+        result = future.result()
+    except UpstreamTimeout:
+        abort(504, message="The Teragon rainfall service did not respond in time.")
+    except UpstreamInvalid:
+        abort(502, message="The Teragon rainfall service sent a response that could not be read.")
+    except UpstreamError:
+        abort(502, message="The Teragon rainfall service could not be reached.")
     elapsed = timeit.default_timer() - start_time
-    print("data processed received in {0} seconds".format(elapsed))
+    application.logger.debug(
+        "response received in %.3f seconds %s", elapsed, engine.client.stats())
+    return result
+
+
+def request_teragon(url, data):
+    """make a request to the Teragon service and parse the response
+
+    Arguments:
+        url {str} -- Teragon API endpoint
+        data {dict} -- request payload (always sent as data via POST)
+
+    Returns:
+        {RainfallMatrix} -- the Teragon table
+    """
+    if engine is not None:
+        return wait_upstream(engine.fetch(
+            url, data, metrics.current.get(), parser=pooled_parser))
+    # the response is parsed as it's received (or, if it's large, read whole
+    # and parsed in the transform pool)
+    parse = pooled_parser(data)
+    response = post_teragon(url, data, stream=True)
+    received = []
+
+    def chunks():
+        for chunk in response.iter_content(chunk_size=65536):
+            received.append(len(chunk))
+            yield chunk
+
+    try:
+        with stage("csv"):
+            if parse is not None:
+                matrix = parse(b"".join(chunks()), response.encoding or 'utf-8')
+            else:
+                matrix = RainfallMatrix.from_csv(
+                    decode_lines(chunks(), response.encoding or 'utf-8'))
+    except requests.Timeout:
+        abort(504, message="The Teragon rainfall service did not respond in time.")
+    except requests.RequestException:
+        abort(502, message="The Teragon rainfall service could not be reached.")
+    except (ValueError, csv.Error):
+        abort(502, message="The Teragon rainfall service sent a response that could not be read.")
+    finally:
+        response.close()
+    record_bytes(sum(received))
+    return matrix
+
+
+def matrix_from_teragon(url, data):
+    """get the data for a payload from the Teragon service. Large payloads are
+    split into smaller requests that are made concurrently.
+
+    Arguments:
+        url {str} -- Teragon API endpoint
+        data {dict} -- request payload
+
+    Returns:
+        {RainfallMatrix} -- the Teragon table
+    """
+    parallelism = application.config['FANOUT_PARALLELISM']
+    fetch_all = None
+    if engine is not None:
+        timings = metrics.current.get()
+        fetch_all = lambda payloads: wait_upstream(
+            engine.fetch_all(url, payloads, parallelism, timings, parser=pooled_parser))
+    with reserved(data):
+        matrix = fan_out(
+            lambda payload: request_teragon(url, payload),
+            data,
+            max_steps=application.config['FANOUT_MAX_STEPS'],
+            max_ids=application.config['FANOUT_MAX_IDS'],
+            parallelism=parallelism,
+            fetch_all=fetch_all
+        )
+    ingest_log.record(url, data['interval'], matrix)
+    return matrix
+
+
+def coalesced(key, fn):
+    """call fn, sharing the call with any concurrent requests for the same
+    key (see the COALESCE setting)
+
+    Arguments:
+        key {tuple} -- identifies the work, e.g. a normalized payload
+        fn {function} -- does the work
+
+    Returns:
+        {object} -- the result of fn, possibly shared with other requests
+    """
+    if not application.config['COALESCE']:
+        return fn()
+    return flights.do(key, fn)
+
+
+def is_live(data):
+    """check whether a payload is for a recent ("live") window, i.e. one that
+    reaches the current hour
+
+    Arguments:
+        data {dict} -- request payload
+
+    Returns:
+        {bool}
+    """
+    now = datetime_last24hours()[1]
+    return payload_window(data)[1] >= datetime(now.year, now.month, now.day, now.hour)
+
+
+def live_entry(url, data):
+    """get the live cache's entry for a payload
+
+    Arguments:
+        url {str} -- Teragon API endpoint
+        data {dict} -- request payload
+
+    Returns:
+        {object} -- the cached window, or None if the payload isn't for a live
+        window (or the cache is disabled)
+    """
+    if live_cache is None or not is_live(data):
+        return None
+    return live_cache.get(url, data)
+
+
+def fetch_matrix(url, data):
+    """get the data for a Teragon payload, from the live cache for recent
+    windows
+
+    Arguments:
+        url {str} -- Teragon API endpoint
+        data {dict} -- request payload
+
+    Returns:
+        {RainfallMatrix} -- the requested data, which must not be modified
+    """
+    entry = live_entry(url, data)
+    if entry is not None:
+        return entry.matrix
+    return fetch_shared_matrix(url, data)
+
+
+def fetch_shared_matrix(url, data):
+    """get the data for a Teragon payload; concurrent requests for the same
+    data share a single fetch
+
+    Arguments:
+        url {str} -- Teragon API endpoint
+        data {dict} -- request payload
+
+    Returns:
+        {RainfallMatrix} -- the requested data, which must not be modified
+    """
+    return coalesced(
+        ("matrix", url) + payload_key(data),
+        lambda: fetch_stored_matrix(url, data)
+    )
+
+
+def fetch_stored_matrix(url, data):
+    """get the data for a Teragon payload, using the local store for
+    historical data: only the parts of the requested window that aren't stored
+    yet are requested from Teragon, and are then written to the store.
+
+    Arguments:
+        url {str} -- Teragon API endpoint
+        data {dict} -- request payload
+
+    Returns:
+        {RainfallMatrix} -- the requested data
+    """
+    kind, ids = payload_ids(data)
+    start, end = payload_window(data)
+    interval, zerofill = data['interval'], bool(data['zerofill'])
+
+    if not store or not ids or start >= end or not store.covers(interval, start, end):
+        return matrix_from_teragon(url, data)
+
+    missing = store.missing(kind, interval, zerofill, ids, start, end)
+
+    # fill in the gaps (the whole window, if nothing is stored yet), then read
+    # the settled part of the window from the store and add the (always
+    # requested) recent part to it. The settled part is read back even when
+    # it was just fetched, so that a window gets the same answer whether or
+    # not it was already stored.
+    until = min(max(store.settled_until(interval), start), end)
+    recent = []
+    for a, b in missing:
+        matrix = matrix_from_teragon(url, payload_with_window(data, a, b))
+        store.write(kind, interval, zerofill, matrix, a, b)
+        if b > until:
+            recent.append(matrix
+                .take_rows(max(a, until).isoformat(), b.isoformat())
+                .take_columns(ids))
+    return RainfallMatrix.vstack(
+        [store.read(kind, interval, zerofill, ids, start, until)] + recent)
+
+
+def apply_aggregations(matrix, aggregations):
+    """apply a request's aggregations to its data, in order
+
+    Arguments:
+        matrix {RainfallMatrix} -- the data
+        aggregations {list} -- functions aggregating the data, or None
+
+    Returns:
+        {RainfallMatrix} -- the aggregated data
+    """
+    if not aggregations:
+        return matrix
+    with stage("aggregate"):
+        for aggregate in aggregations:
+            matrix = aggregate(matrix)
+    return matrix
+
+
+def etl_data_from_teragon(url, data, tranpose, indexed, aggregations=None):
+    """handles getting the data (from the local store or the Teragon service)
+    and transforming it
+
+    Arguments:
+        url {str} -- Teragon API endpoint
+        data {dict} -- request payload (always sent as data via POST)
+        tranpose {bool} --  transpose the resulting table (default: False)
+        aggregations {list} -- functions aggregating the data, applied in
+        order (default: None)
+
+    Returns:
+        {dict} -- Teragon API response transformed into a nested dictionary, ready to be transmitted as JSON
+    """
+    entry = live_entry(url, data)
+
+    def transform():
+        # get the data
+        matrix = entry.matrix if entry is not None else fetch_matrix(url, data)
+        matrix = apply_aggregations(matrix, aggregations)
+
+        # post-process and return the response (large tables are rendered
+        # and serialized in the transform pool)
+        start_time = timeit.default_timer()
+        if pooled(matrix.nrows * matrix.ncols):
+            result = in_workers(
+                transform_pool.render_json, matrix, tranpose, indexed, json_settings())
+        else:
+            with stage("transpose" if tranpose else "transform"):
+                if indexed:
+                    result = matrix.to_indexed(by_location=tranpose)
+                else:
+                    result = matrix.to_records(by_location=tranpose)
+        elapsed = timeit.default_timer() - start_time
+        application.logger.debug("data processed in %.3f seconds", elapsed)
+        return result
+
+    # concurrent identical requests also share the transformed data (the
+    # aggregations can't be compared, so aggregated requests only share the
+    # data they're computed from)
+    if aggregations:
+        result = transform()
+    else:
+        shared = lambda: coalesced(
+            ("transform", url, tranpose, indexed) + payload_key(data),
+            transform
+        )
+        # live windows keep their rendered responses until they're refreshed
+        if entry is not None:
+            result = live_cache.render(entry, (tranpose, indexed), shared)
+        else:
+            result = shared()
+    # a body rendered in the transform pool is already serialized
+    if isinstance(result, bytes):
+        return Response(result, mimetype="application/json")
     return result
 
+
+def features_data_from_teragon(url, data, args, templates):
+    """handles getting the data and embedding it in the features of a geojson
+    layer: the total (or aggregate) for the request's window, or a series if
+    a bucket is given
+
+    Arguments:
+        url {str} -- Teragon API endpoint
+        data {dict} -- request payload (always sent as data via POST)
+        args {obj} -- Flask-Restful args parser object
+        templates {FeatureTemplates} -- the layer
+
+    Returns:
+        {Response} -- the FeatureCollection
+    """
+    # a single value per location, unless buckets were asked for
+    if not args['bucket']:
+        args['bucket'] = "total"
+    matrix = apply_aggregations(
+        fetch_matrix(url, data), [parse_resample_args(args, data)])
+
+    start_time = timeit.default_timer()
+    with stage("serialize"):
+        body = templates.render(matrix, series=args['bucket'] != "total")
+    elapsed = timeit.default_timer() - start_time
+    application.logger.debug("features assembled in %.3f seconds", elapsed)
+    return Response(body, mimetype="application/geo+json")
+
+
+def parse_format_args(args):
+    """handles the format argument, falling back to the request's Accept
+    header, and then to JSON. Only the formats whose library is installed are
+    offered for the Accept header; asking for another one with the format
+    argument is an error.
+
+    Arguments:
+        args {obj} -- Flask-Restful args parser object
+
+    Returns:
+        {str} -- the response format
+    """
+    if args['format']:
+        fmt = args['format']
+    else:
+        offered = ["application/json"] + [
+            m for f in ["arrow", "parquet", "msgpack"] if formats.available(f)
+            for m in formats.MIMETYPES[f]]
+        best = request.accept_mimetypes.best_match(offered, default="application/json")
+        fmt = next(
+            (f for f, mimetypes in formats.MIMETYPES.items() if best in mimetypes),
+            "json"
+        )
+    if fmt in formats.MIMETYPES and not formats.available(fmt):
+        abort(406, message="The {0} format requires {1}, which is not installed on this server.".format(
+            fmt, formats.REQUIRES[fmt]))
+    return fmt
+
+
+def binary_data_from_teragon(url, data, fmt, aggregations=None):
+    """like etl_data_from_teragon, but encodes the data in a binary, columnar
+    format straight from the matrix
+
+    Arguments:
+        url {str} -- Teragon API endpoint
+        data {dict} -- request payload (always sent as data via POST)
+        fmt {str} -- "arrow", "parquet", or "msgpack"
+        aggregations {list} -- functions aggregating the data, applied in
+        order (default: None)
+
+    Returns:
+        {Response} -- the encoded data
+    """
+    entry = live_entry(url, data)
+
+    def encode():
+        matrix = entry.matrix if entry is not None else fetch_matrix(url, data)
+        matrix = apply_aggregations(matrix, aggregations)
+        start_time = timeit.default_timer()
+        if pooled(matrix.nrows * matrix.ncols):
+            body = in_workers(transform_pool.encode, matrix, fmt)
+        else:
+            with stage("serialize"):
+                body = formats.encode(matrix, fmt)
+        elapsed = timeit.default_timer() - start_time
+        application.logger.debug("data encoded as %s in %.3f seconds", fmt, elapsed)
+        return body
+
+    if entry is not None and not aggregations:
+        body = live_cache.render(entry, (fmt,), encode)
+    else:
+        body = encode()
+    return Response(body, mimetype=formats.MIMETYPES[fmt][0])
+
+
+def streams_from_teragon(data):
+    """check whether a payload's data can be streamed straight from Teragon's
+    response as it arrives: that's the case if it takes a single request (it
+    isn't fanned out), it isn't for a live window (which is served from the
+    live cache), and the local store holds none of it. Data streamed this way
+    isn't written to the store.
+
+    Arguments:
+        data {dict} -- request payload
+
+    Returns:
+        {bool}
+    """
+    split = split_payload(
+        data,
+        max_steps=application.config['FANOUT_MAX_STEPS'],
+        max_ids=application.config['FANOUT_MAX_IDS']
+    )
+    if len(split) > 1 or len(split[0][2]) > 1:
+        return False
+    if live_cache is not None and is_live(data):
+        return False
+
+    kind, ids = payload_ids(data)
+    start, end = payload_window(data)
+    interval, zerofill = data['interval'], bool(data['zerofill'])
+    if not store or not ids or start >= end or not store.covers(interval, start, end):
+        return True
+    return store.missing(kind, interval, zerofill, ids, start, end) == [(start, end)]
+
+
+def is_chunked(data, tranpose, aggregations):
+    """check whether a request is large enough to be fetched and streamed in
+    chunks of time, rather than held in memory whole. Only data keyed by time
+    and not aggregated can be chunked.
+
+    Arguments:
+        data {dict} -- request payload
+        tranpose {bool} -- key the data by location rather than time
+        aggregations {list} -- functions aggregating the data, or None
+
+    Returns:
+        {bool}
+    """
+    return (
+        not tranpose and not aggregations and
+        payload_cells(data) > application.config['CHUNK_CELLS']
+    )
+
+
+def chunked_rows(url, data, ordered):
+    """get the data for a payload one window of time at a time, each window
+    holding at most CHUNK_CELLS values; a window is only fetched once the rows
+    of the previous one have been consumed
+
+    Arguments:
+        url {str} -- Teragon API endpoint
+        data {dict} -- request payload
+        ordered {bool} -- iterate over each window's rows in sorted order
+
+    Returns:
+        {tuple} -- (ids, generator of (timestamp, values))
+    """
+    ids = payload_ids(data)[1]
+    windows = [
+        (a, b, payloads[0]) for a, b, payloads in split_payload(
+            data,
+            max_steps=max(application.config['CHUNK_CELLS'] // len(ids), 1),
+            max_ids=len(ids)
+        )
+    ]
+    # the first window is fetched right away, for its ids (and any errors)
+    first = fetch_matrix(url, windows[0][2])
+    inner = list(first.ids)
+
+    def rows(matrix):
+        for k, (a, b, payload) in enumerate(windows):
+            if k:
+                matrix = fetch_matrix(url, payload).take_columns(inner)
+            # rows past the end of a window (in case Teragon includes the end
+            # of the window) are dropped, except for the last one
+            if k < len(windows) - 1:
+                matrix = matrix.take_rows(a.isoformat(), b.isoformat())
+            for row in matrix.iter_rows(ordered=ordered)[1]:
+                yield row
+
+    return inner, rows(first)
+
+
+def matrix_response(matrix, fmt, tranpose, indexed):
+    """render data that's already at hand in any of the response formats
+
+    Arguments:
+        matrix {RainfallMatrix} -- the data
+        fmt {str} -- the response format
+        tranpose {bool} -- key the data by location rather than time
+        indexed {bool} -- use the indexed format rather than records
+
+    Returns:
+        {dict or Response} -- the response
+    """
+    large = pooled(matrix.nrows * matrix.ncols)
+    if fmt in formats.MIMETYPES:
+        if large:
+            body = in_workers(transform_pool.encode, matrix, fmt)
+        else:
+            with stage("serialize"):
+                body = formats.encode(matrix, fmt)
+        return Response(body, mimetype=formats.MIMETYPES[fmt][0])
+    if fmt in ["json-stream", "ndjson"]:
+        inner, rows = matrix.iter_rows(by_location=tranpose, ordered=indexed)
+        return Response(
+            stream_with_context(json_chunks(inner, rows, indexed, fmt == "ndjson")),
+            mimetype="application/x-ndjson" if fmt == "ndjson" else "application/json"
+        )
+    if large:
+        body = in_workers(
+            transform_pool.render_json, matrix, tranpose, indexed, json_settings())
+        return Response(body, mimetype="application/json")
+    with stage("transpose" if tranpose else "transform"):
+        if indexed:
+            return matrix.to_indexed(by_location=tranpose)
+        return matrix.to_records(by_location=tranpose)
+
+
+def event_payload(event, kind, interval):
+    """the Teragon payload for all of an event's GARR or rain gauge data
+
+    Arguments:
+        event {dict} -- the event, from the catalog
+        kind {str} -- "garr" or "gauge"
+        interval {str} -- "Daily", "Hourly", or "15-minute"
+
+    Returns:
+        {dict} -- the payload
+    """
+    payload = {"interval": interval, "zerofill": ''}
+    if kind == "garr":
+        payload['pixels'] = all_pixels_arg
+    else:
+        payload['gauges'] = [x for x in range(1, 34)]
+    return payload_with_window(payload, event['start'], event['end'])
+
+
+def fetch_event_matrix(kind, event, interval):
+    """get all of an event's GARR or rain gauge data, from Teragon (or the
+    local store)
+
+    Arguments:
+        kind {str} -- "garr" or "gauge"
+        event {dict} -- the event, from the catalog
+        interval {str} -- "Daily", "Hourly", or "15-minute"
+
+    Returns:
+        {RainfallMatrix} -- the data
+    """
+    url = application.config['URL_GARR' if kind == "garr" else 'URL_GAGE']
+    return fetch_matrix(url, event_payload(event, kind, interval))
+
+
+def event_info(event):
+    """an event from the catalog, as JSON, with its precomputed datasets
+
+    Arguments:
+        event {dict} -- the event
+
+    Returns:
+        {dict}
+    """
+    return {
+        "id": event['id'],
+        "label": event['label'],
+        "report": event['report'],
+        "start": event['start'].isoformat(),
+        "end": event['end'].isoformat(),
+        "datasets": [
+            {"kind": kind, "interval": interval}
+            for kind, interval in event_store.datasets(event['id'])
+        ],
+    }
+
+
+def stream_data_from_teragon(url, data, tranpose, indexed, ndjson=False, aggregations=None):
+    """like etl_data_from_teragon, but returns a response that is streamed to
+    the client one timestamp (or location) at a time. Data keyed by time is
+    streamed straight from Teragon's response where possible, or fetched in
+    chunks if it's large; otherwise (or if keyed by location) it's streamed
+    once all of it has been received.
+
+    Arguments:
+        url {str} -- Teragon API endpoint
+        data {dict} -- request payload
+        tranpose {bool} -- key the data by location rather than time
+        indexed {bool} -- use the indexed format rather than records
+        ndjson {bool} -- stream newline-delimited JSON with one timestamp (or
+        location) per line, rather than a single JSON document
+        aggregations {list} -- functions aggregating the data, applied in
+        order (default: None)
+
+    Returns:
+        {Response} -- a streamed JSON or NDJSON response
+    """
+    release = None
+    if not tranpose and not aggregations and streams_from_teragon(data):
+        release = reserve(data)
+        try:
+            response = post_teragon(url, data, stream=True)
+        except Exception:
+            release()
+            raise
+        inner, rows = iter_csv(response.iter_lines(decode_unicode=True))
+        # the newest data of each location, noted as the rows pass through
+        received = {}
+        rows = watch_rows(inner, rows, received)
+
+        def chunks():
+            try:
+                for chunk in json_chunks(inner, rows, indexed, ndjson):
+                    yield chunk
+            finally:
+                response.close()
+                ingest_log.record_latest(url, data['interval'], received)
+        chunks = chunks()
+    elif is_chunked(data, tranpose, aggregations):
+        inner, rows = chunked_rows(url, data, ordered=indexed)
+        chunks = json_chunks(inner, rows, indexed, ndjson)
+    else:
+        matrix = apply_aggregations(fetch_matrix(url, data), aggregations)
+        inner, rows = matrix.iter_rows(by_location=tranpose, ordered=indexed)
+        chunks = json_chunks(inner, rows, indexed, ndjson)
+
+    streamed = Response(
+        stream_with_context(chunks),
+        mimetype="application/x-ndjson" if ndjson else "application/json"
+    )
+    # the budget is held until Teragon's response has been streamed through
+    if release is not None:
+        streamed.call_on_close(release)
+    return streamed
+
+
 # ----------------------------------------------------------------------------
 # REST API Arguments
 # define parsers/validation for all types of request params
@@ -441,6 +1592,29 @@ def etl_data_from_teragon(url, data, tranpose, indexed):
 # into the request functions. We'll likely clean most of this up in the future.
 
 
+def coordinates(count):
+    """reqparse type for a comma-delimited list of count numbers, e.g., a
+    "lon,lat" point
+    """
+    def parse(value):
+        values = [float(v) for v in str(value).split(",")]
+        if len(values) != count or not all(map(math.isfinite, values)):
+            raise ValueError("expected {0} comma-delimited numbers".format(count))
+        return values
+    return parse
+
+
+def geojson(value):
+    """reqparse type for GeoJSON, either as an object (in a JSON body) or as a
+    string
+    """
+    if isinstance(value, str):
+        value = json.loads(value)
+    if not isinstance(value, dict):
+        raise ValueError("expected a GeoJSON object")
+    return value
+
+
 parser = reqparse.RequestParser()
 
 parser.add_argument(
@@ -452,6 +1626,21 @@ parser.add_argument(
              "Upper Allegheny River", "Shallow-Cut Monongahela River", "Thompson Run/Turtle Creek", "all_pixels", "", None],
     help='Basin for which to get rainfall data. This is effectively a shortcut for the ids parameter. Defaults to all basins. If ids are specified in the ids parameter, this parameter will be ignored.',
     required=False)
+parser.add_argument(
+    'point',
+    type=coordinates(2),
+    help='Select the GARR pixel containing a point, given as "lon,lat". Ignored if ids are specified.',
+    required=False)
+parser.add_argument(
+    'bbox',
+    type=coordinates(4),
+    help='Select the GARR pixels whose centroids fall within a bounding box, given as "minlon,minlat,maxlon,maxlat". Ignored if ids are specified.',
+    required=False)
+parser.add_argument(
+    'polygon',
+    type=geojson,
+    help='Select the GARR pixels whose centroids fall within a GeoJSON Polygon or MultiPolygon (or a Feature or FeatureCollection of them). Ignored if ids are specified.',
+    required=False)
 parser.add_argument(
     'dates',
     type=str,
@@ -482,6 +1671,58 @@ parser.add_argument(
     default="time",
     required=False
 )
+parser.add_argument(
+    'bucket',
+    type=str,
+    help='Aggregate the data into time buckets of this ISO 8601 duration (e.g., "PT6H" or "P1D"), or "total" for a single bucket covering the whole request.',
+    required=False
+)
+parser.add_argument(
+    'agg',
+    type=str,
+    help='How data is aggregated into buckets: "sum" (default), "max", or "mean".',
+    choices=AGGREGATES + ["", None],
+    default="sum",
+    required=False
+)
+parser.add_argument(
+    'intensity',
+    type=str,
+    help='Return the peak rainfall over any window of this ISO 8601 duration (e.g., "PT1H") within each bucket, i.e., the maximum intensity.',
+    required=False
+)
+parser.add_argument(
+    'basin_agg',
+    type=str,
+    help='Aggregate GARR pixels by basin, returning a series per basin instead of per pixel: "mean", "total", or "max". Only applies to GARR requests.',
+    choices=BASIN_AGGREGATES + ["", None],
+    required=False
+)
+parser.add_argument(
+    'format',
+    type=str,
+    help='Response format: "json" (default), "json-stream" (the same JSON, streamed as it is produced), "ndjson" (streamed newline-delimited JSON, one timestamp or location per line), or a binary table: "arrow" (Arrow IPC stream), "parquet", or "msgpack". If not given, the format is negotiated from the Accept header.',
+    choices=["json", "json-stream", "ndjson", "arrow", "parquet", "msgpack", "", None],
+    required=False
+)
+parser.add_argument(
+    'page_size',
+    type=inputs.positive,
+    help='Paginate the response, with this many time steps per page (or, if keyed by location, this many locations). The cursor of the next page is returned in the X-Next-Cursor header, and a link to it in the Link header.',
+    required=False
+)
+parser.add_argument(
+    'cursor',
+    type=str,
+    help='Get the page of a paginated response that this cursor (from the X-Next-Cursor header) points to; the other parameters must be the same as for the first page.',
+    required=False
+)
+parser.add_argument(
+    'since',
+    type=str,
+    help='Only get the time steps from this ISO 8601 date-time on: pass the X-Watermark header of the previous response to get only the data that is new or may have been revised since.',
+    required=False
+)
 parser.add_argument(
     'geom',
     type=str,
@@ -501,7 +1742,6 @@ class Gage(Resource):
 
         # get the request args
         args = parser.parse_args()
-        # print(args)
 
         # assemble the payload
         payload = parse_common_teragon(args)
@@ -511,7 +1751,6 @@ class Gage(Resource):
             ids = [x for x in range(1, 34)]
         else:
             ids = parse_gauge_ids(args['ids'].split(","))
-        # print(ids)
         payload['gauges'] = ids
 
         # handle the keyed_by parameter
@@ -528,15 +1767,49 @@ class Gage(Resource):
                 # default is data keyed by time, same as Teragon API
                 tranpose = False
 
-        print("\nrequest {0}\npayload".format(
-            datetime.now().isoformat()), payload)
+        # handle polling, then pagination: the rest of the request is for a
+        # single page
+        payload, since = parse_since_args(args, payload)
+        payload, trim = parse_page_args(args, payload, by_location=tranpose)
+        label_request(payload)
+        admit(payload)
+        mark_watermark(application.config['URL_GAGE'], payload)
+
+        # handle temporal aggregation
+        aggregations = [f for f in [
+            since,
+            trim,
+            parse_resample_args(args, payload)
+        ] if f]
+
+        # return a binary table, if requested
+        fmt = parse_format_args(args)
+        if fmt in formats.MIMETYPES:
+            return binary_data_from_teragon(
+                application.config['URL_GAGE'],
+                data=payload,
+                fmt=fmt,
+                aggregations=aggregations
+            )
+
+        # stream the response, if requested or if it's large
+        if fmt in ["json-stream", "ndjson"] or is_chunked(payload, tranpose, aggregations):
+            return stream_data_from_teragon(
+                application.config['URL_GAGE'],
+                data=payload,
+                tranpose=tranpose,
+                indexed=application.config['INDEXED'],
+                ndjson=fmt == "ndjson",
+                aggregations=aggregations
+            )
 
         # make the request and return the response
         return etl_data_from_teragon(
             application.config['URL_GAGE'],
             data=payload,
             tranpose=tranpose,
-            indexed=application.config['INDEXED']
+            indexed=application.config['INDEXED'],
+            aggregations=aggregations
         )
 
 
@@ -545,14 +1818,37 @@ class GagePoint(Resource):
     @swag_from('apidocs/apidocs-gagepoint-get.yaml')
     def get(self):
 
-        # load geojson reference file from disk and return it as python dict
-        pixel_json_file_path = os.path.join(os.path.dirname(
-            os.path.abspath(__file__)), "data", "gauges.geojson")
-        with open(pixel_json_file_path) as f:
-            pixel_json = json.load(f)
-            return pixel_json
+        # return the pre-serialized geojson reference layer
+        return static_layer_response(static_layers["gauges.geojson"])
 
-        return None
+
+class GageFeatures(Resource):
+    @swag_from('apidocs/apidocs-gagefeatures-get.yaml')
+    def get(self):
+
+        # get the request args
+        args = parser.parse_args()
+
+        # assemble the payload
+        payload = parse_common_teragon(args)
+
+        # handle the ids parameter; default to all if not provided
+        if not args['ids']:
+            ids = [x for x in range(1, 34)]
+        else:
+            ids = parse_gauge_ids(args['ids'].split(","))
+        payload['gauges'] = ids
+
+        label_request(payload)
+        admit(payload)
+
+        # make the request and return the gauges with their data
+        return features_data_from_teragon(
+            application.config['URL_GAGE'],
+            data=payload,
+            args=args,
+            templates=feature_templates["gauges.geojson"]
+        )
 
 
 class Garr(Resource):
@@ -561,7 +1857,6 @@ class Garr(Resource):
 
         # get the request args
         args = parser.parse_args()
-        # print(args)
 
         # assemble the payload
         payload = parse_common_teragon(args)
@@ -571,9 +1866,6 @@ class Garr(Resource):
         pixels = parse_pixel_basin_args(args)
         payload['pixels'] = pixels
 
-        print("\nrequest {0}\npayload".format(
-            datetime.now().isoformat()), payload)
-
         # handle the keyed_by parameter
         if not args['keyed_by'] or (args['keyed_by'] not in ["time", "location"]):
             # default is data keyed by time, same as Teragon API
@@ -588,22 +1880,145 @@ class Garr(Resource):
                 # default is data keyed by time, same as Teragon API
                 tranpose = False
 
+        # handle polling, then pagination: the rest of the request is for a
+        # single page (basins can't be split across pages, so they're paged
+        # over time)
+        payload, since = parse_since_args(args, payload)
+        payload, trim = parse_page_args(
+            args, payload, by_location=tranpose and not args['basin_agg'])
+        label_request(payload)
+        admit(payload)
+        mark_watermark(application.config['URL_GARR'], payload)
+
+        # handle aggregation by basin, then over time
+        aggregations = [f for f in [
+            since,
+            trim,
+            parse_basin_agg_args(args),
+            parse_resample_args(args, payload)
+        ] if f]
+
+        # return a binary table, if requested
+        fmt = parse_format_args(args)
+        if fmt in formats.MIMETYPES:
+            return binary_data_from_teragon(
+                application.config['URL_GARR'],
+                data=payload,
+                fmt=fmt,
+                aggregations=aggregations
+            )
+
+        # stream the response, if requested or if it's large
+        if fmt in ["json-stream", "ndjson"] or is_chunked(payload, tranpose, aggregations):
+            return stream_data_from_teragon(
+                application.config['URL_GARR'],
+                data=payload,
+                tranpose=tranpose,
+                indexed=application.config['INDEXED'],
+                ndjson=fmt == "ndjson",
+                aggregations=aggregations
+            )
+
         # make the request and return the response
         return etl_data_from_teragon(
             application.config['URL_GARR'],
             data=payload,
             tranpose=tranpose,
-            indexed=application.config['INDEXED']
+            indexed=application.config['INDEXED'],
+            aggregations=aggregations
+        )
+
+
+class GarrFeatures(Resource):
+    @swag_from('apidocs/apidocs-garrfeatures-post.yaml')
+    def post(self):
+
+        # get the request args
+        args = parser.parse_args()
+
+        # assemble the payload
+        payload = parse_common_teragon(args)
+
+        # handle the pixels or basin parameters
+        payload['pixels'] = parse_pixel_basin_args(args)
+
+        # the data is embedded in the grid, so it can't be aggregated by basin
+        if args['basin_agg']:
+            abort(400, message="basin_agg can't be used with the grid; use the garrd endpoint instead.")
+
+        label_request(payload)
+        admit(payload)
+
+        # handle the geom argument; default to polygon
+        if args['geom'] == "point":
+            pixel_json_file_name = "grid_centroids.geojson"
+        else:
+            pixel_json_file_name = "grid.geojson"
+
+        # make the request and return the grid with its data
+        return features_data_from_teragon(
+            application.config['URL_GARR'],
+            data=payload,
+            args=args,
+            templates=feature_templates[pixel_json_file_name]
         )
 
 
+class Events(Resource):
+    @swag_from('apidocs/apidocs-events-get.yaml')
+    def get(self):
+
+        # the catalog of events
+        return {"events": [event_info(e) for e in event_store.events.values()]}
+
+
+class Event(Resource):
+    @swag_from('apidocs/apidocs-event-get.yaml')
+    def get(self, event_id):
+
+        if event_id not in event_store.events:
+            abort(404, message="There is no event {0}.".format(event_id))
+
+        # the event, with its precomputed summary (if it's been built)
+        result = event_info(event_store.events[event_id])
+        result['summary'] = event_store.summary(event_id)
+        return result
+
+
+class EventData(Resource):
+    @swag_from('apidocs/apidocs-eventdata-get.yaml')
+    def get(self, event_id, kind):
+
+        if event_id not in event_store.events:
+            abort(404, message="There is no event {0}.".format(event_id))
+        kind = "garr" if kind == "garrd" else "gauge"
+
+        # get the request args
+        args = parser.parse_args()
+        if args['interval'] not in ["Daily", "Hourly", "15-minute"]:
+            interval = "Hourly"
+        else:
+            interval = args['interval']
+        tranpose = args['keyed_by'] == "location"
+        fmt = parse_format_args(args)
+
+        # serve the precomputed dataset; if it hasn't been built, get the
+        # data as for any other request
+        matrix = event_store.dataset(event_id, kind, interval)
+        if matrix is None:
+            payload = event_payload(event_store.events[event_id], kind, interval)
+            label_request(payload)
+            admit(payload)
+            matrix = fetch_event_matrix(kind, event_store.events[event_id], interval)
+        return matrix_response(matrix, fmt, tranpose, application.config['INDEXED'])
+
+
 class GarrGrid(Resource):
     @swag_from('apidocs/apidocs-garrgrid-get.yaml')
     def get(self):
 
         # get the request args
         args = parser.parse_args()
-        # print(args)
 
         # handle the geom argument; default to polygon
         if args['geom'] not in ["point", "polygon"]:
@@ -617,28 +2032,94 @@ class GarrGrid(Resource):
         elif shape == "point":
             pixel_json_file_name = "grid_centroids.geojson"
 
-        # load geojson reference file from disk and return it as python dict
-        pixel_json_file_path = os.path.join(os.path.dirname(
-            os.path.abspath(__file__)), "data", pixel_json_file_name)
-        with open(pixel_json_file_path) as f:
-            pixel_json = json.load(f)
-            return pixel_json
-
-        return None
+        # return the pre-serialized geojson reference layer
+        return static_layer_response(static_layers[pixel_json_file_name])
 
 
 # ----------------------------------------------------------------------------
 # ROUTES
 
+@application.before_request
+def start_timings():
+    timings = metrics.RequestTimings()
+    timings.labels["endpoint"] = request.url_rule.rule if request.url_rule else "unmatched"
+    g.timings_token = metrics.current.set(timings)
+    if application.config['PROFILE_DIR']:
+        g.profile = cProfile.Profile()
+        g.profile.enable()
+
+
+@application.after_request
+def keep_status(response):
+    g.status = response.status_code
+    return response
+
+
+@application.teardown_request
+def record_timings(exc=None):
+    timings = metrics.current.get()
+    if timings is None:
+        return
+    metrics.current.reset(g.timings_token)
+    status = getattr(g, "status", 500)
+    request_metrics.record(timings, status)
+
+    profile = getattr(g, "profile", None)
+    if profile is not None:
+        profile.disable()
+    elapsed = timings.elapsed()
+    slow = application.config['SLOW_REQUEST_SECONDS']
+    if slow is not None and elapsed > slow:
+        application.logger.warning(
+            "slow request (%.2f seconds): %s %s %s",
+            elapsed, request.method, request.full_path, timings.summary())
+        if profile is not None:
+            os.makedirs(application.config['PROFILE_DIR'], exist_ok=True)
+            profile.dump_stats(os.path.join(
+                application.config['PROFILE_DIR'],
+                "{0}-{1}.prof".format(datetime.now().strftime("%Y%m%dT%H%M%S%f"), status)))
+
+
+@api.representation('application/json')
+def timed_output_json(data, code, headers=None):
+    with stage("serialize"):
+        return output_json(data, code, headers)
+
+
 @application.route('/', methods=['GET'])
 def home():
     return redirect('/apidocs/', code=302)
 
 
+@application.route('/metrics', methods=['GET'])
+def metrics_text():
+    return Response(request_metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 api.add_resource(Garr, '/api/garrd/')
 api.add_resource(Gage, '/api/gauge/')
 api.add_resource(GarrGrid, '/api/garrd/geojson')
 api.add_resource(GagePoint, '/api/gauge/geojson')
+api.add_resource(GarrFeatures, '/api/garrd/features')
+api.add_resource(GageFeatures, '/api/gauge/features')
+api.add_resource(Events, '/api/events/')
+api.add_resource(Event, '/api/events/<int:event_id>')
+api.add_resource(EventData, '/api/events/<int:event_id>/<any(garrd, gauge):kind>')
+
+
+# ----------------------------------------------------------------------------
+# COMMANDS
+
+@application.cli.command("build-events")
+@click.argument("event_ids", nargs=-1, type=int)
+@click.option("--rebuild", is_flag=True, help="Rebuild datasets that are already built.")
+def build_events(event_ids, rebuild):
+    """Precompute the data and summaries of the cataloged events."""
+    for event_id in event_ids or list(event_store.events):
+        start_time = timeit.default_timer()
+        event_store.build(event_id, fetch_event_matrix, basin_index, rebuild=rebuild)
+        elapsed = timeit.default_timer() - start_time
+        application.logger.debug("event %s built in %.3f seconds", event_id, elapsed)
 
 if __name__ == "__main__":
     application.run()
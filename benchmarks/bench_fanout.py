@@ -0,0 +1,67 @@
+'''
+bench_fanout.py
+
+Compare wall-clock time of a large GARR request made as a single Teragon call
+against the same request split into concurrent sub-requests, using the local
+stub Teragon server.
+
+    python benchmarks/bench_fanout.py [dates] [interval] [per_cell]
+
+The stub models Teragon's response time as 0.5 s plus per_cell seconds (by
+default 5 microseconds) for each cell of the requested table.
+
+'''
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import application
+from stub_teragon import serve_in_background
+
+
+def run(client, query):
+    response = client.post('/api/garrd/', query_string=query)
+    assert response.status_code == 200, response.status_code
+    return response.data
+
+
+if __name__ == "__main__":
+    dates = sys.argv[1] if len(sys.argv) > 1 else "2004-09-01T00:00/2004-09-15T00:00"
+    interval = sys.argv[2] if len(sys.argv) > 2 else "15-minute"
+    per_cell = float(sys.argv[3]) if len(sys.argv) > 3 else 0.000005
+    query = {"dates": dates, "interval": interval, "basin": "all basins"}
+
+    server = serve_in_background(latency=0.5, per_cell=per_cell)
+    application.application.config['URL_GARR'] = server.url
+    application.store = None
+    client = application.application.test_client()
+    config = application.application.config
+
+    print("GARR, all basins, {0}, {1}\n".format(interval, dates))
+
+    # a single upstream call
+    config.update(FANOUT_MAX_STEPS=10 ** 9, FANOUT_MAX_IDS=10 ** 9, FANOUT_PARALLELISM=1)
+    requests_before = server.requests
+    start = timeit.default_timer()
+    single = run(client, query)
+    t_single = timeit.default_timer() - start
+    print("{0:<40} {1:8.3f} s ({2} upstream requests)".format(
+        "single call", t_single, server.requests - requests_before))
+
+    for max_steps, max_ids, parallelism in [(672, 600, 4), (336, 600, 8)]:
+        config.update(
+            FANOUT_MAX_STEPS=max_steps, FANOUT_MAX_IDS=max_ids,
+            FANOUT_PARALLELISM=parallelism)
+        requests_before = server.requests
+        start = timeit.default_timer()
+        split = run(client, query)
+        elapsed = timeit.default_timer() - start
+        assert split == single, "fanned-out response differs from the single call"
+        print("{0:<40} {1:8.3f} s ({2} upstream requests, {3:.1f} x)".format(
+            "{0} steps x {1} ids, {2} at a time".format(max_steps, max_ids, parallelism),
+            elapsed, server.requests - requests_before, t_single / elapsed))
+
+    server.shutdown()
@@ -0,0 +1,132 @@
+'''
+bench_load.py
+
+Load test of the upstream engines against the stub Teragon server: how many
+API requests per second are served as the number of concurrent clients grows,
+with each upstream request taking --latency seconds, for the asyncio engine
+("async") and blocking requests ("threads"). Each request asks for a different
+window, so none are coalesced or cached.
+
+Then, how long the asyncio engine takes to fetch --burst payloads at once, all
+in flight together.
+
+    python benchmarks/bench_load.py [--latency S] [--seconds S]
+        [--burst N] [concurrency ...]
+
+No network access is needed.
+
+'''
+
+import argparse
+import itertools
+import os
+import sys
+import threading
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+import application
+from stub_teragon import serve_in_background
+from suite import serve_app
+
+ENDPOINT = "/api/gauge/"
+
+
+def windows():
+    """a different 2-hour window for each request"""
+    start = datetime(2020, 1, 1)
+    for k in itertools.count():
+        s = start + timedelta(hours=k)
+        yield "{0}/{1}".format(
+            s.strftime("%Y-%m-%dT%H:%M"), (s + timedelta(hours=2)).strftime("%Y-%m-%dT%H:%M"))
+
+
+def measure(base, concurrency, seconds, dates):
+    """requests per second (and errors) from concurrent clients"""
+    url = base + ENDPOINT
+    local = threading.local()
+    lock = threading.Lock()
+    stop = timeit.default_timer() + seconds
+    counts = {"ok": 0, "errors": 0}
+
+    def client(_):
+        local.session = requests.Session()
+        while timeit.default_timer() < stop:
+            with lock:
+                window = next(dates)
+            response = local.session.get(url, params={"dates": window, "interval": "Hourly"})
+            with lock:
+                counts["ok" if response.status_code == 200 else "errors"] += 1
+
+    start = timeit.default_timer()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    return counts["ok"] / (timeit.default_timer() - start), counts["errors"]
+
+
+def burst(engine, url, size):
+    """seconds for the engine to fetch size payloads at once"""
+    payloads = [
+        {"startyear": 2020, "startmonth": 1, "startday": 1, "starthour": k % 24,
+         "endyear": 2020, "endmonth": 1, "endday": 2, "endhour": k % 24,
+         "interval": "Hourly", "zerofill": "yes", "gauges": [k % 30 + 1]}
+        for k in range(size)
+    ]
+    start = timeit.default_timer()
+    matrices = engine.fetch_all(url, payloads, size).result()
+    assert len(matrices) == size
+    return timeit.default_timer() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("concurrency", nargs="*", type=int, default=[1, 8, 32, 64, 128],
+                        help="numbers of concurrent clients")
+    parser.add_argument("--latency", type=float, default=0.5, help="stub latency, in seconds")
+    parser.add_argument("--seconds", type=float, default=5, help="duration of each measurement")
+    parser.add_argument("--burst", type=int, default=500, help="payloads fetched at once")
+    options = parser.parse_args()
+
+    stub = serve_in_background(latency=options.latency, per_cell=0.0, recorded=False)
+    config = application.application.config
+    config['URL_GAGE'] = config['URL_GARR'] = stub.url
+    application.store = None
+    application.live_cache = None
+    config['COALESCE'] = False
+    server, base = serve_app()
+
+    engines = [("async", application.engine), ("threads", None)]
+    dates = windows()
+    print("stub latency {0} s, {1} s per measurement\n".format(options.latency, options.seconds))
+    print("{0:>11} {1:>10} {2:>10} {3:>8}".format("concurrency", "engine", "req/s", "errors"))
+
+    # the application's own timing logs would drown the results
+    stdout = sys.stdout
+    for concurrency in options.concurrency:
+        for name, engine in engines:
+            application.engine = engine
+            sys.stdout = open(os.devnull, "w")
+            try:
+                rate, errors = measure(base, concurrency, options.seconds, dates)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            print("{0:>11} {1:>10} {2:>10.1f} {3:>8}".format(concurrency, name, rate, errors))
+    application.engine = engines[0][1]
+
+    if application.engine is not None:
+        elapsed = burst(application.engine, stub.url, options.burst)
+        print("\n{0} payloads fetched at once by the async engine in {1:.2f} s".format(
+            options.burst, elapsed))
+
+    server.shutdown()
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+'''
+bench_timestamps.py
+
+Regression benchmark for timestamp handling: converting a column of Teragon
+timestamps to ISO 8601 strings with the fixed-format parser in
+rainfall.timestamps, against dateutil's generic parser, and parsing a whole
+15-minute table. Exits with an error if the outputs differ, or if the fast
+path is less than MIN_SPEEDUP times faster.
+
+    python benchmarks/bench_timestamps.py [days]
+
+'''
+
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dateutil.parser import parse
+
+from rainfall.matrix import RainfallMatrix
+from rainfall.timestamps import to_iso_all
+from teragon_fixtures import STEPS, synthesize_csv
+
+MIN_SPEEDUP = 5
+
+
+def bench(label, fn, repeat=3):
+    best = min(timeit.repeat(fn, number=1, repeat=repeat))
+    print("{0:<40} {1:8.3f} s".format(label, best))
+    return best
+
+
+if __name__ == "__main__":
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 90
+    steps = int(timedelta(days=days) / STEPS["15-minute"])
+    start = datetime(2004, 6, 1)
+    column = [
+        (start + i * STEPS["15-minute"]).strftime("%m/%d/%Y %H:%M")
+        for i in range(steps)
+    ]
+    print("{0} days of 15-minute timestamps ({1} rows)\n".format(days, steps))
+
+    expected = [parse(t).isoformat() for t in column]
+    assert to_iso_all(column) == expected, "timestamps differ"
+    t_old = bench("dateutil", lambda: [parse(t).isoformat() for t in column])
+    t_new = bench("fixed format", lambda: to_iso_all(column))
+    speedup = t_old / t_new
+    print("{0:<40} {1:8.1f} x\n".format("speedup", speedup))
+
+    csv_text = synthesize_csv(["{0}".format(i) for i in range(1, 34)], start, steps, "15-minute")
+    print("rain gauge table, {0} rows x 33 gauges".format(steps))
+    bench("RainfallMatrix.from_csv", lambda: RainfallMatrix.from_csv(csv_text))
+
+    if speedup < MIN_SPEEDUP:
+        sys.exit("regression: the fixed-format parser is only {0:.1f} x faster than dateutil (expected {1} x)".format(
+            speedup, MIN_SPEEDUP))
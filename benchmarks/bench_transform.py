@@ -0,0 +1,109 @@
+'''
+bench_transform.py
+
+Compare the columnar transform in rainfall.matrix against the original petl
+pipeline on an all-pixels GARR response (keyed by time), and on a one-basin
+response keyed by location (petl's transpose is too slow to run on all pixels).
+
+    python benchmarks/bench_transform.py [hours]
+
+'''
+
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dateutil.parser import parse
+import petl as etl
+from sortedcontainers import SortedDict
+
+from application import transform_teragon_csv
+from teragon_fixtures import all_pixels, all_pixels_event, synthesize_csv
+
+
+def petl_transform_teragon_csv(teragon_csv, transpose=False, indexed=False):
+    """the original petl-based transform, kept for comparison"""
+    petl_table = etl.fromcsv(teragon_csv)
+    h = list(etl.header(petl_table))
+    xy_cols = zip(* [iter(h[1:])] * 2)
+    new_header = ['Timestamp']
+    fields_to_cut = []
+    for each in xy_cols:
+        id_col = each[0]
+        notes_col = "{0}-n".format(id_col)
+        new_header.extend([id_col, notes_col])
+        fields_to_cut.append(notes_col)
+    table = etl \
+        .setheader(petl_table, new_header) \
+        .cutout(*tuple(fields_to_cut))  \
+        .select('Timestamp', lambda v: v.upper() != 'TOTAL')  \
+        .convert('Timestamp', lambda t: parse(t).isoformat())  \
+        .replaceall('N/D', None)
+    if transpose:
+        table = etl.transpose(table)
+    if indexed:
+        data = SortedDict()
+        for row in etl.dicts(table):
+            inside = SortedDict()
+            for d in row.items():
+                if d[0] != 'Timestamp':
+                    if d[1]:
+                        v = float(d[1])
+                    else:
+                        v = d[1]
+                    inside[d[0]] = v
+            data[row['Timestamp']] = inside
+        return data
+    else:
+        rows = []
+        for row in etl.dicts(table):
+            data = []
+            for d in row.items():
+                if d[0] != 'Timestamp':
+                    if d[1]:
+                        v = float(d[1])
+                    else:
+                        v = d[1]
+                    data.append({'id': d[0], 'v': v})
+            rows.append({"id": row['Timestamp'], "d": data})
+        return rows
+
+
+def bench(label, fn, repeat=3):
+    best = min(timeit.repeat(fn, number=1, repeat=repeat))
+    print("{0:<40} {1:8.3f} s".format(label, best))
+    return best
+
+
+if __name__ == "__main__":
+    hours = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    csv_text = all_pixels_event(hours)
+    print("all pixels, {0} hourly rows, {1:.1f} MB of CSV\n".format(
+        hours, len(csv_text) / 1e6))
+
+    def compare(csv_text, transpose):
+        for indexed in (True, False):
+            old = petl_transform_teragon_csv(
+                etl.MemorySource(csv_text.encode()), transpose, indexed)
+            new = transform_teragon_csv(csv_text, transpose, indexed)
+            assert old == new, "outputs differ (transpose={0}, indexed={1})".format(
+                transpose, indexed)
+
+            mode = "{0}, {1}".format(
+                "by location" if transpose else "by time",
+                "indexed" if indexed else "records")
+            t_old = bench("petl, {0}".format(mode), lambda: petl_transform_teragon_csv(
+                etl.MemorySource(csv_text.encode()), transpose, indexed))
+            t_new = bench("columnar, {0}".format(mode), lambda: transform_teragon_csv(
+                csv_text, transpose, indexed))
+            print("{0:<40} {1:8.1f} x\n".format("speedup", t_old / t_new))
+
+    compare(csv_text, False)
+
+    basin = all_pixels()[:250]
+    csv_text = synthesize_csv(basin, datetime(2004, 9, 17, 3), hours)
+    print("250 pixels, {0} hourly rows, keyed by location\n".format(hours))
+    compare(csv_text, True)
@@ -0,0 +1,81 @@
+'''
+record_fixtures.py
+
+(Re)build the Teragon responses in benchmarks/fixtures, one gzipped CSV per
+entry of fixtures/manifest.json. Each entry is an API request; its Teragon
+payload is assembled the same way the API does it. With --live, responses are
+recorded from Teragon itself; otherwise they're synthesized in Teragon's
+layout, so the fixtures can be rebuilt without network access.
+
+    python benchmarks/record_fixtures.py [--live] [name ...]
+
+'''
+
+import gzip
+import json
+import os
+import sys
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+import application
+from rainfall.teragon import STEPS, payload_ids, payload_window
+from teragon_fixtures import synthesize_csv
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load_manifest():
+    with open(os.path.join(FIXTURES, "manifest.json")) as fp:
+        return json.load(fp)
+
+
+def fixture_payload(fixture):
+    """the Teragon payload the API sends for a fixture's request"""
+    with application.application.test_request_context(
+            fixture["endpoint"], method=fixture["method"], query_string=fixture["query"]):
+        args = application.parser.parse_args()
+        payload = application.parse_common_teragon(args)
+        if fixture["endpoint"].startswith("/api/gauge"):
+            ids = args['ids'].split(",") if args['ids'] else range(1, 34)
+            payload['gauges'] = application.parse_gauge_ids([str(i) for i in ids])
+        else:
+            payload['pixels'] = application.parse_pixel_basin_args(args)
+    return payload
+
+
+def fixture_url(fixture):
+    if fixture["endpoint"].startswith("/api/gauge"):
+        return application.application.config['URL_GAGE']
+    return application.application.config['URL_GARR']
+
+
+def record(name, fixture, live=False):
+    payload = fixture_payload(fixture)
+    if live:
+        response = requests.post(fixture_url(fixture), data=payload, timeout=300)
+        response.raise_for_status()
+        csv_text = response.text
+    else:
+        start, end = payload_window(payload)
+        steps = (end - start) // STEPS[payload['interval']]
+        csv_text = synthesize_csv(
+            payload_ids(payload)[1], start, steps, payload['interval'],
+            seed=zlib.crc32(name.encode()))
+    path = os.path.join(FIXTURES, name + ".csv.gz")
+    with open(path, 'wb') as f:
+        # mtime=0 keeps rebuilt fixtures byte-identical
+        f.write(gzip.compress(csv_text.encode('utf-8'), mtime=0))
+    print("{0:<28} {1:>10,} bytes of CSV -> {2}".format(
+        name, len(csv_text), os.path.relpath(path)))
+
+
+if __name__ == "__main__":
+    live = "--live" in sys.argv
+    names = [a for a in sys.argv[1:] if not a.startswith("--")]
+    manifest = load_manifest()
+    for name in names or manifest:
+        record(name, manifest[name], live)
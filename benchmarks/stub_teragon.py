@@ -0,0 +1,213 @@
+'''
+stub_teragon.py
+
+A local stand-in for Teragon's rain gauge and pixel endpoints. It answers the
+same POSTed payloads after a delay that models Teragon's response time: a
+fixed latency plus a cost per cell of the table. Payloads covered by one of
+the fixture responses in benchmarks/fixtures (synthetic, or recorded from
+Teragon with record_fixtures.py --live) are answered from it (sliced to the
+requested ids and window); other payloads get synthesized tables. Each
+request is handled in its own (forked) process, like a remote server would,
+so the stub doesn't compete with the code being measured.
+
+    python benchmarks/stub_teragon.py [port] [latency] [per_cell]
+
+'''
+
+import csv
+import glob
+import gzip
+import io
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ForkingMixIn
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rainfall.teragon import STEPS, payload_ids, payload_window
+from teragon_fixtures import window_csv
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def parse_payload(body):
+    """turn a form-encoded Teragon payload back into a payload dict"""
+    form = parse_qs(body.decode('utf-8'), keep_blank_values=True)
+    payload = {}
+    for k, v in form.items():
+        if k == 'gauges':
+            payload[k] = ",".join(v)
+        elif k.startswith('start') or k.startswith('end'):
+            payload[k] = int(v[0])
+        else:
+            payload[k] = v[0]
+    return payload
+
+
+class RecordedTable(object):
+    """a fixture Teragon response (synthetic, or recorded from Teragon)"""
+
+    def __init__(self, path):
+        with gzip.open(path, 'rt', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            self.rows = [
+                (datetime.strptime(row[0], "%m/%d/%Y %H:%M"), row)
+                for row in reader if row and row[0].upper() != 'TOTAL'
+            ]
+        self.ids = header[1::2]
+        self.columns = {c: 1 + 2 * j for j, c in enumerate(self.ids)}
+        self.kind = "garr" if "-" in self.ids[0] else "gauge"
+        step = self.rows[1][0] - self.rows[0][0]
+        self.interval = next(k for k, v in STEPS.items() if v == step)
+        self.start, self.end = self.rows[0][0], self.rows[-1][0] + step
+
+    def covers(self, kind, interval, ids, start, end):
+        return (kind, interval) == (self.kind, self.interval) \
+            and self.start <= start and end <= self.end \
+            and all(i in self.columns for i in ids)
+
+    def slice(self, ids, start, end):
+        """the table for some of the ids, over part of the window"""
+        columns = [self.columns[i] for i in ids]
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\r\n")
+        header = ["Timestamp"]
+        for i in ids:
+            header.extend([i, "{0} notes".format(i)])
+        writer.writerow(header)
+        for t, row in self.rows:
+            if start <= t < end:
+                cells = [row[0]]
+                for c in columns:
+                    cells.extend(row[c:c + 2])
+                writer.writerow(cells)
+        writer.writerow(["Total"] + ["", ""] * len(ids))
+        return out.getvalue()
+
+
+def load_recorded(folder=FIXTURES):
+    """load the fixture responses in a folder"""
+    return [RecordedTable(p) for p in sorted(glob.glob(os.path.join(folder, "*.csv.gz")))]
+
+
+class StubTeragonHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = parse_payload(self.rfile.read(length))
+        start, end = payload_window(payload)
+        kind, ids = payload_ids(payload)
+        interval = payload.get('interval') or "Hourly"
+
+        server = self.server
+        cells = len(ids) * max((end - start) // STEPS[interval], 0)
+        time.sleep(server.latency + cells * server.per_cell)
+
+        recorded = next(
+            (t for t in server.recorded if t.covers(kind, interval, ids, start, end)), None)
+        if recorded is not None:
+            body = recorded.slice(ids, start, end).encode('utf-8')
+        else:
+            body = window_csv(ids, start, end, interval).encode('utf-8')
+        with server.requests.get_lock():
+            server.requests.value += 1
+        if recorded is not None:
+            with server.replayed.get_lock():
+                server.replayed.value += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up waiting
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class StubTeragonServer(ForkingMixIn, HTTPServer):
+
+    # room for the load test's bursts of connections (by default, at most 40
+    # requests are handled at once)
+    request_queue_size = 1024
+    max_children = 1024
+
+    def __init__(self, address, latency=0.5, per_cell=0.000001, requests=None,
+                 replayed=None, recorded=True):
+        HTTPServer.__init__(self, address, StubTeragonHandler)
+        self.latency = latency
+        self.per_cell = per_cell
+        # counters shared with the forked request handlers
+        self.requests = requests or multiprocessing.Value('i', 0)
+        self.replayed = replayed or multiprocessing.Value('i', 0)
+        self.recorded = load_recorded() if recorded else []
+
+    @property
+    def url(self):
+        return "http://{0}:{1}/".format(*self.server_address)
+
+
+def _serve(port, latency, per_cell, requests, replayed, recorded, ready):
+    server = StubTeragonServer(
+        ('127.0.0.1', port), latency, per_cell, requests, replayed, recorded)
+    ready.put(server.url)
+    server.serve_forever()
+
+
+class BackgroundStub(object):
+    """a stub server running in a child process"""
+
+    def __init__(self, latency=0.5, per_cell=0.000001, port=0, recorded=True):
+        self._requests = multiprocessing.Value('i', 0)
+        self._replayed = multiprocessing.Value('i', 0)
+        ready = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=_serve,
+            args=(port, latency, per_cell, self._requests, self._replayed, recorded, ready))
+        self._process.daemon = True
+        self._process.start()
+        self.url = ready.get()
+
+    @property
+    def requests(self):
+        """the number of requests served so far"""
+        return self._requests.value
+
+    @property
+    def replayed(self):
+        """the number of requests answered from fixture responses"""
+        return self._replayed.value
+
+    def shutdown(self):
+        self._process.terminate()
+        self._process.join()
+
+
+def serve_in_background(latency=0.5, per_cell=0.000001, port=0, recorded=True):
+    """start a stub server in a child process
+
+    Arguments:
+        recorded {bool} -- answer from the fixture responses where possible
+
+    Returns:
+        {BackgroundStub} -- the running server; call shutdown() to stop it
+    """
+    return BackgroundStub(latency, per_cell, port, recorded)
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8400
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    per_cell = float(sys.argv[3]) if len(sys.argv) > 3 else 0.000001
+    server = StubTeragonServer(('127.0.0.1', port), latency, per_cell)
+    print("stub Teragon listening on {0}".format(server.url))
+    server.serve_forever()
@@ -0,0 +1,182 @@
+'''
+suite.py
+
+Offline benchmark suite: runs the API against the stub Teragon server
+(replaying the fixture responses in benchmarks/fixtures: synthetic, or
+recorded with record_fixtures.py --live), and measures each
+fixture's request in each output mode:
+
+- latency: median and 95th percentile of sequential requests over HTTP
+- throughput: requests per second with concurrent clients over HTTP
+- peak memory: peak Python allocations while handling one request
+
+By default the local store, the live cache and request coalescing are turned
+off, so that every request does the full work; --caches leaves them on.
+
+    python benchmarks/suite.py [--runs N] [--concurrency N] [--latency S]
+        [--per-cell S] [--caches] [--json results.json] [fixture ...]
+
+No network access is needed.
+
+'''
+
+import argparse
+import json
+import os
+import sys
+import threading
+import timeit
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import application
+from rainfall import formats
+from record_fixtures import load_manifest
+from stub_teragon import serve_in_background
+
+# output modes, as extra query parameters
+MODES = [
+    ("json", {}),
+    ("json by location", {"keyed_by": "location"}),
+    ("json-stream", {"format": "json-stream"}),
+    ("ndjson", {"format": "ndjson"}),
+    ("arrow", {"format": "arrow"}),
+    ("parquet", {"format": "parquet"}),
+    ("msgpack", {"format": "msgpack"}),
+]
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(int(round(share * (len(values) - 1))), len(values) - 1)]
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_request(self, *args):
+        pass
+
+
+def serve_app():
+    """serve the API over HTTP from a background thread"""
+    server = make_server(
+        '127.0.0.1', 0, application.application, threaded=True,
+        request_handler=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, "http://127.0.0.1:{0}".format(server.server_port)
+
+
+def send(session, method, url, query):
+    response = session.request(method, url, params=query)
+    assert response.status_code == 200, (url, query, response.status_code, response.text[:200])
+    return len(response.content)
+
+
+def measure_latency(base, fixture, query, runs):
+    session = requests.Session()
+    url = base + fixture["endpoint"]
+    times = []
+    for _ in range(runs):
+        start = timeit.default_timer()
+        size = send(session, fixture["method"], url, query)
+        times.append(timeit.default_timer() - start)
+    return size, percentile(times, 0.5), percentile(times, 0.95)
+
+
+def measure_throughput(base, fixture, query, runs, concurrency):
+    url = base + fixture["endpoint"]
+    local = threading.local()
+
+    def one(_):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        send(local.session, fixture["method"], url, query)
+
+    total = runs * concurrency
+    start = timeit.default_timer()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    return total / (timeit.default_timer() - start)
+
+
+def measure_memory(fixture, query):
+    client = application.application.test_client()
+    tracemalloc.start()
+    try:
+        response = client.open(fixture["endpoint"], method=fixture["method"], query_string=query)
+        # consume streamed responses
+        response.get_data()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("fixtures", nargs="*", help="fixtures to run (default: all)")
+    parser.add_argument("--runs", type=int, default=5, help="requests per measurement")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent clients")
+    parser.add_argument("--latency", type=float, default=0.1, help="stub latency, in seconds")
+    parser.add_argument("--per-cell", type=float, default=0.0, help="stub time per cell, in seconds")
+    parser.add_argument("--caches", action="store_true", help="leave the store, live cache and coalescing on")
+    parser.add_argument("--json", help="also write the results to this file")
+    options = parser.parse_args()
+
+    stub = serve_in_background(latency=options.latency, per_cell=options.per_cell)
+    config = application.application.config
+    config['URL_GAGE'] = config['URL_GARR'] = stub.url
+    if not options.caches:
+        application.store = None
+        application.live_cache = None
+        config['COALESCE'] = False
+    server, base = serve_app()
+
+    manifest = load_manifest()
+    names = options.fixtures or list(manifest)
+    print("stub latency {0} s, {1} runs, {2} concurrent clients{3}\n".format(
+        options.latency, options.runs, options.concurrency,
+        ", caches on" if options.caches else ""))
+    print("{0:<24} {1:<17} {2:>11} {3:>9} {4:>9} {5:>8} {6:>10}".format(
+        "fixture", "mode", "bytes", "p50 ms", "p95 ms", "req/s", "peak MB"))
+
+    # the application's own timing logs would drown the results
+    stdout, results = sys.stdout, []
+    for name in names:
+        fixture = manifest[name]
+        for mode, extra in MODES:
+            if extra.get("format") in formats.MIMETYPES and not formats.available(extra["format"]):
+                continue
+            query = dict(fixture["query"], **extra)
+            sys.stdout = open(os.devnull, "w")
+            try:
+                replayed = stub.replayed
+                size, p50, p95 = measure_latency(base, fixture, query, options.runs)
+                rate = measure_throughput(base, fixture, query, options.runs, options.concurrency)
+                peak = measure_memory(fixture, query)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            assert stub.replayed > replayed, "{0} wasn't answered from its recording".format(name)
+            results.append({
+                "fixture": name, "mode": mode, "bytes": size,
+                "p50": p50, "p95": p95, "throughput": rate, "peak_memory": peak,
+            })
+            print("{0:<24} {1:<17} {2:>11,} {3:>9.1f} {4:>9.1f} {5:>8.1f} {6:>10.1f}".format(
+                name, mode, size, p50 * 1000, p95 * 1000, rate, peak / 1e6))
+
+    server.shutdown()
+    stub.shutdown()
+    if options.json:
+        with open(options.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+'''
+teragon_fixtures.py
+
+Synthesize CSV responses in the layout returned by Teragon's rain gauge and
+pixel endpoints, for benchmarking without network access.
+
+'''
+
+import json
+import os
+import random
+import zlib
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STEPS = {
+    "Daily": timedelta(days=1),
+    "Hourly": timedelta(hours=1),
+    "15-minute": timedelta(minutes=15),
+}
+
+
+def all_pixels():
+    """every GARR pixel id, in "123-456" format"""
+    with open(os.path.join(ROOT, "data", "lookup_basins_revised.json")) as fp:
+        lookup = json.load(fp)
+    return [p for v in lookup.values() for p in v]
+
+
+def synthesize_csv(ids, start, steps, interval="Hourly", seed=0, blank=0.5, nodata=0.01):
+    """build a Teragon-style CSV table
+
+    Arguments:
+        ids {list} -- location ids (pixels or gauges) used as column headers
+        start {datetime} -- timestamp of the first row
+        steps {int} -- number of rows (timestamps)
+        interval {str} -- "Daily", "Hourly", or "15-minute"
+        seed {int} -- seed for the random values
+        blank {float} -- share of cells left empty (no rainfall)
+        nodata {float} -- share of cells marked 'N/D'
+
+    Returns:
+        {str} -- the CSV, including the trailing 'Total' row
+    """
+    rng = random.Random(seed)
+    step = STEPS[interval]
+    lines = []
+    header = ["Timestamp"]
+    for i in ids:
+        header.extend([i, "{0} notes".format(i)])
+    lines.append(",".join(header))
+    totals = [0.0] * len(ids)
+    t = start
+    for _ in range(steps):
+        row = [t.strftime("%m/%d/%Y %H:%M")]
+        for j in range(len(ids)):
+            r = rng.random()
+            if r < nodata:
+                row.extend(["N/D", ""])
+            elif r < nodata + blank:
+                row.extend(["", ""])
+            else:
+                v = round(rng.random() * 0.5, 4)
+                totals[j] += v
+                row.extend([str(v), ""])
+        lines.append(",".join(row))
+        t += step
+    total = ["Total"]
+    for v in totals:
+        total.extend([str(round(v, 4)), ""])
+    lines.append(",".join(total))
+    return "\r\n".join(lines) + "\r\n"
+
+
+def all_pixels_event(hours=24, interval="Hourly"):
+    """an all-pixels GARR response covering a storm event"""
+    steps = int(timedelta(hours=hours) / STEPS[interval])
+    return synthesize_csv(all_pixels(), datetime(2004, 9, 17, 3), steps, interval)
+
+
+def window_csv(ids, start, end, interval="Hourly"):
+    """build a Teragon-style CSV table for a time window, [start, end). Values
+    are a deterministic function of the location and the time, so tables for
+    overlapping requests agree with each other.
+
+    Arguments:
+        ids {list} -- location ids (pixels or gauges) used as column headers
+        start {datetime} -- start of the window
+        end {datetime} -- end of the window
+        interval {str} -- "Daily", "Hourly", or "15-minute"
+
+    Returns:
+        {str} -- the CSV, including the trailing 'Total' row
+    """
+    step = STEPS[interval]
+    hashes = [zlib.crc32(i.encode()) for i in ids]
+    header = ["Timestamp"]
+    for i in ids:
+        header.extend([i, "{0} notes".format(i)])
+    lines = [",".join(header)]
+    t = start
+    while t < end:
+        ht = zlib.crc32(t.isoformat().encode())
+        row = [t.strftime("%m/%d/%Y %H:%M")]
+        for hi in hashes:
+            x = ((hi * 2654435761) ^ (ht * 40503)) & 0xffff
+            if x % 100 < 1:
+                row.append("N/D,")
+            elif x % 100 < 50:
+                row.append(",")
+            else:
+                row.append("{0},".format((x % 1000) / 1000.0))
+        lines.append(",".join(row))
+        t += step
+    lines.append(",".join(["Total"] + ["," for i in ids]))
+    return "\r\n".join(lines) + "\r\n"
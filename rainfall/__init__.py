@@ -0,0 +1,8 @@
+'''
+rainfall
+
+Data-handling internals for the 3RWW Rainfall API: parsing and transforming
+Teragon responses, and the supporting machinery used by the Flask resources
+in application.py.
+
+'''
@@ -0,0 +1,72 @@
+'''
+admission.py
+
+A budget for the amount of data requested from Teragon at once. Each request
+reserves its estimated number of values (see teragon.payload_cells) before
+requesting them, and waits while the budget is used up by other requests.
+
+'''
+
+# standard library
+import threading
+
+
+class CellBudget(object):
+    """A budget of values in flight, shared by the threads of a worker."""
+
+    def __init__(self, limit):
+        """
+        Arguments:
+            limit {int} -- the number of values that may be in flight at once
+        """
+        self.limit = limit
+        self._used = 0
+        self._waiting = 0
+        self._rejected = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, cells, timeout=None):
+        """reserve values from the budget, waiting for room if needed.
+        Requests larger than the whole budget reserve all of it, so that they
+        run on their own rather than never.
+
+        Arguments:
+            cells {int} -- the number of values
+            timeout {float} -- seconds to wait, or None to wait indefinitely
+
+        Returns:
+            {int} -- the number of values reserved (to be released), or None
+            if there wasn't room in time
+        """
+        cells = min(cells, self.limit)
+        with self._condition:
+            self._waiting += 1
+            try:
+                if not self._condition.wait_for(
+                        lambda: self._used + cells <= self.limit, timeout):
+                    self._rejected += 1
+                    return None
+            finally:
+                self._waiting -= 1
+            self._used += cells
+            return cells
+
+    def release(self, cells):
+        """return values reserved with acquire to the budget
+
+        Arguments:
+            cells {int} -- the number of values acquire returned
+        """
+        with self._condition:
+            self._used -= cells
+            self._condition.notify_all()
+
+    def stats(self):
+        """values in flight, requests waiting, and requests turned away"""
+        with self._condition:
+            return {
+                "used": self._used,
+                "limit": self.limit,
+                "waiting": self._waiting,
+                "rejected": self._rejected,
+            }
@@ -0,0 +1,123 @@
+'''
+aggregate.py
+
+Temporal aggregation of rainfall matrices: resampling to arbitrary bucket
+widths (sum, max or mean), and maximum rolling-window intensity.
+
+Empty cells (which Teragon returns for zero rainfall, unless zerofill is on)
+count as zero; 'N/D' cells are left out. A bucket with no data at all for a
+location is None.
+
+'''
+
+# standard library
+import math
+import re
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from rainfall.matrix import RainfallMatrix, NAN
+
+DURATION = re.compile(r'^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?)?$')
+
+AGGREGATES = ["sum", "max", "mean"]
+
+
+def parse_duration(text):
+    """parse an ISO 8601 duration of days, hours and minutes, e.g. "PT6H",
+    "P1D", or "PT30M"
+
+    Arguments:
+        text {str} -- the duration
+
+    Returns:
+        {timedelta} -- the duration, or None if it isn't valid (or is zero)
+    """
+    match = DURATION.match(text or '')
+    if not match:
+        return None
+    days, hours, minutes = [int(g) if g else 0 for g in match.groups()]
+    duration = timedelta(days=days, hours=hours, minutes=minutes)
+    return duration if duration else None
+
+
+def _aggregate(cells, how):
+    """aggregate a sequence of values, skipping NaNs"""
+    total = math.fsum(cells)
+    if total != total:
+        cells = [v for v in cells if v == v]
+        if not cells:
+            return NAN
+        total = math.fsum(cells)
+    if how == "sum":
+        return total
+    if how == "mean":
+        return total / len(cells) if len(cells) else NAN
+    return max(cells) if len(cells) else NAN
+
+
+def _has_data(cells):
+    """whether any of the values isn't NaN"""
+    return any(v == v for v in cells)
+
+
+def _rolling_sums(cells, k):
+    """trailing sums over windows of k values, with NaNs counted as zero.
+    The first k - 1 windows are partial.
+    """
+    sums = list(accumulate((v if v == v else 0.0 for v in cells), initial=0.0))
+    return [sums[i + 1] - sums[max(i + 1 - k, 0)] for i in range(len(cells))]
+
+
+def resample(matrix, start, end, width=None, how="sum", step=None, intensity=None):
+    """aggregate a matrix into time buckets
+
+    Arguments:
+        matrix {RainfallMatrix} -- rainfall data, in time order
+        start {datetime} -- start of the requested window; buckets are aligned
+        to it
+        end {datetime} -- end of the requested window
+        width {timedelta} -- width of the buckets, or None for a single bucket
+        covering the whole window
+        how {str} -- "sum", "max", or "mean"
+        step {timedelta} -- time step of the data (required for intensity)
+        intensity {timedelta} -- if set, aggregate the maximum rainfall over
+        any window of this length ending in the bucket (i.e., the peak
+        intensity) rather than the values themselves
+
+    Returns:
+        {RainfallMatrix} -- a matrix with one row per bucket, labeled with the
+        start of the bucket
+    """
+    width = width or max(end - start, timedelta(0)) or timedelta(days=1)
+    n = matrix.ncols
+
+    # rows are in time order, so each bucket is a contiguous range of rows
+    bounds = []
+    labels = []
+    for i, ts in enumerate(matrix.timestamps):
+        bucket = (datetime.fromisoformat(ts) - start) // width
+        if bounds and bounds[-1][0] == bucket:
+            bounds[-1][2] = i + 1
+        else:
+            bounds.append([bucket, i, i + 1])
+            labels.append((start + bucket * width).isoformat())
+
+    values = matrix.zero_blanks()
+    result = array('d', [NAN]) * (len(bounds) * n)
+    for j in range(n):
+        column = values[j::n]
+        if intensity:
+            # the peak of the rolling sums, for buckets with any data
+            sums = _rolling_sums(column, max(intensity // step, 1))
+            result[j::n] = array('d', [
+                max(sums[r0:r1]) if _has_data(column[r0:r1]) else NAN
+                for bucket, r0, r1 in bounds
+            ])
+        else:
+            result[j::n] = array('d', [
+                _aggregate(column[r0:r1], how) for bucket, r0, r1 in bounds
+            ])
+
+    return RainfallMatrix(labels, list(matrix.ids), result)
@@ -0,0 +1,274 @@
+'''
+aioclient.py
+
+A non-blocking HTTP client for the Teragon endpoints, built on aiohttp:
+form-encoded POSTs over kept-alive connections, with connect/read timeouts,
+retries with backoff, and the same counters as
+rainfall.client.TeragonClient. A single event loop can hold hundreds of
+requests in flight at once.
+
+Responses are returned as soon as their headers are received, and their
+bodies read as they arrive. Only successful (2xx) responses are returned:
+redirects aren't followed, and are errors like any other status. Bodies
+compressed with gzip or deflate are decompressed as they're read. Proxies
+are taken from the environment (HTTP_PROXY, HTTPS_PROXY, NO_PROXY), as they
+are by requests.
+
+'''
+
+# standard library
+import asyncio
+import threading
+
+import aiohttp
+from aiohttp.http_exceptions import ContentEncodingError, TransferEncodingError
+
+# bytes read from a response at a time
+CHUNK_SIZE = 65536
+
+# the content encodings that are accepted (and decompressed)
+_ENCODINGS = ("identity", "gzip", "x-gzip", "deflate")
+
+
+class UpstreamError(Exception):
+    """Teragon couldn't be reached, or answered with an error."""
+
+
+class UpstreamTimeout(UpstreamError):
+    """Teragon didn't respond in time."""
+
+
+class UpstreamInvalid(UpstreamError):
+    """Teragon's response couldn't be read."""
+
+
+class _Retry(Exception):
+    """an attempt failed in a way that's safe to retry"""
+
+
+class UpstreamResponse(object):
+    """A response whose headers have been received. Its body is read as it
+    arrives with iter_chunks, or all at once with read; the connection goes
+    back to the client's pool once the body has been read (call close if it
+    isn't going to be).
+    """
+
+    def __init__(self, client, response):
+        self.status_code = response.status
+        self.headers = response.headers
+        self.content = None
+        self._client = client
+        self._response = response
+
+    @property
+    def encoding(self):
+        """the charset of the response, defaulting (as requests does) to
+        ISO-8859-1 for text
+        """
+        if self._response.charset:
+            return self._response.charset
+        return 'ISO-8859-1' if self._response.content_type.startswith('text/') else 'utf-8'
+
+    @property
+    def content_encoding(self):
+        """the encoding the body is compressed with ("identity" if none)"""
+        return self.headers.get('content-encoding', '').strip().lower() or "identity"
+
+    @property
+    def text(self):
+        """the body, once it has been read"""
+        return self.content.decode(self.encoding, errors='replace')
+
+    async def iter_chunks(self):
+        """the body, in chunks of bytes as they're received
+
+        Raises:
+            UpstreamTimeout -- if Teragon stopped sending it
+            UpstreamError -- if the connection was lost
+            UpstreamInvalid -- if the body couldn't be decompressed, or its
+            chunks couldn't be read
+        """
+        try:
+            async for chunk in self._response.content.iter_chunked(CHUNK_SIZE):
+                yield chunk
+        except asyncio.TimeoutError:
+            self._client._count('_errors')
+            raise UpstreamTimeout("Teragon stopped sending its response")
+        except aiohttp.ClientPayloadError as e:
+            self._client._count('_errors')
+            if isinstance(e.__cause__, (TransferEncodingError, ContentEncodingError)):
+                raise UpstreamInvalid("Teragon's response couldn't be read: {0}".format(e))
+            raise UpstreamError("Teragon's response was cut short: {0}".format(e))
+        except aiohttp.ClientResponseError as e:
+            self._client._count('_errors')
+            raise UpstreamInvalid("Teragon's response couldn't be read: {0}".format(e.message))
+        except (aiohttp.ClientError, OSError) as e:
+            self._client._count('_errors')
+            raise UpstreamError("Teragon's response was cut short: {0!r}".format(e))
+        finally:
+            self._response.release()
+
+    async def read(self):
+        """read the whole body
+
+        Returns:
+            {bytes}
+        """
+        self.content = b"".join([chunk async for chunk in self.iter_chunks()])
+        return self.content
+
+    def close(self):
+        """drop the connection, if the body hasn't been read"""
+        self._response.close()
+
+
+class AsyncTeragonClient(object):
+    """Non-blocking, pooled HTTP client for Teragon's endpoints. Coroutines
+    must all run on the same event loop.
+    """
+
+    def __init__(self, pool_size=256, connect_timeout=5, read_timeout=120, retries=2, backoff=0.5):
+        """
+        Arguments:
+            pool_size {int} -- maximum number of open connections per host;
+            further requests wait for one
+            connect_timeout {float} -- seconds to wait for a connection
+            read_timeout {float} -- seconds to wait between reads of the
+            response
+            retries {int} -- number of retries on connection errors and 5xx
+            backoff {float} -- backoff factor between retries, in seconds
+        """
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        # made on the event loop when first needed
+        self._session = None
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._connections = 0
+        self._reused = 0
+        self._retries = 0
+        self._errors = 0
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _start_session(self):
+        """the session, counting new and reused connections"""
+        async def created(session, context, params):
+            self._count('_connections')
+
+        async def reused(session, context, params):
+            self._count('_reused')
+
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(created)
+        trace.on_connection_reuseconn.append(reused)
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0, limit_per_host=self.pool_size),
+            timeout=aiohttp.ClientTimeout(
+                total=None, sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+            headers={"Accept-Encoding": "gzip, deflate"},
+            auto_decompress=True,
+            trust_env=True,
+            trace_configs=[trace]
+        )
+
+    async def open(self, url, data):
+        """POST a payload, returning once the response headers are received
+
+        Arguments:
+            url {str} -- Teragon API endpoint
+            data {dict} -- request payload
+
+        Returns:
+            {UpstreamResponse} -- the (successful) response, whose body is
+            yet to be read
+
+        Raises:
+            UpstreamTimeout -- if Teragon didn't respond in time
+            UpstreamInvalid -- if the response couldn't be read
+            UpstreamError -- if there's no successful response after the
+            retries
+        """
+        self._count('_requests')
+        if self._session is None:
+            self._session = self._start_session()
+        attempt = 0
+        while True:
+            try:
+                response = await self._session.post(url, data=data, allow_redirects=False)
+                if response.status in (500, 502, 503, 504):
+                    response.close()
+                    raise _Retry("HTTP {0}".format(response.status))
+                if not 200 <= response.status < 300:
+                    # errors, and redirects, which aren't expected of Teragon
+                    response.close()
+                    self._count('_errors')
+                    raise UpstreamError("HTTP {0} from {1}{2}".format(
+                        response.status, url,
+                        " to " + response.headers['location'] if 'location' in response.headers else ""))
+                response = UpstreamResponse(self, response)
+                if response.content_encoding not in _ENCODINGS:
+                    response.close()
+                    self._count('_errors')
+                    raise UpstreamError("unsupported Content-Encoding {0!r} from {1}".format(
+                        response.content_encoding, url))
+                return response
+            except aiohttp.ClientResponseError as e:
+                # a response that couldn't be parsed
+                self._count('_errors')
+                raise UpstreamInvalid("{0}: {1}".format(url, e.message))
+            except (_Retry, aiohttp.ClientError, OSError, asyncio.TimeoutError) as e:
+                if attempt >= self.retries:
+                    self._count('_errors')
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise UpstreamTimeout("no response from {0} in time".format(url))
+                    raise UpstreamError("{0}: {1!r}".format(url, e))
+                attempt += 1
+                self._count('_retries')
+                await asyncio.sleep(self.backoff * (2 ** (attempt - 1)) if attempt > 1 else 0)
+
+    async def post(self, url, data):
+        """POST a payload and read the whole response
+
+        Arguments:
+            url {str} -- Teragon API endpoint
+            data {dict} -- request payload
+
+        Returns:
+            {UpstreamResponse} -- the (successful) response, with its content
+
+        Raises:
+            UpstreamTimeout -- if Teragon didn't respond in time
+            UpstreamError -- if there's no successful response after the
+            retries
+        """
+        response = await self.open(url, data)
+        await response.read()
+        return response
+
+    async def close(self):
+        """close the client's connections"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def stats(self):
+        """counters for the client
+
+        Returns:
+            {dict} -- requests made, connections opened, requests that reused
+            a kept-alive connection, retried attempts, and failed requests
+        """
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "connections": self._connections,
+                "reused": self._reused,
+                "retries": self._retries,
+                "errors": self._errors,
+            }
@@ -0,0 +1,105 @@
+'''
+basins.py
+
+Spatial aggregation of GARR pixel matrices into per-basin series (mean, total
+or max across a basin's pixels), using a precomputed pixel to basin index.
+
+As with temporal aggregation, empty cells count as zero and 'N/D' cells are
+left out; a basin with no data at a timestamp is None.
+
+'''
+
+# standard library
+import math
+from array import array
+from functools import lru_cache
+from itertools import compress
+
+from rainfall.matrix import RainfallMatrix, NAN
+
+BASIN_AGGREGATES = ["mean", "total", "max"]
+
+# the key of the basin lookup that holds the pixels outside of every basin
+OUTSIDE = "other"
+
+
+class BasinIndex(object):
+    """Maps GARR pixels to the basins they belong to."""
+
+    def __init__(self, lookup, outside=OUTSIDE):
+        """
+        Arguments:
+            lookup {dict} -- pixel ids ("123-456") by basin name
+
+        Keyword Arguments:
+            outside {str} -- the key of the lookup holding the pixels that
+            aren't in any basin; they're left out of the aggregates (default:
+            {"other"})
+        """
+        self.basins = [b for b in lookup if b != outside]
+        self._position = {}
+        for b, basin in enumerate(self.basins):
+            for p in lookup[basin]:
+                self._position.setdefault(p, b)
+
+    @lru_cache(maxsize=32)
+    def index_vector(self, ids):
+        """the basin of each pixel, as positions in self.basins (-1 for pixels
+        outside of every basin)
+
+        Arguments:
+            ids {tuple} -- pixel ids, e.g. the columns of a matrix
+
+        Returns:
+            {tuple} -- a basin position per pixel
+        """
+        return tuple(self._position.get(p, -1) for p in ids)
+
+    def aggregate(self, matrix, how="mean"):
+        """aggregate a pixel matrix by basin, in a single pass over its columns
+
+        Arguments:
+            matrix {RainfallMatrix} -- GARR pixel data
+            how {str} -- "mean", "total", or "max"
+
+        Returns:
+            {RainfallMatrix} -- a matrix with a column per basin covered by the
+            matrix's pixels, in the lookup's order
+        """
+        n, nrows = matrix.ncols, matrix.nrows
+        index = self.index_vector(tuple(matrix.ids))
+        members = {}
+        for j, b in enumerate(index):
+            if b >= 0:
+                members.setdefault(b, []).append(j)
+        basins = sorted(members)
+
+        # missing values are zeroed, with a flag for the 'N/D' ones (i.e., the
+        # missing values that weren't empty cells)
+        values = array('d', matrix.values)
+        nodata = bytearray(len(values))
+        for k in compress(range(len(values)), map(math.isnan, values)):
+            values[k] = 0.0
+            if matrix.blanks is None or not matrix.blanks[k]:
+                nodata[k] = 1
+
+        result = array('d', [NAN]) * (nrows * len(basins))
+        for c, b in enumerate(basins):
+            js = members[b]
+            # per-row counts of the pixels that have data
+            counts = [len(js) - sum(flags) for flags in zip(*[nodata[j::n] for j in js])]
+            if how == "max":
+                columns = [
+                    [v if not f else -math.inf for v, f in zip(values[j::n], nodata[j::n])]
+                    for j in js
+                ]
+                series = map(max, zip(*columns))
+            else:
+                series = map(math.fsum, zip(*[values[j::n] for j in js]))
+            result[c::len(basins)] = array('d', [
+                NAN if not count else (s / count if how == "mean" else s)
+                for s, count in zip(series, counts)
+            ])
+
+        return RainfallMatrix(
+            list(matrix.timestamps), [self.basins[b] for b in basins], result)
@@ -0,0 +1,119 @@
+'''
+client.py
+
+A shared HTTP client for the Teragon endpoints: a pooled, keep-alive session
+with connect/read timeouts and retries with backoff, which keeps count of how
+often connections are reused.
+
+'''
+
+# standard library
+import threading
+# web requests
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
+
+
+def _retry(retries, backoff):
+    """retry policy for Teragon requests. Teragon's endpoints only read
+    data, so POSTs are safe to retry.
+    """
+    options = dict(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff,
+        status_forcelist=(500, 502, 503, 504),
+    )
+    try:
+        return Retry(allowed_methods=frozenset(['GET', 'POST']), **options)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=frozenset(['GET', 'POST']), **options)
+
+
+class TeragonClient(object):
+    """Pooled HTTP client for Teragon's endpoints."""
+
+    def __init__(self, pool_size=10, connect_timeout=5, read_timeout=120, retries=2, backoff=0.5):
+        """
+        Arguments:
+            pool_size {int} -- maximum number of kept-alive connections per host
+            connect_timeout {float} -- seconds to wait for a connection
+            read_timeout {float} -- seconds to wait between bytes of the response
+            retries {int} -- number of retries on connection errors and 5xx
+            backoff {float} -- backoff factor between retries, in seconds
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=_retry(retries, backoff)
+        )
+        self._session = requests.Session()
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+
+    def post(self, url, data, stream=False):
+        """POST a payload
+
+        Arguments:
+            url {str} -- Teragon API endpoint
+            data {dict} -- request payload
+            stream {bool} -- return as soon as the response headers are
+            received, leaving the body to be read from the response
+            (default: False)
+
+        Returns:
+            {requests.Response} -- the response
+
+        Raises:
+            requests.RequestException -- if there's no (successful) response
+            after the retries; requests.Timeout if Teragon didn't respond in time
+        """
+        with self._lock:
+            self._requests += 1
+        try:
+            response = self._session.post(
+                url, data=data, timeout=self.timeout, stream=stream)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            with self._lock:
+                self._errors += 1
+            # requests reports read timeouts that ran out of retries as
+            # connection errors
+            reason = getattr(e.args[0] if e.args else None, 'reason', None)
+            if isinstance(reason, ReadTimeoutError):
+                raise requests.ReadTimeout(e, request=e.request)
+            raise
+        return response
+
+    def stats(self):
+        """counters for the client
+
+        Returns:
+            {dict} -- requests made, connections opened, requests that reused
+            a kept-alive connection, retried attempts, and failed requests
+        """
+        pools = self._adapter.poolmanager.pools
+        connections = attempts = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                attempts += pool.num_requests
+        with self._lock:
+            requests_made, errors = self._requests, self._errors
+        return {
+            "requests": requests_made,
+            "connections": connections,
+            "reused": max(attempts - connections, 0),
+            "retries": max(attempts - requests_made, 0),
+            "errors": errors,
+        }
@@ -0,0 +1,77 @@
+'''
+coalesce.py
+
+Single-flight coalescing of identical concurrent work: while a call for a key
+is in flight, other callers for the same key wait for it and share its result
+(or its error) instead of repeating it.
+
+'''
+
+# standard library
+import threading
+
+
+class _Call(object):
+    """A call in flight."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls that share a key."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._leaders = 0
+        self._followers = 0
+
+    def do(self, key, fn):
+        """call fn, unless a call for the same key is already in flight, in
+        which case wait for that call and return its result
+
+        Arguments:
+            key {hashable} -- identifies the work
+            fn {function} -- does the work, taking no arguments
+
+        Returns:
+            {object} -- the result of fn, which is shared with every caller
+            that was coalesced into the same call; it must not be modified
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._leaders += 1
+            else:
+                self._followers += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        """counters for the coalescing
+
+        Returns:
+            {dict} -- calls made, and calls that were coalesced into them
+        """
+        with self._lock:
+            return {"calls": self._leaders, "coalesced": self._followers}
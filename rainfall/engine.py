@@ -0,0 +1,224 @@
+'''
+engine.py
+
+The asyncio upstream engine: Teragon requests are made on a single event loop
+running in a background thread, so a process can have hundreds of them in
+flight without a thread (or a pooled connection) blocked on each one. Parsing
+the responses is CPU-bound, and is handed to a small, bounded pool of worker
+threads so that it never stalls the loop; each response is parsed as it's
+received, a chunk at a time, rather than once all of it has arrived. Only a
+few chunks of a response wait to be parsed at any time: while they do, the
+rest of it is left unread on the connection. Callers can have large
+responses read whole instead, and parsed elsewhere (see
+rainfall.workers.TransformPool.parse_csv).
+
+Callers in request threads get concurrent.futures.Future objects, and only
+wait for their own results.
+
+'''
+
+# standard library
+import asyncio
+import queue
+import threading
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+
+from rainfall.aioclient import UpstreamError, UpstreamInvalid
+from rainfall.matrix import RainfallMatrix, decode_lines
+
+# marks the end of a response's body
+_END = object()
+
+# chunks of a body that may be waiting to be parsed; reading the body from
+# the connection waits while the parsing thread catches up
+QUEUE_CHUNKS = 8
+
+
+class _Body(object):
+    """A response body on its way from the event loop to a parsing thread, a
+    bounded number of chunks at a time.
+    """
+
+    def __init__(self, loop, size=QUEUE_CHUNKS):
+        self.chunks = queue.Queue(size)
+        self.failed = threading.Event()
+        self._loop = loop
+        self._room = asyncio.Event()
+
+    async def put(self, item):
+        """(on the loop) queue a chunk, the end of the body, or the error
+        that stopped it, waiting for room without blocking the loop
+        """
+        while True:
+            try:
+                self.chunks.put_nowait(item)
+                return
+            except queue.Full:
+                # set by the parsing thread once it takes a chunk
+                self._room.clear()
+                await self._room.wait()
+
+    def received(self):
+        """(in the parsing thread) the chunks of the body, until its end
+
+        Raises:
+            the error that stopped the body from being received, if any
+        """
+        while True:
+            item = self.chunks.get()
+            self._loop.call_soon_threadsafe(self._room.set)
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    def parse(self, encoding):
+        """(in the parsing thread) parse the body into a matrix, as it's
+        received
+        """
+        received = self.received()
+        try:
+            return RainfallMatrix.from_csv(decode_lines(received, encoding))
+        except Exception:
+            self.failed.set()
+            raise
+        finally:
+            # whatever is left of the body is discarded, so that the loop is
+            # never left waiting for room
+            try:
+                for _ in received:
+                    pass
+            except Exception:
+                pass
+
+
+class UpstreamEngine(object):
+    """An event loop in a background thread that fetches Teragon tables."""
+
+    def __init__(self, client, parse_workers=4):
+        """
+        Arguments:
+            client {AsyncTeragonClient} -- the client used on the loop
+            parse_workers {int} -- number of threads parsing responses
+        """
+        self.client = client
+        self.loop = asyncio.new_event_loop()
+        self._parser = ThreadPoolExecutor(
+            max_workers=parse_workers, thread_name_prefix="upstream-parse")
+        self._thread = threading.Thread(
+            target=self._run, name="upstream-loop", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _received(self, response):
+        """parse a response's body as it's received
+
+        Returns:
+            {tuple} -- (RainfallMatrix, the size of the body)
+        """
+        # the body is handed to a parsing thread as it arrives
+        body = _Body(self.loop)
+        parsed = self.loop.run_in_executor(self._parser, body.parse, response.encoding)
+        chunks = response.iter_chunks()
+        size = 0
+        try:
+            async for chunk in chunks:
+                await body.put(chunk)
+                size += len(chunk)
+                if body.failed.is_set():
+                    # the rest of the body won't be parsed
+                    break
+        except BaseException as e:
+            await body.put(e)
+            await asyncio.wait([parsed])
+            if not parsed.cancelled():
+                # the parser stops with the same error, raised here instead
+                parsed.exception()
+            raise
+        finally:
+            await chunks.aclose()
+        await body.put(_END)
+        return await parsed, size
+
+    async def _fetch(self, url, payload, timings, parser):
+        start = timeit.default_timer()
+        response = await self.client.open(url, payload)
+        receiving = timeit.default_timer()
+        parse = parser(payload) if parser is not None else None
+        try:
+            if parse is None:
+                matrix, size = await self._received(response)
+            else:
+                # the whole body is parsed at once
+                content = await response.read()
+                size = len(content)
+                matrix = await self.loop.run_in_executor(
+                    self._parser, parse, content, response.encoding)
+        except UpstreamError:
+            raise
+        except Exception as e:
+            raise UpstreamInvalid("Teragon's response couldn't be parsed: {0!r}".format(e))
+        if timings is not None:
+            timings.add("upstream", receiving - start)
+            timings.add_bytes(size)
+            timings.add("csv", timeit.default_timer() - receiving)
+        return matrix
+
+    async def _fetch_all(self, url, payloads, parallelism, timings, parser):
+        limit = asyncio.Semaphore(parallelism)
+
+        async def one(payload):
+            async with limit:
+                return await self._fetch(url, payload, timings, parser)
+
+        return await asyncio.gather(*[one(p) for p in payloads])
+
+    def fetch(self, url, payload, timings=None, parser=None):
+        """fetch and parse a payload's table
+
+        Arguments:
+            url {str} -- Teragon API endpoint
+            payload {dict} -- request payload
+            timings {RequestTimings} -- the stage timings of the request this
+            is for, or None
+            parser {function} -- given a payload, a function that parses its
+            whole body (bytes, encoding) into a RainfallMatrix, or None to
+            parse the body as it's received (default: {None}, always)
+
+        Returns:
+            {Future} -- resolves to a RainfallMatrix, or raises UpstreamError
+            (UpstreamInvalid if the response can't be parsed)
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._fetch(url, payload, timings, parser), self.loop)
+
+    def fetch_all(self, url, payloads, parallelism, timings=None, parser=None):
+        """fetch and parse several payloads' tables, at most parallelism at a
+        time
+
+        Arguments:
+            url {str} -- Teragon API endpoint
+            payloads {list} -- request payloads
+            parallelism {int} -- maximum number of requests in flight
+            timings {RequestTimings} -- the stage timings of the request this
+            is for, or None
+            parser {function} -- as in fetch
+
+        Returns:
+            {Future} -- resolves to a list of RainfallMatrix, in the order of
+            payloads
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._fetch_all(url, payloads, parallelism, timings, parser), self.loop)
+
+    def close(self):
+        """close the client, and stop the loop and the parsing threads"""
+        asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self._parser.shutdown()
@@ -0,0 +1,309 @@
+'''
+events.py
+
+The catalog of notable rainfall events (data/db.json), and their precomputed
+datasets: the GARR and rain gauge data for each event at every interval,
+built ahead of time and kept as compressed files, along with summary
+statistics (basin totals and peak intensities), so that requests for these
+events don't go to Teragon.
+
+Each event's files are kept in a directory of their own:
+
+    <root>/<event id>/garr-Hourly.rfm.gz
+    <root>/<event id>/gauge-15-minute.rfm.gz
+    ...
+    <root>/<event id>/summary.json
+
+'''
+
+# standard library
+import gzip
+import json
+import os
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import timedelta
+# date/time parsing
+from dateutil.parser import parse
+
+from rainfall.aggregate import resample
+from rainfall.matrix import RainfallMatrix
+from rainfall.teragon import STEPS
+from rainfall.timestamps import gettz
+
+# the kinds of data precomputed for each event
+KINDS = ["garr", "gauge"]
+
+# the time zone of event times (and of Teragon's data)
+LOCAL_ZONE = 'America/New_York'
+
+
+def parse_event_time(text):
+    """parse an event time from the catalog (e.g., "2016-09-08 18:00 EDT")
+    as a naive local date-time, like the ones in Teragon payloads
+
+    Arguments:
+        text {str} -- the event time
+
+    Returns:
+        {datetime}
+    """
+    local = gettz(LOCAL_ZONE)
+    dt = parse(text, tzinfos={"EDT": local, "EST": local})
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(local).replace(tzinfo=None)
+    return dt
+
+
+def load_catalog(path):
+    """read the event catalog. Event windows are widened to whole hours,
+    which is the resolution of Teragon's payloads.
+
+    Arguments:
+        path {str} -- path to db.json
+
+    Returns:
+        {list} -- events, as dicts of id, label, report, start and end
+    """
+    with open(path) as fp:
+        db = json.load(fp)
+    hour = timedelta(hours=1)
+    events = []
+    for e in db.get("events", []):
+        start = parse_event_time(e['dt_start'])
+        end = parse_event_time(e['dt_end'])
+        start = start.replace(minute=0, second=0, microsecond=0)
+        if end.minute or end.second or end.microsecond:
+            end = end.replace(minute=0, second=0, microsecond=0) + hour
+        events.append({
+            "id": e['id'],
+            "label": e.get('label') or "",
+            "report": e.get('report'),
+            "start": start,
+            "end": end,
+        })
+    return events
+
+
+def dump_matrix(matrix):
+    """serialize a matrix compactly: a JSON header (timestamps and ids), then
+    the values as little-endian doubles and the blank flags, gzipped
+
+    Arguments:
+        matrix {RainfallMatrix} -- the data
+
+    Returns:
+        {bytes}
+    """
+    values = matrix.values
+    if sys.byteorder != "little":
+        values = array('d', values)
+        values.byteswap()
+    header = json.dumps({
+        "timestamps": matrix.timestamps,
+        "ids": list(matrix.ids),
+        "blanks": matrix.blanks is not None,
+    }, separators=(',', ':')).encode('utf-8')
+    return gzip.compress(
+        header + b"\n" + values.tobytes() + bytes(matrix.blanks or b""),
+        mtime=0)
+
+
+def load_matrix(data):
+    """read a matrix serialized with dump_matrix
+
+    Arguments:
+        data {bytes} -- the serialized matrix
+
+    Returns:
+        {RainfallMatrix}
+    """
+    data = gzip.decompress(data)
+    split = data.index(b"\n")
+    header = json.loads(data[:split].decode('utf-8'))
+    count = len(header['timestamps']) * len(header['ids'])
+    values = array('d')
+    values.frombytes(data[split + 1:split + 1 + count * 8])
+    if sys.byteorder != "little":
+        values.byteswap()
+    blanks = None
+    if header['blanks']:
+        blanks = bytearray(data[split + 1 + count * 8:])
+    return RainfallMatrix(header['timestamps'], header['ids'], values, blanks)
+
+
+def _first_row(matrix):
+    """the values of a single-row matrix (e.g., a total), rounded, with None
+    for missing values, by id
+    """
+    return {
+        i: (round(v, 3) if isinstance(v, float) else None)
+        for i, v in zip(matrix.ids, matrix.row(0))
+    } if matrix.nrows else {}
+
+
+def summarize(event, garr, gauge, basin_index, interval):
+    """summary statistics for an event: the total rainfall and peak hourly
+    intensity of each basin (over the mean of its pixels) and gauge, and the
+    wettest pixel of each basin
+
+    Arguments:
+        event {dict} -- the event, from the catalog
+        garr {RainfallMatrix} -- the event's GARR data, for all pixels
+        gauge {RainfallMatrix} -- the event's rain gauge data
+        basin_index {BasinIndex} -- the pixels of each basin
+        interval {str} -- the interval of the data
+
+    Returns:
+        {dict}
+    """
+    start, end = event['start'], event['end']
+    step, hour = STEPS[interval], timedelta(hours=1)
+
+    def total(matrix):
+        return _first_row(resample(matrix, start, end))
+
+    def peak(matrix):
+        return _first_row(resample(matrix, start, end, step=step, intensity=hour))
+
+    basin_means = basin_index.aggregate(garr, "mean")
+    wettest = basin_index.aggregate(resample(garr, start, end), "max")
+    basins = {
+        basin: {"total": t, "peak_1h": p, "max_pixel_total": m}
+        for basin, t, p, m in zip(
+            basin_means.ids,
+            total(basin_means).values(),
+            peak(basin_means).values(),
+            _first_row(wettest).values())
+    }
+    gauges = {
+        gid: {"total": t, "peak_1h": p}
+        for gid, t, p in zip(gauge.ids, total(gauge).values(), peak(gauge).values())
+    }
+    return {
+        "id": event['id'],
+        "interval": interval,
+        "basins": basins,
+        "gauges": gauges,
+    }
+
+
+class EventStore(object):
+    """The precomputed datasets and summaries of the cataloged events."""
+
+    def __init__(self, catalog, root, cache_size=16):
+        """
+        Arguments:
+            catalog {list} -- events, from load_catalog
+            root {str} -- directory of the precomputed files
+            cache_size {int} -- number of datasets kept in memory
+        """
+        self.events = OrderedDict((e['id'], e) for e in catalog)
+        self.root = root
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, event_id, name):
+        return os.path.join(self.root, str(event_id), name)
+
+    def _dataset_path(self, event_id, kind, interval):
+        return self._path(event_id, "{0}-{1}.rfm.gz".format(kind, interval))
+
+    def datasets(self, event_id):
+        """the precomputed datasets of an event
+
+        Arguments:
+            event_id {int} -- the event
+
+        Returns:
+            {list} -- (kind, interval) pairs
+        """
+        return [
+            (kind, interval) for kind in KINDS for interval in STEPS
+            if os.path.exists(self._dataset_path(event_id, kind, interval))
+        ]
+
+    def dataset(self, event_id, kind, interval):
+        """a precomputed dataset, kept in memory once it's been read
+
+        Arguments:
+            event_id {int} -- the event
+            kind {str} -- "garr" or "gauge"
+            interval {str} -- "Daily", "Hourly", or "15-minute"
+
+        Returns:
+            {RainfallMatrix} -- the data (which must not be modified), or None
+            if it hasn't been built
+        """
+        key = (event_id, kind, interval)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        try:
+            with open(self._dataset_path(*key), 'rb') as f:
+                matrix = load_matrix(f.read())
+        except IOError:
+            return None
+        with self._lock:
+            self._cache[key] = matrix
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return matrix
+
+    def summary(self, event_id):
+        """an event's precomputed summary statistics
+
+        Arguments:
+            event_id {int} -- the event
+
+        Returns:
+            {dict} -- the summary, or None if it hasn't been built
+        """
+        try:
+            with open(self._path(event_id, "summary.json")) as fp:
+                return json.load(fp)
+        except IOError:
+            return None
+
+    def _write(self, event_id, name, data):
+        """write a file atomically, so that readers never see part of it"""
+        path = self._path(event_id, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", 'wb') as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def build(self, event_id, fetch, basin_index, rebuild=False):
+        """precompute an event's datasets (those not built yet, unless
+        rebuild) and its summary
+
+        Arguments:
+            event_id {int} -- the event
+            fetch {function} -- fetch(kind, event, interval) returns a
+            RainfallMatrix of the event's data
+            basin_index {BasinIndex} -- the pixels of each basin
+            rebuild {bool} -- rebuild datasets that are already built
+        """
+        event = self.events[event_id]
+        for kind in KINDS:
+            for interval in STEPS:
+                if not rebuild and os.path.exists(self._dataset_path(event_id, kind, interval)):
+                    continue
+                matrix = fetch(kind, event, interval)
+                self._write(
+                    event_id, "{0}-{1}.rfm.gz".format(kind, interval), dump_matrix(matrix))
+                with self._lock:
+                    self._cache.pop((event_id, kind, interval), None)
+
+        summary = summarize(
+            event,
+            self.dataset(event_id, "garr", "15-minute"),
+            self.dataset(event_id, "gauge", "15-minute"),
+            basin_index,
+            "15-minute"
+        )
+        self._write(event_id, "summary.json", json.dumps(summary, indent=2).encode('utf-8'))
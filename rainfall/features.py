@@ -0,0 +1,111 @@
+'''
+features.py
+
+GeoJSON layers with rainfall data embedded in each feature's properties. Each
+feature of a layer is serialized once, up to its rainfall property, and kept
+as a fragment of bytes keyed by the feature's location id; a response is
+assembled by joining the fragments of the requested locations with their
+serialized values, with no parsing or serialization of the geometries.
+
+'''
+
+# standard library
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# the compact separators used for all of the fragments
+_SEPARATORS = (',', ':')
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=_SEPARATORS)
+
+
+def _value(v):
+    """a rendered matrix value as JSON (floats are the common case, and
+    json.dumps writes them as their repr)
+    """
+    if v.__class__ is float:
+        return repr(v).encode('ascii')
+    return _dumps(v).encode('ascii')
+
+
+class FeatureTemplates(object):
+    """A GeoJSON layer, serialized once as a fragment per feature, ready to
+    have rainfall data added to its features.
+    """
+
+    def __init__(self, data, id_property, name="rainfall"):
+        """
+        Arguments:
+            data {dict} -- the parsed GeoJSON FeatureCollection
+            id_property {str} -- the property holding each feature's location
+            id, as in the matrices of data (features without one are left
+            out)
+
+        Keyword Arguments:
+            name {str} -- the property that the data is added as (default:
+            {"rainfall"})
+        """
+        # everything but the features, with the features array left open
+        collection = {k: v for k, v in data.items() if k != "features"}
+        head = _dumps(collection)[:-1]
+        self.head = (head + ("," if collection else "") + '"features":[').encode('utf-8')
+        self.tail = b"]}"
+
+        # each feature, with its properties left open at the data's property
+        self.fragments = []
+        unidentified = 0
+        for feature in data.get("features", []):
+            properties = feature.get("properties") or {}
+            if properties.get(id_property) is None:
+                unidentified += 1
+                continue
+            rest = {k: v for k, v in feature.items() if k != "properties"}
+            fragment = "{0},\"properties\":{1}{2}{3}:".format(
+                _dumps(rest)[:-1],
+                _dumps(properties)[:-1],
+                "," if properties else "",
+                _dumps(name)
+            )
+            self.fragments.append((str(properties[id_property]), fragment.encode('utf-8')))
+        if unidentified:
+            # they can't be matched with any data
+            logger.warning(
+                "%d features of %s have no %s, and are left out of its templates",
+                unidentified, data.get("name", "the layer"), id_property)
+
+    def __len__(self):
+        return len(self.fragments)
+
+    def render(self, matrix, series=False):
+        """assemble the FeatureCollection of the locations of a matrix, in the
+        layer's order, with their data
+
+        Arguments:
+            matrix {RainfallMatrix} -- the data, with a column per location
+
+        Keyword Arguments:
+            series {bool} -- add each location's values keyed by timestamp,
+            rather than the value of its first (and only) row (default:
+            {False})
+
+        Returns:
+            {bytes} -- the FeatureCollection
+        """
+        columns = {c: j for j, c in enumerate(matrix.ids)}
+        if series:
+            timestamps = matrix.timestamps
+            value = lambda j: _dumps(dict(zip(timestamps, matrix.column(j)))).encode('ascii')
+        else:
+            row = matrix.row(0) if matrix.nrows else [None] * matrix.ncols
+            value = lambda j: _value(row[j])
+
+        parts = []
+        for location, fragment in self.fragments:
+            j = columns.get(location)
+            if j is not None:
+                parts.append(fragment + value(j) + b"}}")
+        return self.head + b",".join(parts) + self.tail
@@ -0,0 +1,144 @@
+'''
+formats.py
+
+Binary, columnar response formats (Arrow IPC, Parquet and msgpack), encoded
+straight from a RainfallMatrix.
+
+Tables have a 'timestamp' column followed by a float64 column per location.
+Empty cells (no rainfall) are 0.0; 'N/D' cells are null (or NaN in msgpack).
+
+'''
+
+# standard library
+import io
+import sys
+from array import array
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+try:
+    import pyarrow.parquet
+    parquet = pyarrow.parquet
+except ImportError:
+    parquet = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# the media types of each format; the first is the one responses are sent with
+MIMETYPES = {
+    "arrow": ["application/vnd.apache.arrow.stream"],
+    "parquet": ["application/vnd.apache.parquet", "application/x-parquet"],
+    "msgpack": ["application/msgpack", "application/x-msgpack"],
+}
+
+# the library each format needs
+REQUIRES = {
+    "arrow": "pyarrow",
+    "parquet": "pyarrow",
+    "msgpack": "msgpack",
+}
+
+
+def available(fmt):
+    """whether the library needed for a format is installed
+
+    Arguments:
+        fmt {str} -- "arrow", "parquet", or "msgpack"
+
+    Returns:
+        {bool}
+    """
+    if fmt == "arrow":
+        return pyarrow is not None
+    if fmt == "parquet":
+        return pyarrow is not None and parquet is not None
+    if fmt == "msgpack":
+        return msgpack is not None
+    return False
+
+
+def to_table(matrix):
+    """build an Arrow table from a matrix, one column at a time from the
+    matrix's values (no Python objects are made for the cells)
+
+    Arguments:
+        matrix {RainfallMatrix} -- the data
+
+    Returns:
+        {pyarrow.Table}
+    """
+    n = matrix.ncols
+    values = matrix.zero_blanks()
+    null = pyarrow.scalar(None, pyarrow.float64())
+    columns = [
+        pyarrow.array(matrix.timestamps, pyarrow.string()).cast(pyarrow.timestamp('s'))
+    ]
+    for j in range(n):
+        column = values[j::n]
+        column = pyarrow.Array.from_buffers(
+            pyarrow.float64(), len(column), [None, pyarrow.py_buffer(column)])
+        columns.append(pyarrow.compute.if_else(
+            pyarrow.compute.is_nan(column), null, column))
+    return pyarrow.Table.from_arrays(columns, names=["timestamp"] + list(matrix.ids))
+
+
+def to_arrow(matrix):
+    """encode a matrix as an Arrow IPC stream"""
+    table = to_table(matrix)
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def to_parquet(matrix):
+    """encode a matrix as a Parquet file"""
+    sink = io.BytesIO()
+    parquet.write_table(to_table(matrix), sink)
+    return sink.getvalue()
+
+
+def to_msgpack(matrix):
+    """encode a matrix as msgpack: a map of 'timestamps' and 'ids' (arrays of
+    strings), and 'values', the row-major matrix as little-endian float64
+    bytes (of 'shape' [rows, columns]), with NaN for 'N/D'
+    """
+    values = matrix.zero_blanks()
+    if sys.byteorder != "little":
+        values = array('d', values)
+        values.byteswap()
+    return msgpack.packb({
+        "timestamps": matrix.timestamps,
+        "ids": list(matrix.ids),
+        "shape": [matrix.nrows, matrix.ncols],
+        "dtype": "<f8",
+        "values": values.tobytes(),
+    }, use_bin_type=True)
+
+
+ENCODERS = {
+    "arrow": to_arrow,
+    "parquet": to_parquet,
+    "msgpack": to_msgpack,
+}
+
+
+def encode(matrix, fmt):
+    """encode a matrix in a binary format
+
+    Arguments:
+        matrix {RainfallMatrix} -- the data
+        fmt {str} -- "arrow", "parquet", or "msgpack"
+
+    Returns:
+        {bytes} -- the encoded data
+    """
+    return ENCODERS[fmt](matrix)
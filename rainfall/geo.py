@@ -0,0 +1,58 @@
+'''
+geo.py
+
+Static GeoJSON layers (the GARR grid and its centroids, and the rain gauges),
+loaded once and kept as pre-serialized, pre-compressed bytes with strong
+ETags, so that serving them costs no parsing or serialization.
+
+'''
+
+# standard library
+import gzip
+import hashlib
+import json
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class StaticLayer(object):
+    """A GeoJSON file, serialized once and compressed ahead of time."""
+
+    def __init__(self, path):
+        """
+        Arguments:
+            path {str} -- path to the GeoJSON file
+        """
+        with open(path) as f:
+            self.data = json.load(f)
+        body = json.dumps(self.data, separators=(',', ':')).encode('utf-8')
+        etag = hashlib.sha1(body).hexdigest()
+
+        # each encoding is its own representation, with its own strong ETag
+        self.representations = {
+            'identity': (body, etag)
+        }
+        self.representations['gzip'] = (
+            gzip.compress(body, compresslevel=9, mtime=0), etag + "-gzip")
+        if brotli is not None:
+            self.representations['br'] = (brotli.compress(body), etag + "-br")
+
+    def representation(self, accept_encodings):
+        """pick the smallest representation the client accepts
+
+        Arguments:
+            accept_encodings {werkzeug.datastructures.Accept} -- the request's
+            parsed Accept-Encoding header
+
+        Returns:
+            {tuple} -- (body, content encoding or None, ETag)
+        """
+        for encoding in ('br', 'gzip'):
+            if encoding in self.representations and accept_encodings.quality(encoding) > 0:
+                body, etag = self.representations[encoding]
+                return body, encoding, etag
+        body, etag = self.representations['identity']
+        return body, None, etag
@@ -0,0 +1,174 @@
+'''
+ingest.py
+
+Tracking of the newest data received from Teragon, for polling clients. The
+log records the newest time step with data of each location (by endpoint and
+interval), as tables are fetched, or streamed to clients. A response's
+watermark is the first of its time steps that may still be new or revised:
+the newest hour of data received for the least up-to-date of its locations
+(which Teragon may still revise, see rainfall.live) and everything after it.
+A client that passes the watermark back as `since` is sent only those steps.
+
+Only the last day of each fetched table is searched for a location's newest
+data, so that locations without any (e.g. a gauge that's offline) don't each
+cost a search of the whole table; streamed tables are noted a row at a time,
+as they pass through. A location that no data has been received for holds
+the watermark of the requests for it at the start of their window.
+
+'''
+
+# standard library
+import math
+import threading
+from datetime import datetime, timedelta
+
+from rainfall.live import OVERLAP
+from rainfall.teragon import STEPS
+
+# how far back from its newest row a table is searched for each location's
+# newest data
+HORIZON = timedelta(days=1)
+
+
+def latest_by_column(matrix, horizon=None):
+    """the newest time step of each column of a matrix that has any data (an
+    empty cell, i.e. no rainfall, counts as data; 'N/D' doesn't)
+
+    Arguments:
+        matrix {RainfallMatrix} -- the data
+
+    Keyword Arguments:
+        horizon {timedelta} -- only search the rows this close to the
+        matrix's newest row (default: {None}, all of them)
+
+    Returns:
+        {dict} -- each step's ISO 8601 timestamp, by location id, for the
+        columns with data
+    """
+    n, values, blanks = matrix.ncols, matrix.values, matrix.blanks
+    isnan = math.isnan
+    oldest = None
+    if horizon is not None and matrix.nrows:
+        oldest = (datetime.fromisoformat(matrix.timestamps[-1]) - horizon).isoformat()
+    latest = {}
+    remaining = range(n)
+    for i in range(matrix.nrows - 1, -1, -1):
+        ts = matrix.timestamps[i]
+        if oldest is not None and ts < oldest:
+            break
+        base = i * n
+        left = []
+        for j in remaining:
+            k = base + j
+            if not isnan(values[k]) or (blanks is not None and blanks[k]):
+                latest[matrix.ids[j]] = ts
+            else:
+                left.append(j)
+        remaining = left
+        if not remaining:
+            break
+    return latest
+
+
+def watch_rows(ids, rows, latest):
+    """pass a table's rows through as they're streamed (see
+    rainfall.matrix.iter_csv), noting the newest time step of each location
+    with data, as latest_by_column does for a whole matrix
+
+    Arguments:
+        ids {list} -- the table's location ids
+        rows {iterable} -- (ISO 8601 timestamp, rendered values) pairs, in
+        time order
+        latest {dict} -- updated with each step's timestamp, by location id,
+        for the locations with data so far
+
+    Returns:
+        {generator} -- the rows
+    """
+    for ts, values in rows:
+        for location, value in zip(ids, values):
+            # an empty cell ('') counts as data; 'N/D' (None) doesn't
+            if value is not None:
+                latest[location] = ts
+        yield ts, values
+
+
+def watermark(start, end, interval, latest):
+    """the first time step of a window that may still be new or revised
+
+    Arguments:
+        start {datetime} -- start of the window
+        end {datetime} -- end of the window
+        interval {str} -- Teragon interval
+        latest {datetime} -- the newest time step received with data, or
+        None if there's none
+
+    Returns:
+        {datetime}
+    """
+    if latest is None:
+        return start
+    return max(start, min(end, latest + STEPS[interval]) - OVERLAP)
+
+
+class IngestLog(object):
+    """The newest time step with data received from Teragon, by endpoint,
+    interval and location.
+    """
+
+    def __init__(self, horizon=HORIZON):
+        """
+        Keyword Arguments:
+            horizon {timedelta} -- how far back from its newest row each
+            table is searched for data (default: {HORIZON})
+        """
+        self.horizon = horizon
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def record(self, url, interval, matrix):
+        """record a table received from Teragon
+
+        Arguments:
+            url {str} -- Teragon API endpoint
+            interval {str} -- Teragon interval
+            matrix {RainfallMatrix} -- the table
+        """
+        self.record_latest(url, interval, latest_by_column(matrix, self.horizon))
+
+    def record_latest(self, url, interval, received):
+        """record the newest time steps with data of some locations, e.g. as
+        noted by watch_rows
+
+        Arguments:
+            url {str} -- Teragon API endpoint
+            interval {str} -- Teragon interval
+            received {dict} -- ISO 8601 timestamps, by location id
+        """
+        if not received:
+            return
+        with self._lock:
+            latest = self._latest.setdefault((url, interval), {})
+            for location, ts in received.items():
+                ts = datetime.fromisoformat(ts)
+                if ts > latest.get(location, datetime.min):
+                    latest[location] = ts
+
+    def latest(self, url, interval, ids):
+        """the newest time step with data received for all of some locations
+
+        Arguments:
+            url {str} -- Teragon API endpoint
+            interval {str} -- Teragon interval
+            ids {list} -- the location ids
+
+        Returns:
+            {datetime} -- the oldest of the locations' newest steps, or None
+            if nothing has been received for one of them
+        """
+        with self._lock:
+            latest = self._latest.get((url, interval), {})
+            steps = [latest.get(location) for location in ids]
+        if not steps or None in steps:
+            return None
+        return min(steps)
@@ -0,0 +1,231 @@
+'''
+live.py
+
+An in-memory cache for recent ("live") windows, such as the default last 24
+hours. Each cached window keeps its matrix and the responses rendered from
+it. Once a window is older than its interval's TTL (or as the window slides
+forward), only its newest hour is requested again and spliced onto the
+cached matrix; a background thread does so ahead of time for windows that
+are in use.
+
+'''
+
+# standard library
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from rainfall.coalesce import SingleFlight
+from rainfall.matrix import RainfallMatrix
+from rainfall.teragon import payload_ids, payload_window, payload_with_window
+
+logger = logging.getLogger(__name__)
+
+# the newest data may still be revised, so refreshes request it again; this
+# is the smallest window the payloads can express
+OVERLAP = timedelta(hours=1)
+
+
+class _Entry(object):
+    """A cached window. Entries aren't modified once cached; refreshing a
+    window replaces its entry.
+    """
+
+    def __init__(self, url, payload, matrix):
+        self.url = url
+        self.payload = payload
+        self.start, self.end = payload_window(payload)
+        self.matrix = matrix
+        self.rendered = {}
+        self.refreshed = self.accessed = time.monotonic()
+
+    @property
+    def cells(self):
+        """the size of the entry: the cells of the matrix and of each
+        response rendered from it
+        """
+        return self.matrix.nrows * self.matrix.ncols * (1 + len(self.rendered))
+
+
+class LiveCache(object):
+    """LRU cache of recent windows, bounded by size."""
+
+    def __init__(self, fetch, ttl, max_cells):
+        """
+        Arguments:
+            fetch {function} -- fetches a payload from a url, returning a
+            RainfallMatrix
+            ttl {dict} -- seconds a window is served for before being
+            refreshed, by interval
+            max_cells {int} -- maximum size of the cache, in cells
+        """
+        self._fetch = fetch
+        self.ttl = ttl
+        self.max_cells = max_cells
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        self._hits = self._refreshes = 0
+
+    @staticmethod
+    def _key(url, payload):
+        """live windows are keyed by what they request and for how long, but
+        not when, so that they slide forward
+        """
+        kind, ids = payload_ids(payload)
+        start, end = payload_window(payload)
+        return (url, kind, tuple(ids), payload['interval'],
+                bool(payload.get('zerofill')), end - start)
+
+    def get(self, url, payload):
+        """get the cached entry for a window, fetching or refreshing it as
+        needed
+
+        Arguments:
+            url {str} -- Teragon API endpoint
+            payload {dict} -- Teragon API payload
+
+        Returns:
+            {_Entry} -- the window's entry, or None if the payload is for an
+            older window than the one cached
+        """
+        key = self._key(url, payload)
+        start, end = payload_window(payload)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None and start < entry.start:
+            return None
+
+        if entry is None or (entry.start, entry.end) != (start, end) or self._stale(entry):
+            entry = self._flights.do(
+                (key, start, end),
+                lambda: self._refresh(key, url, payload, self.ttl[payload['interval']])
+            )
+        else:
+            with self._lock:
+                self._hits += 1
+        entry.accessed = time.monotonic()
+        return entry
+
+    def render(self, entry, key, fn):
+        """get a response rendered from an entry's matrix, rendering it
+        with fn the first time
+
+        Arguments:
+            entry {_Entry} -- a cached window
+            key {hashable} -- identifies the rendering
+            fn {function} -- renders the response
+
+        Returns:
+            {object} -- the response, which must not be modified
+        """
+        result = entry.rendered.get(key)
+        if result is None:
+            result = entry.rendered[key] = fn()
+            with self._lock:
+                self._evict()
+        return result
+
+    def _stale(self, entry, share=1.0):
+        """whether an entry is older than (a share of) its TTL"""
+        age = time.monotonic() - entry.refreshed
+        return age > self.ttl[entry.payload['interval']] * share
+
+    def _refresh(self, key, url, payload, max_age):
+        """fetch a window, re-using as much of the cached entry as possible:
+        the rows of the cached entry that are still in the window are kept,
+        except its newest hour, which is fetched again along with any newer
+        rows
+
+        Returns:
+            {_Entry} -- the new entry
+        """
+        start, end = payload_window(payload)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and (entry.start, entry.end) == (start, end) \
+                and time.monotonic() - entry.refreshed <= max_age:
+            return entry
+
+        if entry is None or start < entry.start or start >= entry.end - OVERLAP:
+            matrix = self._fetch(url, payload)
+        else:
+            a = max(start, entry.end - OVERLAP)
+            fresh = self._fetch(url, payload_with_window(payload, a, end))
+            if fresh.ids != entry.matrix.ids:
+                fresh = fresh.take_columns(entry.matrix.ids)
+            kept = entry.matrix.take_rows(start.isoformat(), a.isoformat())
+            matrix = RainfallMatrix.vstack([kept, fresh])
+
+        entry = _Entry(url, payload, matrix)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._refreshes += 1
+            self._evict()
+        return entry
+
+    def _evict(self):
+        """drop the least recently used entries until the cache fits"""
+        total = sum(e.cells for e in self._entries.values())
+        while total > self.max_cells and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            total -= entry.cells
+
+    def refresh(self, idle=4):
+        """refresh the entries that are past half their TTL, so that requests
+        rarely wait for a refresh; entries that haven't been requested for
+        idle TTLs are dropped instead
+        """
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._entries.items())
+        for key, entry in entries:
+            ttl = self.ttl[entry.payload['interval']]
+            if now - entry.accessed > ttl * idle:
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+            elif self._stale(entry, 0.5):
+                try:
+                    self._flights.do(
+                        (key, entry.start, entry.end),
+                        lambda: self._refresh(key, entry.url, entry.payload, ttl * 0.5)
+                    )
+                except Exception as e:
+                    logger.warning("live cache refresh failed: %s %r", key[:2], e)
+
+    def start_refresher(self, every):
+        """refresh entries in a background thread
+
+        Arguments:
+            every {float} -- seconds between refreshes
+        """
+        def run():
+            while True:
+                time.sleep(every)
+                self.refresh()
+
+        thread = threading.Thread(target=run, name="live-cache-refresher")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def stats(self):
+        """counters for the cache
+
+        Returns:
+            {dict} -- entries, cells held, requests served from the cache, and
+            refreshes (including first fetches)
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "cells": sum(e.cells for e in self._entries.values()),
+                "hits": self._hits,
+                "refreshes": self._refreshes,
+            }
@@ -0,0 +1,384 @@
+'''
+matrix.py
+
+A columnar, in-memory representation of a Teragon rainfall table: a vector of
+timestamps, a vector of location ids (GARR pixels or rain gauges), and a
+row-major matrix of rainfall values stored in a flat array of doubles.
+
+Teragon's CSV is parsed once into this structure; the JSON structures returned
+by the API are rendered from it.
+
+'''
+
+# standard library
+import codecs
+import csv
+import io
+from array import array
+from itertools import compress
+# data transformation
+from sortedcontainers import SortedDict
+
+from rainfall.timestamps import to_iso
+
+# missing values (Teragon's 'N/D' and empty cells) are stored as NaN
+NAN = float('nan')
+
+
+def _iter_lines(teragon_csv):
+    """normalize the supported CSV sources into an iterable of text lines
+
+    Arguments:
+        teragon_csv {str|bytes|iterable} -- CSV content as text or bytes, or
+        an iterable of lines (e.g., an open file)
+
+    Returns:
+        {iterable} -- lines of text, ready for csv.reader
+    """
+    if isinstance(teragon_csv, bytes):
+        teragon_csv = teragon_csv.decode('utf-8')
+    if isinstance(teragon_csv, str):
+        return io.StringIO(teragon_csv, newline='')
+    return (l.decode('utf-8') if isinstance(l, bytes) else l for l in teragon_csv)
+
+
+def decode_lines(chunks, encoding='utf-8'):
+    """decode a body received in chunks of bytes (e.g., Teragon's response,
+    as it arrives) into lines of text, holding no more than a chunk and a
+    partial line at a time
+
+    Arguments:
+        chunks {iterable} -- chunks of bytes
+        encoding {str} -- the body's character encoding (default: 'utf-8')
+
+    Returns:
+        {generator} -- lines of text, with their line endings
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    rest = ''
+    for chunk in chunks:
+        lines = (rest + decoder.decode(chunk)).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    rest += decoder.decode(b'', final=True)
+    if rest:
+        yield rest
+
+
+def _read_header(teragon_csv):
+    """start reading Teragon's CSV
+
+    Returns:
+        {tuple} -- (csv reader positioned after the header, location ids)
+    """
+    reader = csv.reader(_iter_lines(teragon_csv))
+    header = next(reader, [])
+    # the id columns are every other column after 'Timestamp'; a trailing
+    # unpaired column is ignored
+    n = (len(header) - 1) // 2
+    return reader, header[1:1 + 2 * n:2]
+
+
+def _cell(c):
+    """render a CSV cell the way RainfallMatrix does: 'N/D' (and cells missing
+    from short rows) as None, empty cells as '', and values as floats
+    """
+    if c is None or c == 'N/D':
+        return None
+    return float(c) if c else c
+
+
+def iter_csv(teragon_csv):
+    """parse Teragon's CSV one row at a time, e.g. while it's still being
+    received, rather than collecting it into a RainfallMatrix
+
+    Arguments:
+        teragon_csv {str|bytes|iterable} -- the CSV response
+
+    Returns:
+        {tuple} -- (location ids, generator of (ISO 8601 timestamp, values)),
+        with values rendered as in RainfallMatrix.row
+    """
+    reader, ids = _read_header(teragon_csv)
+    n = len(ids)
+    stop = 1 + 2 * n
+
+    def rows():
+        for row in reader:
+            if not row or row[0].upper() == 'TOTAL':
+                continue
+            cells = row[1:stop:2]
+            if len(cells) < n:
+                cells.extend([None] * (n - len(cells)))
+            yield to_iso(row[0]), [_cell(c) for c in cells]
+
+    return ids, rows()
+
+
+class RainfallMatrix(object):
+    """Rainfall values for a set of locations over a set of timestamps.
+
+    Values are kept row-major (one row per timestamp, one column per location)
+    in a flat array of doubles. Missing values are NaN; a parallel bytearray
+    records which of those were empty cells (rendered as '') rather than
+    Teragon's 'N/D' (rendered as None), which keeps the output identical to
+    the original petl-based transform.
+    """
+
+    def __init__(self, timestamps, ids, values, blanks=None):
+        """
+        Arguments:
+            timestamps {list} -- ISO 8601 timestamp strings, one per row
+            ids {list} -- location ids, one per column
+            values {array} -- array('d') of len(timestamps) * len(ids) values
+            blanks {bytearray} -- optional flags marking NaN values that were
+            empty cells (default: None, meaning all NaNs are 'N/D')
+        """
+        self.timestamps = timestamps
+        self.ids = ids
+        self.values = values
+        self.blanks = blanks
+
+    @property
+    def nrows(self):
+        return len(self.timestamps)
+
+    @property
+    def ncols(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_csv(cls, teragon_csv):
+        """parse Teragon's CSV response into a RainfallMatrix.
+
+        Teragon's table has a 'Timestamp' column followed by a pair of columns
+        for each location: the first holds the rainfall value (and is headed
+        with the location id), the second holds notes, which are dropped. The
+        trailing 'Total' row is dropped as well.
+
+        Arguments:
+            teragon_csv {str|bytes|iterable} -- the CSV response
+
+        Returns:
+            {RainfallMatrix} -- the parsed table
+        """
+        reader, ids = _read_header(teragon_csv)
+        n = len(ids)
+        stop = 1 + 2 * n
+
+        timestamps = []
+        values = array('d')
+        blanks = None
+        padding = [None] * n
+
+        for row in reader:
+            if not row or row[0].upper() == 'TOTAL':
+                continue
+            timestamps.append(to_iso(row[0]))
+            cells = row[1:stop:2]
+            if len(cells) < n:
+                # short rows are padded with missing values
+                cells.extend(padding[len(cells):])
+            values.extend([
+                float(c) if c and c != 'N/D' else NAN for c in cells
+            ])
+            if '' in cells:
+                if blanks is None:
+                    blanks = bytearray(len(values) - n)
+                blanks.extend([c == '' for c in cells])
+            elif blanks is not None:
+                blanks.extend(bytes(n))
+
+        return cls(timestamps, ids, values, blanks)
+
+    @classmethod
+    def vstack(cls, matrices):
+        """stack matrices with the same ids on top of each other, in order
+
+        Arguments:
+            matrices {list} -- RainfallMatrix objects sharing the same ids
+
+        Returns:
+            {RainfallMatrix} -- a matrix with the rows of all of them
+        """
+        ids = matrices[0].ids
+        timestamps = []
+        values = array('d')
+        blanks = None
+        if any(m.blanks is not None for m in matrices):
+            blanks = bytearray()
+        for m in matrices:
+            timestamps.extend(m.timestamps)
+            values.extend(m.values)
+            if blanks is not None:
+                blanks.extend(m.blanks if m.blanks is not None else bytes(len(m.values)))
+        return cls(timestamps, list(ids), values, blanks)
+
+    @classmethod
+    def hstack(cls, matrices):
+        """place matrices for different ids side by side, in order. Rows are
+        matched up by timestamp; a timestamp missing from one of the matrices
+        is filled with empty values for its ids.
+
+        Arguments:
+            matrices {list} -- RainfallMatrix objects
+
+        Returns:
+            {RainfallMatrix} -- a matrix with the columns of all of them
+        """
+        ids = [c for m in matrices for c in m.ids]
+        timestamps = matrices[0].timestamps
+        aligned = all(m.timestamps == timestamps for m in matrices)
+        if not aligned:
+            timestamps = sorted(set(ts for m in matrices for ts in m.timestamps))
+        nrows, n = len(timestamps), len(ids)
+
+        values = array('d', [NAN]) * (nrows * n)
+        blanks = None
+        if not aligned or any(m.blanks is not None for m in matrices):
+            blanks = bytearray([not aligned]) * (nrows * n)
+
+        position = {ts: i for i, ts in enumerate(timestamps)}
+        offset = 0
+        for m in matrices:
+            rows = range(nrows) if aligned else [position[ts] for ts in m.timestamps]
+            for i, r in enumerate(rows):
+                start = r * n + offset
+                values[start:start + m.ncols] = m.values[i * m.ncols:(i + 1) * m.ncols]
+                if blanks is not None:
+                    if m.blanks is not None:
+                        blanks[start:start + m.ncols] = m.blanks[i * m.ncols:(i + 1) * m.ncols]
+                    else:
+                        blanks[start:start + m.ncols] = bytes(m.ncols)
+            offset += m.ncols
+        return cls(list(timestamps), ids, values, blanks)
+
+    def take_columns(self, ids):
+        """a new matrix with only the given ids, in the given order; ids that
+        are not in this matrix are filled with missing ('N/D') values
+        """
+        n = self.ncols
+        nrows = self.nrows
+        position = {c: j for j, c in enumerate(self.ids)}
+        values = array('d', [NAN]) * (nrows * len(ids))
+        blanks = None if self.blanks is None else bytearray(len(values))
+        for k, c in enumerate(ids):
+            j = position.get(c)
+            if j is None:
+                continue
+            values[k::len(ids)] = self.values[j::n]
+            if blanks is not None:
+                blanks[k::len(ids)] = self.blanks[j::n]
+        return RainfallMatrix(list(self.timestamps), list(ids), values, blanks)
+
+    def take_rows(self, start, end=None):
+        """a new matrix with only the rows with timestamps in [start, end)
+
+        Arguments:
+            start {str} -- ISO 8601 timestamp (inclusive)
+            end {str} -- ISO 8601 timestamp (exclusive), or None for all the
+            rows from start on (default: None)
+        """
+        n = self.ncols
+        rows = [
+            i for i, ts in enumerate(self.timestamps)
+            if start <= ts and (end is None or ts < end)
+        ]
+        values = array('d')
+        blanks = None if self.blanks is None else bytearray()
+        for i in rows:
+            values.extend(self.values[i * n:(i + 1) * n])
+            if blanks is not None:
+                blanks.extend(self.blanks[i * n:(i + 1) * n])
+        return RainfallMatrix(
+            [self.timestamps[i] for i in rows], list(self.ids), values, blanks)
+
+    def zero_blanks(self):
+        """the values, with empty cells (which Teragon returns for zero
+        rainfall) as 0.0 rather than NaN; 'N/D' cells are still NaN
+        """
+        values = self.values
+        if self.blanks is not None:
+            values = array('d', values)
+            for k in compress(range(len(values)), self.blanks):
+                values[k] = 0.0
+        return values
+
+    def _missing(self, k):
+        """the rendered value for the missing cell at flat index k"""
+        if self.blanks is not None and self.blanks[k]:
+            return ''
+        return None
+
+    def row(self, i):
+        """rendered values for row i (a timestamp), in column order
+        """
+        n = self.ncols
+        start = i * n
+        row = self.values[start:start + n].tolist()
+        return [
+            v if v == v else self._missing(start + j)
+            for j, v in enumerate(row)
+        ]
+
+    def column(self, j):
+        """rendered values for column j (a location), in row order. This reads
+        a strided view over the row-major values, so no transposed copy of the
+        matrix is ever made.
+        """
+        n = self.ncols
+        col = self.values[j::n].tolist()
+        return [
+            v if v == v else self._missing(i * n + j)
+            for i, v in enumerate(col)
+        ]
+
+    def iter_rows(self, by_location=False, ordered=False):
+        """iterate over the rendered rows (or, if by_location, the columns)
+
+        Arguments:
+            by_location {bool} -- iterate over locations rather than timestamps
+            ordered {bool} -- iterate in sorted order of the keys
+
+        Returns:
+            {tuple} -- (inner keys, generator of (key, values))
+        """
+        outer, inner, get = self._axes(by_location)
+        order = range(len(outer))
+        if ordered:
+            order = sorted(order, key=outer.__getitem__)
+        return inner, ((outer[i], get(i)) for i in order)
+
+    def _axes(self, by_location):
+        """(outer keys, inner keys, accessor) for rendering keyed by time
+        (one row at a time) or by location (one column at a time)
+        """
+        if by_location:
+            return self.ids, self.timestamps, self.column
+        return self.timestamps, self.ids, self.row
+
+    def to_indexed(self, by_location=False):
+        """render the matrix as nested dictionaries, keyed first by timestamp
+        and then by id: {timestamp: {id: value}}; or, if by_location, first by
+        id and then by timestamp: {id: {timestamp: value}}
+        """
+        outer, inner, get = self._axes(by_location)
+        data = SortedDict()
+        for i, key in enumerate(outer):
+            data[key] = SortedDict(zip(inner, get(i)))
+        return data
+
+    def to_records(self, by_location=False):
+        """render the matrix as nested records:
+        [{"id": timestamp, "d": [{"id": id, "v": value}]}], or, if
+        by_location, [{"id": id, "d": [{"id": timestamp, "v": value}]}]
+        """
+        outer, inner, get = self._axes(by_location)
+        return [
+            {
+                "id": key,
+                "d": [{'id': c, 'v': v} for c, v in zip(inner, get(i))]
+            }
+            for i, key in enumerate(outer)
+        ]
@@ -0,0 +1,180 @@
+'''
+metrics.py
+
+Per-request stage timings, aggregated into histograms and rendered in the
+Prometheus text format.
+
+A request's timings are collected in a RequestTimings object held in a context
+variable, so that any code running on the request's behalf (including its
+fanned-out sub-requests) can record stages with `stage()` without it being
+passed around. When the request ends, its timings are added to the histograms
+under a small, fixed set of labels.
+
+'''
+
+# standard library
+import contextvars
+import threading
+import timeit
+from contextlib import contextmanager
+
+# histogram buckets, in seconds and in bytes
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+# the timings of the request being handled, if any
+current = contextvars.ContextVar("request_timings", default=None)
+
+
+def count_bucket(count):
+    """a coarse bucket for a number of locations, usable as a label
+
+    Arguments:
+        count {int} -- number of pixels or gauges
+
+    Returns:
+        {str} -- "0", "1", "2-10", "11-100", "101-1000", or "1001+"
+    """
+    if count <= 1:
+        return str(max(count, 0))
+    for limit, label in ((10, "2-10"), (100, "11-100"), (1000, "101-1000")):
+        if count <= limit:
+            return label
+    return "1001+"
+
+
+class Histogram(object):
+    """A labeled histogram with fixed buckets."""
+
+    def __init__(self, name, help, labelnames, buckets):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        """add an observation
+
+        Arguments:
+            labels {tuple} -- label values, in the order of labelnames
+            value {float} -- the observed value
+        """
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        """the histogram in the Prometheus text format"""
+        lines = [
+            "# HELP {0} {1}".format(self.name, self.help),
+            "# TYPE {0} histogram".format(self.name),
+        ]
+        with self._lock:
+            series = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._series.items())
+        for labels, (counts, total, count) in series:
+            pairs = ['{0}="{1}"'.format(n, v) for n, v in zip(self.labelnames, labels)]
+            for bound, c in zip(self.buckets, counts):
+                lines.append('{0}_bucket{{{1}}} {2}'.format(
+                    self.name, ",".join(pairs + ['le="{0:g}"'.format(bound)]), c))
+            lines.append('{0}_bucket{{{1}}} {2}'.format(
+                self.name, ",".join(pairs + ['le="+Inf"']), count))
+            lines.append('{0}_sum{{{1}}} {2:.6f}'.format(self.name, ",".join(pairs), total))
+            lines.append('{0}_count{{{1}}} {2}'.format(self.name, ",".join(pairs), count))
+        return "\n".join(lines)
+
+
+class RequestTimings(object):
+    """The stage timings of a single request."""
+
+    def __init__(self):
+        self.started = timeit.default_timer()
+        self.stages = []
+        self.bytes = []
+        self.labels = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.stages.append((name, seconds))
+
+    def add_bytes(self, count):
+        with self._lock:
+            self.bytes.append(count)
+
+    def elapsed(self):
+        return timeit.default_timer() - self.started
+
+    def summary(self):
+        """total seconds by stage"""
+        totals = {}
+        with self._lock:
+            for name, seconds in self.stages:
+                totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+
+@contextmanager
+def stage(name):
+    """time a stage of the current request (if there is one)
+
+    Arguments:
+        name {str} -- the stage, e.g. "upstream" or "csv"
+    """
+    start = timeit.default_timer()
+    try:
+        yield
+    finally:
+        timings = current.get()
+        if timings is not None:
+            timings.add(name, timeit.default_timer() - start)
+
+
+def record_bytes(count):
+    """record bytes received from upstream for the current request"""
+    timings = current.get()
+    if timings is not None:
+        timings.add_bytes(count)
+
+
+class Metrics(object):
+    """The API's histograms."""
+
+    LABELS = ("endpoint", "interval", "locations")
+
+    def __init__(self):
+        self.requests = Histogram(
+            "rainfall_request_seconds", "Time to handle requests.",
+            self.LABELS + ("status",), TIME_BUCKETS)
+        self.stages = Histogram(
+            "rainfall_stage_seconds", "Time spent in each stage of handling requests.",
+            self.LABELS + ("stage",), TIME_BUCKETS)
+        self.upstream_bytes = Histogram(
+            "rainfall_upstream_bytes", "Size of the responses received from Teragon.",
+            self.LABELS, BYTE_BUCKETS)
+
+    def record(self, timings, status):
+        """add a finished request's timings to the histograms
+
+        Arguments:
+            timings {RequestTimings} -- the request's timings
+            status {int} -- the response's status code
+        """
+        labels = tuple(timings.labels.get(n, "") for n in self.LABELS)
+        self.requests.observe(labels + (str(status),), timings.elapsed())
+        for name, seconds in timings.stages:
+            self.stages.observe(labels + (name,), seconds)
+        for count in timings.bytes:
+            self.upstream_bytes.observe(labels, count)
+
+    def render(self):
+        """all histograms in the Prometheus text format"""
+        return "\n".join(
+            h.render() for h in (self.requests, self.stages, self.upstream_bytes)) + "\n"
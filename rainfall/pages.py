@@ -0,0 +1,140 @@
+'''
+pages.py
+
+Cursor pagination of large requests. A request is split into pages, each of
+which is a bounded payload of its own: a span of time (a whole number of
+hours, as Teragon's windows are), or, when keyed by location, a slice of the
+locations. A cursor is an opaque token for the next page, tied to the request
+it came from and to the window of time resolved for its first page, so that
+paging through a relative window (e.g., the last 24 hours) isn't thrown off
+when the hour rolls over.
+
+'''
+
+# standard library
+import base64
+import json
+import zlib
+from datetime import datetime, timedelta
+
+from rainfall.teragon import STEPS, payload_ids, payload_key, payload_window, payload_with_ids, payload_with_window
+
+HOUR = timedelta(hours=1)
+
+
+def request_token(payload):
+    """a short token identifying the data requested by a (whole) payload, so
+    that a cursor can't be applied to a different request
+
+    Arguments:
+        payload {dict} -- Teragon API payload
+
+    Returns:
+        {int}
+    """
+    return zlib.crc32(repr(payload_key(payload)).encode('utf-8'))
+
+
+def encode_cursor(position, size, token, window):
+    """make a cursor
+
+    Arguments:
+        position {str or int} -- the start of the page (an ISO 8601
+        date-time), or the offset of its first location
+        size {int} -- page size
+        token {int} -- the request's token
+        window {tuple} -- (start, end) datetimes of the whole request, as
+        resolved for its first page
+
+    Returns:
+        {str} -- the cursor, safe to use in a URL
+    """
+    text = json.dumps(
+        [position, size, token, window[0].isoformat(), window[1].isoformat()],
+        separators=(',', ':'))
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii').rstrip("=")
+
+
+def decode_cursor(cursor):
+    """read a cursor made with encode_cursor
+
+    Arguments:
+        cursor {str} -- the cursor
+
+    Raises:
+        ValueError: if the cursor is malformed
+
+    Returns:
+        {tuple} -- (position, size, token, (start, end))
+    """
+    try:
+        text = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position, size, token, start, end = json.loads(text.decode('utf-8'))
+        window = (datetime.fromisoformat(start), datetime.fromisoformat(end))
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError("malformed cursor")
+    if not isinstance(position, (str, int)) or not isinstance(size, int) or size < 1:
+        raise ValueError("malformed cursor")
+    return position, size, token, window
+
+
+def time_span(payload, size, unit=None):
+    """the time covered by pages of a number of time steps: a whole number of
+    hours, and of units (e.g. aggregation buckets), so that no hour or unit is
+    split between pages
+
+    Arguments:
+        payload {dict} -- Teragon API payload
+        size {int} -- time steps per page
+        unit {timedelta} -- pages span a multiple of this (default: None)
+
+    Returns:
+        {timedelta}
+    """
+    unit = unit or HOUR
+    whole = unit
+    while whole % HOUR:
+        whole += unit
+    span = STEPS[payload['interval']] * size
+    return max(-(-span // whole), 1) * whole
+
+
+def time_page(payload, start, span):
+    """the payload for the page of time starting at start
+
+    Arguments:
+        payload {dict} -- Teragon API payload for the whole request
+        start {datetime} -- start of the page
+        span {timedelta} -- time covered by a page
+
+    Returns:
+        {tuple} -- (payload for the page, end of the page, start of the next
+        page or None if this is the last one)
+    """
+    end = payload_window(payload)[1]
+    page_end = min(start + span, end)
+    return (
+        payload_with_window(payload, start, page_end),
+        page_end,
+        page_end if page_end < end else None
+    )
+
+
+def location_page(payload, offset, size):
+    """the payload for the page of locations starting at offset
+
+    Arguments:
+        payload {dict} -- Teragon API payload for the whole request
+        offset {int} -- index of the page's first location
+        size {int} -- locations per page
+
+    Returns:
+        {tuple} -- (payload for the page, offset of the next page or None if
+        this is the last one)
+    """
+    ids = payload_ids(payload)[1]
+    following = offset + size
+    return (
+        payload_with_ids(payload, ids[offset:following]),
+        following if following < len(ids) else None
+    )
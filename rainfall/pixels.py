@@ -0,0 +1,103 @@
+'''
+pixels.py
+
+Compact integer codes for GARR pixels. A pixel's code is its grid column and
+row packed into a single integer, column * 1000 + row: the number in the PIXEL
+column of grid.csv. Pixel "123-456" (as in Teragon's responses and the
+geojson grid) is "123,456" in Teragon payloads, and 123456 as a code.
+
+A PixelTable, built once from the grid, holds every pixel's code with lookup
+arrays to its grid row and to each of the string formats, so that converting
+a selection of pixels between formats is a lookup per pixel rather than
+string splitting and formatting.
+
+'''
+
+# standard library
+import re
+from array import array
+
+_SEPARATOR = re.compile(r'[-,]')
+
+
+def encode(pixel_id):
+    """the code of a pixel id in any format
+
+    Arguments:
+        pixel_id {str or int} -- "123-456", "123,456", "123456", or 123456
+
+    Raises:
+        ValueError: if the id isn't a pixel id, or its row is outside the
+        lattice (0 to 999)
+
+    Returns:
+        {int} -- e.g. 123456
+    """
+    if isinstance(pixel_id, int):
+        code = pixel_id
+    else:
+        parts = _SEPARATOR.split(pixel_id.strip())
+        if len(parts) == 2:
+            column, row = int(parts[0]), int(parts[1])
+            # a row past the lattice's would be another pixel's code
+            if not 0 <= row < 1000 or column < 0:
+                raise ValueError("not a pixel id: {0!r}".format(pixel_id))
+            code = column * 1000 + row
+        elif len(parts) == 1:
+            code = int(parts[0])
+        else:
+            raise ValueError("not a pixel id: {0!r}".format(pixel_id))
+    if code < 0:
+        raise ValueError("not a pixel id: {0!r}".format(pixel_id))
+    return code
+
+
+def dashed(code):
+    """the "123-456" id of a pixel code"""
+    return "{0}-{1}".format(*divmod(code, 1000))
+
+
+def teragon(code):
+    """the "123,456" id of a pixel code, as in Teragon payloads"""
+    return "{0},{1}".format(*divmod(code, 1000))
+
+
+class PixelTable(object):
+    """The pixels of the grid, by code, with their ids in each format."""
+
+    def __init__(self, codes):
+        """
+        Arguments:
+            codes {iterable} -- the codes of the grid's pixels, in grid order
+        """
+        self.codes = array('l', codes)
+        self.rows = {c: k for k, c in enumerate(self.codes)}
+        self.dashed = [dashed(c) for c in self.codes]
+        self.teragon = [teragon(c) for c in self.codes]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def to_dashed(self, codes):
+        """the "123-456" ids of some pixels
+
+        Arguments:
+            codes {iterable} -- pixel codes
+
+        Returns:
+            {list} -- pixel ids
+        """
+        rows, ids = self.rows, self.dashed
+        return [ids[rows[c]] if c in rows else dashed(c) for c in codes]
+
+    def to_teragon(self, codes):
+        """the pixels argument of a Teragon payload for some pixels
+
+        Arguments:
+            codes {iterable} -- pixel codes
+
+        Returns:
+            {str} -- e.g. "123,456;123,457"
+        """
+        rows, ids = self.rows, self.teragon
+        return ";".join(ids[rows[c]] if c in rows else teragon(c) for c in codes)
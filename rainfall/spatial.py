@@ -0,0 +1,205 @@
+'''
+spatial.py
+
+A spatial index over the GARR grid, for selecting pixels by a lon/lat point,
+a bounding box, or a GeoJSON polygon without any geometry work on the
+client.
+
+The grid is loaded once from grid.csv. The pixels are binned into a regular
+lon/lat lattice about the size of a pixel, so a lookup only ever tests the
+handful of pixels in the bins it touches.
+
+'''
+
+# standard library
+import csv
+import math
+from array import array
+
+
+def _ring_contains(ring, x, y):
+    """ray casting test for a point in a ring of (x, y) vertices"""
+    inside = False
+    x1, y1 = ring[-1]
+    for x2, y2 in ring:
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def _polygon_contains(rings, x, y):
+    """point in polygon test, for a polygon given as an exterior ring and
+    optional holes
+    """
+    return sum(_ring_contains(r, x, y) for r in rings) % 2 == 1
+
+
+def _parse_wkt_polygon(wkt):
+    """the exterior ring of a WKT 'POLYGON ((x y, ...))', as (x, y) tuples"""
+    coords = wkt[wkt.index('((') + 2:wkt.index(')')]
+    return [tuple(map(float, c.split())) for c in coords.split(',')]
+
+
+def geometry_polygons(geometry):
+    """get the polygons of a GeoJSON geometry (or a Feature, or a
+    FeatureCollection), each as a list of rings of (x, y) tuples
+
+    Arguments:
+        geometry {dict} -- GeoJSON object
+
+    Returns:
+        {list} -- polygons
+
+    Raises:
+        ValueError -- if the GeoJSON isn't (multi)polygonal
+    """
+    kind = geometry.get('type') if isinstance(geometry, dict) else None
+    if kind == 'FeatureCollection':
+        return [p for f in geometry.get('features') or [] for p in geometry_polygons(f)]
+    if kind == 'Feature':
+        return geometry_polygons(geometry.get('geometry'))
+    try:
+        if kind == 'Polygon':
+            polygons = [geometry['coordinates']]
+        elif kind == 'MultiPolygon':
+            polygons = geometry['coordinates']
+        else:
+            raise ValueError("expected a GeoJSON Polygon or MultiPolygon")
+        polygons = [
+            [[(float(c[0]), float(c[1])) for c in ring] for ring in polygon]
+            for polygon in polygons
+        ]
+    except (KeyError, IndexError, TypeError) as e:
+        raise ValueError("invalid GeoJSON coordinates: {0}".format(e))
+    if not polygons or any(not p or any(len(r) < 3 for r in p) for p in polygons):
+        raise ValueError("invalid GeoJSON coordinates: empty polygon or ring")
+    return polygons
+
+
+class PixelIndex(object):
+    """Spatial index over the GARR pixels."""
+
+    def __init__(self, path):
+        """
+        Arguments:
+            path {str} -- path to grid.csv (WKT, PIXEL, X, Y columns)
+        """
+        self.codes = array('l')
+        self.centroids = []
+        self.quads = []
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                self.codes.append(int(row['PIXEL']))
+                self.centroids.append((float(row['X']), float(row['Y'])))
+                self.quads.append(_parse_wkt_polygon(row['WKT']))
+
+        # the lattice: bins about the size of a pixel, over the grid's extent
+        xs = [x for q in self.quads for x, y in q]
+        ys = [y for q in self.quads for x, y in q]
+        self.bounds = (min(xs), min(ys), max(xs), max(ys))
+        q = self.quads[0]
+        self._dx = max(x for x, y in q) - min(x for x, y in q)
+        self._dy = max(y for x, y in q) - min(y for x, y in q)
+
+        # each pixel is binned by its centroid (for range queries) and by the
+        # bins its extent overlaps (for point queries)
+        self._by_centroid = {}
+        self._by_extent = {}
+        for k, (x, y) in enumerate(self.centroids):
+            self._by_centroid.setdefault(self._bin(x, y), []).append(k)
+            q = self.quads[k]
+            i0, j0 = self._bin(min(x for x, y in q), min(y for x, y in q))
+            i1, j1 = self._bin(max(x for x, y in q), max(y for x, y in q))
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    self._by_extent.setdefault((i, j), []).append(k)
+
+    def _bin(self, x, y):
+        """the lattice bin of a point"""
+        return (
+            int(math.floor((x - self.bounds[0]) / self._dx)),
+            int(math.floor((y - self.bounds[1]) / self._dy))
+        )
+
+    def _bins(self, minx, miny, maxx, maxy):
+        """the lattice bins overlapping a bounding box, clipped to the grid"""
+        minx, miny = max(minx, self.bounds[0]), max(miny, self.bounds[1])
+        maxx, maxy = min(maxx, self.bounds[2]), min(maxy, self.bounds[3])
+        if minx > maxx or miny > maxy:
+            return []
+        i0, j0 = self._bin(minx, miny)
+        i1, j1 = self._bin(maxx, maxy)
+        return [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+
+    def _at(self, x, y):
+        """the index of the pixel containing a point, or None"""
+        for k in self._by_extent.get(self._bin(x, y), []):
+            if _ring_contains(self.quads[k], x, y):
+                return k
+        return None
+
+    def _codes(self, found):
+        """pixel codes for a set of pixel indexes, in grid order"""
+        return [self.codes[k] for k in sorted(found)]
+
+    def at(self, lon, lat):
+        """select the pixel containing a point
+
+        Arguments:
+            lon {float} -- longitude
+            lat {float} -- latitude
+
+        Returns:
+            {list} -- the pixel's code (see rainfall.pixels; empty if the
+            point is outside of the grid)
+        """
+        k = self._at(lon, lat)
+        return [] if k is None else [self.codes[k]]
+
+    def within_bbox(self, minlon, minlat, maxlon, maxlat):
+        """select the pixels whose centroids fall within a bounding box. A box
+        too small to contain any centroid selects the pixel at its center.
+
+        Returns:
+            {list} -- pixel codes
+        """
+        found = set()
+        for b in self._bins(minlon, minlat, maxlon, maxlat):
+            for k in self._by_centroid.get(b, []):
+                x, y = self.centroids[k]
+                if minlon <= x <= maxlon and minlat <= y <= maxlat:
+                    found.add(k)
+        if not found:
+            return self.at((minlon + maxlon) / 2.0, (minlat + maxlat) / 2.0)
+        return self._codes(found)
+
+    def within(self, geometry):
+        """select the pixels whose centroids fall within a GeoJSON polygon.
+        A polygon too small to contain any centroid selects the pixels its
+        vertices fall in.
+
+        Arguments:
+            geometry {dict} -- GeoJSON Polygon or MultiPolygon (or a Feature
+            or FeatureCollection of them)
+
+        Returns:
+            {list} -- pixel codes
+
+        Raises:
+            ValueError -- if the geometry isn't valid
+        """
+        polygons = geometry_polygons(geometry)
+        found = set()
+        for rings in polygons:
+            xs = [x for x, y in rings[0]]
+            ys = [y for x, y in rings[0]]
+            for b in self._bins(min(xs), min(ys), max(xs), max(ys)):
+                for k in self._by_centroid.get(b, []):
+                    if _polygon_contains(rings, *self.centroids[k]):
+                        found.add(k)
+        if not found:
+            for rings in polygons:
+                found.update(self._at(x, y) for x, y in rings[0])
+            found.discard(None)
+        return self._codes(found)
@@ -0,0 +1,287 @@
+'''
+store.py
+
+A persistent, memory-mapped local store of rainfall time series, so that
+historical data (which does not change) is requested from Teragon only once.
+
+Each series (one GARR pixel or rain gauge, at one interval) is a pair of flat
+files indexed by time step from a fixed epoch: one of doubles holding the
+values, and one of bytes recording the state of each step (not yet fetched,
+a value, 'N/D', an empty cell, or a step Teragon returned no row for).
+
+Recent data can still be revised upstream, so only steps older than a
+"settling" period are stored; newer steps are always fetched.
+
+'''
+
+# standard library
+import logging
+import mmap
+import os
+import threading
+from array import array
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+from rainfall.matrix import RainfallMatrix, NAN
+from rainfall.teragon import STEPS
+
+logger = logging.getLogger(__name__)
+
+# time steps are counted from this date
+EPOCH = datetime(2000, 1, 1)
+
+# states of a time step in a series
+UNKNOWN = 0
+VALUE = 1
+NODATA = 2
+BLANK = 3
+ABSENT = 4
+
+# translation tables from states to 0/1 flags
+_UNKNOWN_FLAGS = bytes([s == UNKNOWN for s in range(256)])
+_PRESENT_FLAGS = bytes([VALUE <= s <= BLANK for s in range(256)])
+_BLANK_FLAGS = bytes([s in (BLANK, ABSENT) for s in range(256)])
+
+
+def _any(flags, count):
+    """combine 0/1 flag strings of length count with a logical OR, using
+    integer arithmetic rather than looping over every byte
+    """
+    acc = 0
+    for f in flags:
+        acc |= int.from_bytes(f, 'little')
+    return acc.to_bytes(count, 'little')
+
+
+def _read(path, first, count, itemsize):
+    """read count items of itemsize bytes from a file, starting at item
+    first; items past the end of the file are returned as zero bytes
+    """
+    result = bytearray(count * itemsize)
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return result
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        start, stop = first * itemsize, min((first + count) * itemsize, size)
+        if stop > start:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                result[:stop - start] = m[start:stop]
+    return result
+
+
+def _write(path, first, data):
+    """write bytes into a file at byte offset first, growing the (sparse)
+    file as needed
+    """
+    with open(path, 'a+b') as f:
+        stop = first + len(data)
+        if os.fstat(f.fileno()).st_size < stop:
+            f.truncate(stop)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE) as m:
+            m[first:stop] = data
+
+
+class RainfallStore(object):
+    """On-disk rainfall time series, keyed by kind of data ("garr" or
+    "gauge"), interval, zerofill setting, location id and time step.
+    """
+
+    def __init__(self, root, settle=timedelta(days=30)):
+        """
+        Arguments:
+            root {str} -- directory for the store's files
+            settle {timedelta} -- data newer than this is never stored
+        """
+        self.root = root
+        self.settle = settle
+        self._lock = threading.Lock()
+        # rows of fetched tables that couldn't be stored
+        self.skipped_rows = 0
+
+    def _series(self, kind, interval, zerofill, location):
+        """paths to the values and states files of a series"""
+        folder = os.path.join(
+            self.root, kind, interval.lower(), "zerofill" if zerofill else "default")
+        base = os.path.join(folder, quote(location, safe=''))
+        return base + ".values", base + ".state"
+
+    def _slot(self, t, interval):
+        """the time step of a datetime, or None if it isn't on a step"""
+        step = STEPS[interval]
+        slot, remainder = divmod(t - EPOCH, step)
+        if remainder or slot < 0:
+            return None
+        return slot
+
+    def _cutoff(self, interval):
+        """the first time step that hasn't settled yet"""
+        step = STEPS[interval]
+        return -(-(datetime.now() - self.settle - EPOCH) // step)
+
+    def settled_until(self, interval):
+        """the datetime of the first time step that hasn't settled yet"""
+        return EPOCH + self._cutoff(interval) * STEPS[interval]
+
+    def covers(self, interval, start, end):
+        """whether the store can be used for a window: it must be aligned to
+        the interval's time steps (e.g., Daily windows start at midnight)
+        """
+        return (
+            interval in STEPS and
+            self._slot(start, interval) is not None and
+            self._slot(end, interval) is not None
+        )
+
+    def missing(self, kind, interval, zerofill, ids, start, end):
+        """find the parts of a window that have to be fetched from Teragon
+
+        Arguments:
+            kind {str} -- "garr" or "gauge"
+            interval {str} -- Teragon interval
+            zerofill {bool} -- Teragon zerofill setting
+            ids {list} -- location ids
+            start {datetime} -- start of the window (inclusive)
+            end {datetime} -- end of the window (exclusive)
+
+        Returns:
+            {list} -- (start, end) datetime windows missing for any of the ids,
+            in order; steps that haven't settled are always included
+        """
+        step = STEPS[interval]
+        s0, s1 = self._slot(start, interval), self._slot(end, interval)
+        cutoff = min(max(self._cutoff(interval), s0), s1)
+        count = cutoff - s0
+
+        # a step is missing if it's unknown for any of the ids
+        gaps = _any((
+            _read(self._series(kind, interval, zerofill, location)[1], s0, count, 1)
+            .translate(_UNKNOWN_FLAGS)
+            for location in ids
+        ), count)
+
+        # collapse the missing steps into runs
+        runs = []
+        for k, g in enumerate(gaps):
+            if not g:
+                continue
+            if runs and runs[-1][1] == k:
+                runs[-1][1] = k + 1
+            else:
+                runs.append([k, k + 1])
+        if cutoff < s1:
+            if runs and runs[-1][1] == count:
+                runs[-1][1] = s1 - s0
+            else:
+                runs.append([count, s1 - s0])
+
+        return [(start + a * step, start + b * step) for a, b in runs]
+
+    def write(self, kind, interval, zerofill, matrix, start, end):
+        """store the settled part of a matrix fetched for a window. Steps in
+        the window for which the matrix has no row are recorded as absent;
+        rows that can't be mapped onto a time step are skipped, and counted
+        in skipped_rows.
+
+        Arguments:
+            kind {str} -- "garr" or "gauge"
+            interval {str} -- Teragon interval
+            zerofill {bool} -- Teragon zerofill setting
+            matrix {RainfallMatrix} -- the data Teragon returned for the window
+            start {datetime} -- start of the window (inclusive)
+            end {datetime} -- end of the window (exclusive)
+        """
+        s0, s1 = self._slot(start, interval), self._slot(end, interval)
+        s1 = min(s1, self._cutoff(interval))
+        count = s1 - s0
+        if count <= 0:
+            return
+
+        # map the matrix rows onto time steps in the window. Rows that aren't
+        # on a step, and second rows on the same step (e.g., the repeated hour
+        # at the end of daylight saving time), are skipped; the first row on
+        # a step is the one stored.
+        rows = []
+        seen = set()
+        skipped = []
+        for i, ts in enumerate(matrix.timestamps):
+            slot = self._slot(datetime.fromisoformat(ts), interval)
+            if slot is None or slot in seen:
+                skipped.append(ts)
+                continue
+            seen.add(slot)
+            if s0 <= slot < s1:
+                rows.append((i, slot - s0))
+        if skipped:
+            with self._lock:
+                self.skipped_rows += len(skipped)
+            logger.warning(
+                "%s %s rows not stored (off-step or repeated time steps): %s",
+                interval, kind, ", ".join(skipped))
+
+        n = matrix.ncols
+        with self._lock:
+            for j, location in enumerate(matrix.ids):
+                values = array('d', [NAN]) * count
+                states = bytearray([ABSENT]) * count
+                for i, k in rows:
+                    v = matrix.values[i * n + j]
+                    values[k] = v
+                    if v == v:
+                        states[k] = VALUE
+                    elif matrix.blanks is not None and matrix.blanks[i * n + j]:
+                        states[k] = BLANK
+                    else:
+                        states[k] = NODATA
+                values_path, states_path = self._series(kind, interval, zerofill, location)
+                os.makedirs(os.path.dirname(values_path), exist_ok=True)
+                # values first, so that a step is only marked as known once its
+                # value is in place
+                _write(values_path, s0 * values.itemsize, values.tobytes())
+                _write(states_path, s0, bytes(states))
+
+    def read(self, kind, interval, zerofill, ids, start, end):
+        """read a window of stored data
+
+        Arguments:
+            kind {str} -- "garr" or "gauge"
+            interval {str} -- Teragon interval
+            zerofill {bool} -- Teragon zerofill setting
+            ids {list} -- location ids
+            start {datetime} -- start of the window (inclusive)
+            end {datetime} -- end of the window (exclusive)
+
+        Returns:
+            {RainfallMatrix} -- the stored data, with a row for every step for
+            which Teragon returned a row
+        """
+        step = STEPS[interval]
+        s0, s1 = self._slot(start, interval), self._slot(end, interval)
+        count = s1 - s0
+        n = len(ids)
+
+        columns = []
+        for location in ids:
+            values_path, states_path = self._series(kind, interval, zerofill, location)
+            values = array('d')
+            values.frombytes(_read(values_path, s0, count, values.itemsize))
+            states = _read(states_path, s0, count, 1)
+            columns.append((values, states))
+        present = _any((c[1].translate(_PRESENT_FLAGS) for c in columns), count)
+
+        rows = [k for k in range(count) if present[k]]
+        values = array('d', [NAN]) * (len(rows) * n)
+        blanks = bytearray(len(values))
+        for j, (col_values, col_states) in enumerate(columns):
+            # empty cells, and cells absent from a row Teragon did return, are
+            # rendered as empty
+            col_blanks = col_states.translate(_BLANK_FLAGS)
+            if len(rows) < count:
+                col_values = array('d', [col_values[k] for k in rows])
+                col_blanks = bytes(col_blanks[k] for k in rows)
+            values[j::n] = col_values
+            blanks[j::n] = col_blanks
+        timestamps = [(start + k * step).isoformat() for k in rows]
+        return RainfallMatrix(timestamps, list(ids), values, blanks)
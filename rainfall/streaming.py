@@ -0,0 +1,65 @@
+'''
+streaming.py
+
+Serialize rainfall data to JSON incrementally, one timestamp (or location) at
+a time, so that responses can be streamed to clients while they're produced.
+
+'''
+
+import json
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def json_chunks(inner, rows, indexed=True, ndjson=False):
+    """serialize rows of rainfall data as JSON, one row at a time
+
+    The output is the same JSON structure as the indexed or record formats of
+    the regular response (as a single JSON document), or newline-delimited
+    JSON with one timestamp (or location) per line.
+
+    Arguments:
+        inner {list} -- the inner keys (ids, or timestamps if keyed by location)
+        rows {iterable} -- (key, values) pairs, with values in the order of inner
+        indexed {bool} -- produce the indexed format rather than records
+        ndjson {bool} -- produce newline-delimited JSON
+
+    Returns:
+        {generator} -- chunks of UTF-8 encoded JSON
+    """
+    # in the indexed format, the inner keys are sorted
+    order = sorted(range(len(inner)), key=inner.__getitem__)
+    inner_keys = [_dumps(k) for k in inner]
+
+    def indexed_row(values):
+        return "{" + ",".join(
+            "{0}:{1}".format(inner_keys[j], _dumps(values[j])) for j in order
+        ) + "}"
+
+    def record_row(key, values):
+        return _dumps({
+            "id": key,
+            "d": [{'id': c, 'v': v} for c, v in zip(inner, values)]
+        })
+
+    if ndjson:
+        for key, values in rows:
+            if indexed:
+                line = "{" + _dumps(key) + ":" + indexed_row(values) + "}\n"
+            else:
+                line = record_row(key, values) + "\n"
+            yield line.encode('utf-8')
+        return
+
+    yield b"{" if indexed else b"["
+    separator = ""
+    for key, values in rows:
+        if indexed:
+            chunk = separator + _dumps(key) + ":" + indexed_row(values)
+        else:
+            chunk = separator + record_row(key, values)
+        yield chunk.encode('utf-8')
+        separator = ","
+    yield b"}\n" if indexed else b"]\n"
@@ -0,0 +1,234 @@
+'''
+teragon.py
+
+Helpers for working with the request payloads sent to Teragon's rain gauge
+and pixel endpoints.
+
+'''
+
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from rainfall.matrix import RainfallMatrix
+
+# the time step of each of Teragon's intervals
+STEPS = {
+    "Daily": timedelta(days=1),
+    "Hourly": timedelta(hours=1),
+    "15-minute": timedelta(minutes=15),
+}
+
+
+def payload_window(payload):
+    """get the start and end of the time window requested by a payload
+
+    Arguments:
+        payload {dict} -- Teragon API payload
+
+    Returns:
+        {tuple} -- (start, end) naive datetimes, to the hour
+    """
+    start = datetime(
+        payload['startyear'], payload['startmonth'],
+        payload['startday'], payload['starthour']
+    )
+    end = datetime(
+        payload['endyear'], payload['endmonth'],
+        payload['endday'], payload['endhour']
+    )
+    return start, end
+
+
+def payload_with_window(payload, start, end):
+    """copy a payload, replacing its time window
+
+    Arguments:
+        payload {dict} -- Teragon API payload
+        start {datetime} -- new start of the window
+        end {datetime} -- new end of the window
+
+    Returns:
+        {dict} -- a new payload
+    """
+    p = dict(payload)
+    p.update({
+        "startmonth": start.month,
+        "startday": start.day,
+        "startyear": start.year,
+        "starthour": start.hour,
+        "endmonth": end.month,
+        "endday": end.day,
+        "endyear": end.year,
+        "endhour": end.hour,
+    })
+    return p
+
+
+@lru_cache(maxsize=64)
+def _pixel_ids(pixels):
+    """the ids in a payload's pixels argument, parsed once per distinct
+    argument (the same one is parsed many times while handling a request)
+    """
+    return tuple(p.replace(",", "-") for p in pixels.split(";")) if pixels else ()
+
+
+def payload_ids(payload):
+    """get the kind of data and the location ids requested by a payload, in
+    the format used by Teragon's responses
+
+    Arguments:
+        payload {dict} -- Teragon API payload
+
+    Returns:
+        {tuple} -- ("garr", ["123-456", ...]) or ("gauge", ["1", ...])
+    """
+    if 'pixels' in payload:
+        return "garr", list(_pixel_ids(payload['pixels']))
+    gauges = payload.get('gauges', [])
+    if isinstance(gauges, str):
+        gauges = gauges.split(",")
+    return "gauge", [str(g) for g in gauges]
+
+
+def payload_key(payload):
+    """a normalized, hashable key for a payload: payloads with the same key
+    request the same data from Teragon, however their ids were given
+
+    Arguments:
+        payload {dict} -- Teragon API payload
+
+    Returns:
+        {tuple} -- the key
+    """
+    kind, ids = payload_ids(payload)
+    start, end = payload_window(payload)
+    return (
+        kind, tuple(ids), start, end,
+        payload['interval'], bool(payload.get('zerofill'))
+    )
+
+
+def payload_cells(payload):
+    """estimate the cost of a payload: the number of values it requests from
+    Teragon (time steps × locations)
+
+    Arguments:
+        payload {dict} -- Teragon API payload
+
+    Returns:
+        {int} -- the number of values
+    """
+    start, end = payload_window(payload)
+    steps = max((end - start) // STEPS[payload['interval']], 0)
+    return steps * len(payload_ids(payload)[1])
+
+
+def payload_with_ids(payload, ids):
+    """copy a payload, replacing its location ids
+
+    Arguments:
+        payload {dict} -- Teragon API payload
+        ids {list} -- location ids, in the format used by Teragon's responses
+
+    Returns:
+        {dict} -- a new payload
+    """
+    p = dict(payload)
+    if 'pixels' in payload:
+        p['pixels'] = ";".join(i.replace("-", ",") for i in ids)
+    else:
+        p['gauges'] = ",".join(ids)
+    return p
+
+
+def split_payload(payload, max_steps, max_ids):
+    """split a payload into sub-requests covering at most max_steps time
+    steps and max_ids locations each
+
+    Arguments:
+        payload {dict} -- Teragon API payload
+        max_steps {int} -- maximum number of time steps per sub-request
+        max_ids {int} -- maximum number of locations per sub-request
+
+    Returns:
+        {list} -- a list of (start, end, payloads) for consecutive time windows,
+        where payloads covers the locations of the window in chunks
+    """
+    start, end = payload_window(payload)
+    ids = payload_ids(payload)[1]
+
+    # windows are a whole number of hours (the payload's resolution) and of
+    # time steps
+    step = STEPS[payload['interval']]
+    windows = [(start, end)]
+    if step * max_steps < end - start:
+        hour = timedelta(hours=1)
+        size = max((step * max_steps) // hour, 1) * hour
+        if size % step:
+            size = max(size // step, 1) * step
+        windows = []
+        a = start
+        while a < end:
+            b = min(a + size, end)
+            windows.append((a, b))
+            a = b
+
+    if len(ids) > max_ids:
+        chunks = [ids[i:i + max_ids] for i in range(0, len(ids), max_ids)]
+    else:
+        chunks = None
+
+    split = []
+    for a, b in windows:
+        p = payload_with_window(payload, a, b) if len(windows) > 1 else payload
+        if chunks:
+            split.append((a, b, [payload_with_ids(p, c) for c in chunks]))
+        else:
+            split.append((a, b, [p]))
+    return split
+
+
+def fan_out(fetch, payload, max_steps, max_ids, parallelism, fetch_all=None):
+    """fetch a payload as concurrent sub-requests, and merge the results
+
+    Arguments:
+        fetch {function} -- fetches a single payload, returning a RainfallMatrix
+        payload {dict} -- Teragon API payload
+        max_steps {int} -- maximum number of time steps per sub-request
+        max_ids {int} -- maximum number of locations per sub-request
+        parallelism {int} -- maximum number of concurrent sub-requests
+        fetch_all {function} -- fetches a list of payloads concurrently,
+        returning a list of RainfallMatrix; by default, fetch is called from
+        a pool of parallelism threads
+
+    Returns:
+        {RainfallMatrix} -- the data for the whole payload
+    """
+    split = split_payload(payload, max_steps, max_ids)
+    payloads = [p for a, b, ps in split for p in ps]
+    if len(payloads) == 1:
+        return fetch(payload)
+
+    if fetch_all is not None:
+        results = iter(fetch_all(payloads))
+    else:
+        # each sub-request runs in a copy of the caller's context, so that
+        # it's still attributed to the caller's request (see rainfall.metrics)
+        contexts = [contextvars.copy_context() for _ in payloads]
+        with ThreadPoolExecutor(max_workers=min(parallelism, len(payloads))) as pool:
+            results = iter(list(pool.map(
+                lambda context, p: context.run(fetch, p), contexts, payloads)))
+
+    # join the location chunks of each window, then stack the windows in
+    # time order. Rows past the end of a window (in case Teragon includes the
+    # end of the window) are dropped, except for the last one.
+    windows = []
+    for k, (a, b, ps) in enumerate(split):
+        m = [next(results) for _ in ps]
+        m = RainfallMatrix.hstack(m) if len(m) > 1 else m[0]
+        if k < len(split) - 1:
+            m = m.take_rows(a.isoformat(), b.isoformat())
+        windows.append(m)
+    return RainfallMatrix.vstack(windows) if len(windows) > 1 else windows[0]
@@ -0,0 +1,94 @@
+'''
+timestamps.py
+
+Fast timestamp handling. Teragon's timestamps have a known, fixed layout
+("09/17/2004 03:15"), which is parsed with a regular expression rather than
+dateutil's generic parser; anything else falls back to dateutil. Time zone
+objects are looked up once and cached.
+
+'''
+
+# standard library
+import re
+from datetime import datetime
+from functools import lru_cache
+# date/time parsing
+from dateutil import tz
+from dateutil.parser import parse
+
+# Teragon's layout: month/day/year hour:minute, with optional seconds and
+# AM/PM
+TERAGON = re.compile(
+    r'^\s*(\d{1,2})/(\d{1,2})/(\d{4})\s+(\d{1,2}):(\d{2})(?::(\d{2}))?\s*([AaPp][Mm])?\s*$')
+
+
+@lru_cache(maxsize=None)
+def gettz(name):
+    """a cached dateutil.tz.gettz
+
+    Arguments:
+        name {str} -- time zone name, e.g. 'America/New_York' or 'UTC'
+
+    Returns:
+        {tzinfo}
+    """
+    return tz.gettz(name)
+
+
+@lru_cache(maxsize=4096)
+def _parse_iso(text):
+    """the slow path: parse any timestamp with dateutil"""
+    return parse(text).isoformat()
+
+
+def to_iso(text):
+    """convert a timestamp from a Teragon table to an ISO 8601 string, the
+    same as dateutil.parser.parse(text).isoformat()
+
+    Arguments:
+        text {str} -- the timestamp
+
+    Returns:
+        {str} -- e.g. '2004-09-17T03:15:00'
+    """
+    match = TERAGON.match(text)
+    if match is None:
+        return _parse_iso(text)
+    month, day, year, hour, minute, second, meridiem = match.groups()
+    hour = int(hour)
+    if meridiem:
+        hour = hour % 12 + (12 if meridiem.upper() == 'PM' else 0)
+    try:
+        return datetime(
+            int(year), int(month), int(day), hour, int(minute), int(second or 0)
+        ).isoformat()
+    except ValueError:
+        return _parse_iso(text)
+
+
+def to_iso_all(texts):
+    """convert a column of timestamps to ISO 8601 strings
+
+    Arguments:
+        texts {iterable} -- timestamps from a Teragon table
+
+    Returns:
+        {list} -- ISO 8601 strings
+    """
+    return list(map(to_iso, texts))
+
+
+def parse_datetime(text):
+    """parse an ISO 8601 date-time, falling back to dateutil for anything
+    datetime.fromisoformat doesn't handle
+
+    Arguments:
+        text {str} -- the date-time
+
+    Returns:
+        {datetime}
+    """
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return parse(text)
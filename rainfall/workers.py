@@ -0,0 +1,204 @@
+'''
+workers.py
+
+A pool of worker processes for the CPU-bound work on large tables: parsing
+Teragon's response, rendering the JSON response (transform or transpose, then
+serialization), and encoding the binary formats. Work in the pool runs on
+other cores, outside the GIL, so that a large request doesn't hold up the
+other requests of its process.
+
+The bulk of the data crosses between processes through shared memory rather
+than being pickled: the body of a response, and the values (and blank flags)
+of a matrix. Workers are spawned rather than forked, as the processes using
+the pool run threads of their own. A spawned worker imports this package, and
+also re-imports the script its parent was started with, as __mp_main__;
+application.py skips its data loading and services when it's imported that
+way.
+
+'''
+
+# standard library
+import json
+import multiprocessing
+import timeit
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+from rainfall import formats
+from rainfall.matrix import RainfallMatrix, decode_lines
+
+# bytes of a response decoded at a time
+CHUNK_SIZE = 65536
+
+
+def _shared(*chunks):
+    """a block of shared memory holding some bytes-like objects, one after
+    another
+    """
+    chunks = [memoryview(c).cast('B') for c in chunks]
+    shm = SharedMemory(create=True, size=max(sum(c.nbytes for c in chunks), 1))
+    offset = 0
+    for c in chunks:
+        shm.buf[offset:offset + c.nbytes] = c
+        offset += c.nbytes
+    return shm
+
+
+def _load_matrix(name, timestamps, ids, has_blanks, unlink=False):
+    """rebuild a matrix from its values in shared memory (releasing the
+    memory, if unlink)
+    """
+    count = len(timestamps) * len(ids)
+    shm = SharedMemory(name)
+    try:
+        values = array('d')
+        with shm.buf[:count * values.itemsize] as view:
+            values.frombytes(view)
+        blanks = None
+        if has_blanks:
+            with shm.buf[count * values.itemsize:count * (values.itemsize + 1)] as view:
+                blanks = bytearray(view)
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+    return RainfallMatrix(timestamps, ids, values, blanks)
+
+
+def _parse_csv(name, size, encoding):
+    """(in a worker) parse a Teragon response from shared memory, leaving the
+    matrix's values in a new block of shared memory for the caller to load
+    (and release)
+
+    Returns:
+        {tuple} -- (the arguments of _load_matrix, {stage: seconds})
+    """
+    start = timeit.default_timer()
+    shm = SharedMemory(name)
+    try:
+        chunks = (
+            bytes(shm.buf[k:min(k + CHUNK_SIZE, size)])
+            for k in range(0, size, CHUNK_SIZE)
+        )
+        matrix = RainfallMatrix.from_csv(decode_lines(chunks, encoding))
+    finally:
+        shm.close()
+    parsed = _shared(matrix.values, matrix.blanks or b"")
+    parsed.close()
+    return (parsed.name, matrix.timestamps, list(matrix.ids), matrix.blanks is not None), {
+        "csv": timeit.default_timer() - start,
+    }
+
+
+def _render_json(name, timestamps, ids, has_blanks, by_location, indexed, settings):
+    """(in a worker) render a matrix from shared memory as a JSON response
+    body
+
+    Returns:
+        {tuple} -- (bytes, {stage: seconds})
+    """
+    start = timeit.default_timer()
+    matrix = _load_matrix(name, timestamps, ids, has_blanks)
+    if indexed:
+        data = matrix.to_indexed(by_location=by_location)
+    else:
+        data = matrix.to_records(by_location=by_location)
+    rendered = timeit.default_timer()
+    body = (json.dumps(data, **settings) + "\n").encode('utf-8')
+    return body, {
+        "transpose" if by_location else "transform": rendered - start,
+        "serialize": timeit.default_timer() - rendered,
+    }
+
+
+def _encode(name, timestamps, ids, has_blanks, fmt):
+    """(in a worker) encode a matrix from shared memory in a binary format
+
+    Returns:
+        {tuple} -- (bytes, {stage: seconds})
+    """
+    start = timeit.default_timer()
+    matrix = _load_matrix(name, timestamps, ids, has_blanks)
+    body = formats.encode(matrix, fmt)
+    return body, {"serialize": timeit.default_timer() - start}
+
+
+class TransformPool(object):
+    """Worker processes rendering and encoding tables."""
+
+    def __init__(self, processes):
+        """
+        Arguments:
+            processes {int} -- number of worker processes, which are started
+            as they're needed
+        """
+        self.processes = processes
+        self._pool = ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+
+    def _run(self, shm, fn, *args):
+        """run fn in a worker, releasing the shared memory once it's done"""
+        try:
+            return self._pool.submit(fn, shm.name, *args).result()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def _matrix(self, matrix):
+        """the shared memory and arguments that pass a matrix to a worker"""
+        shm = _shared(matrix.values, matrix.blanks or b"")
+        return shm, (matrix.timestamps, list(matrix.ids), matrix.blanks is not None)
+
+    def parse_csv(self, body, encoding='utf-8'):
+        """parse a Teragon response, as RainfallMatrix.from_csv would
+
+        Arguments:
+            body {bytes} -- the response's body
+
+        Keyword Arguments:
+            encoding {str} -- the body's character encoding (default:
+            {'utf-8'})
+
+        Returns:
+            {RainfallMatrix} -- the table
+
+        Raises:
+            ValueError, csv.Error -- if the response can't be parsed
+        """
+        shm = _shared(body)
+        args, _ = self._run(shm, _parse_csv, len(body), encoding)
+        return _load_matrix(*args, unlink=True)
+
+    def render_json(self, matrix, by_location, indexed, settings):
+        """render a matrix as a JSON response body, as RainfallMatrix's
+        to_indexed or to_records, then json.dumps, would
+
+        Arguments:
+            matrix {RainfallMatrix} -- the data
+            by_location {bool} -- key the data by location rather than time
+            indexed {bool} -- use the indexed format rather than records
+            settings {dict} -- keyword arguments of json.dumps
+
+        Returns:
+            {tuple} -- (bytes, {stage: seconds spent in the worker})
+        """
+        shm, args = self._matrix(matrix)
+        return self._run(shm, _render_json, *args, by_location, indexed, settings)
+
+    def encode(self, matrix, fmt):
+        """encode a matrix in a binary format, as formats.encode would
+
+        Arguments:
+            matrix {RainfallMatrix} -- the data
+            fmt {str} -- "arrow", "parquet", or "msgpack"
+
+        Returns:
+            {tuple} -- (bytes, {stage: seconds spent in the worker})
+        """
+        shm, args = self._matrix(matrix)
+        return self._run(shm, _encode, *args, fmt)
+
+    def close(self):
+        """stop the worker processes"""
+        self._pool.shutdown()
@@ -0,0 +1,29 @@
+'''
+conftest.py
+
+Shared setup for the tests: the repository root is put on the path, so the
+rainfall package can be imported without installing it, and the application
+is available to the tests that make requests to it.
+
+'''
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# test_request.py is a script that requests data from Teragon when it's
+# imported; it isn't collected with the other tests
+collect_ignore = ["test_request.py"]
+
+
+@pytest.fixture(scope="session")
+def app():
+    """the application module, with its local store turned off (tests that
+    make requests replace the fetching of Teragon's data)
+    """
+    import application
+    application.store = None
+    return application
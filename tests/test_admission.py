@@ -0,0 +1,62 @@
+'''
+test_admission.py
+
+Request cost estimates, and the budget of values in flight.
+
+'''
+
+import threading
+from datetime import datetime
+
+from rainfall.admission import CellBudget
+from rainfall.teragon import payload_cells, payload_with_window
+
+
+def test_payload_cells():
+    payload = payload_with_window(
+        {"interval": "15-minute", "zerofill": False, "pixels": "134,111;135,111;136,111"},
+        datetime(2020, 1, 1), datetime(2020, 1, 2))
+    assert payload_cells(payload) == 96 * 3
+    payload = payload_with_window(
+        {"interval": "Daily", "gauges": [1, 2]}, datetime(2020, 1, 1), datetime(2020, 1, 11))
+    assert payload_cells(payload) == 20
+    # an empty window costs nothing
+    payload = payload_with_window(
+        {"interval": "Hourly", "gauges": [1]}, datetime(2020, 1, 2), datetime(2020, 1, 1))
+    assert payload_cells(payload) == 0
+
+
+def test_acquire_and_release():
+    budget = CellBudget(100)
+    assert budget.acquire(60) == 60
+    assert budget.acquire(40) == 40
+    assert budget.stats()["used"] == 100
+    budget.release(60)
+    budget.release(40)
+    assert budget.stats()["used"] == 0
+
+
+def test_timeout_when_full():
+    budget = CellBudget(100)
+    budget.acquire(80)
+    assert budget.acquire(30, timeout=0.01) is None
+    assert budget.stats()["rejected"] == 1
+    assert budget.acquire(20, timeout=0.01) == 20
+
+
+def test_oversized_request_takes_the_whole_budget():
+    budget = CellBudget(100)
+    assert budget.acquire(1000) == 100
+    assert budget.acquire(1, timeout=0.01) is None
+
+
+def test_waiter_is_admitted_on_release():
+    budget = CellBudget(100)
+    budget.acquire(100)
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(budget.acquire(50, timeout=5)))
+    waiter.start()
+    budget.release(100)
+    waiter.join()
+    assert admitted == [50]
+    assert budget.stats() == {"used": 50, "limit": 100, "waiting": 0, "rejected": 0}
@@ -0,0 +1,100 @@
+'''
+test_aggregate.py
+
+Temporal resampling and rolling intensity.
+
+'''
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from rainfall.aggregate import parse_duration, resample
+from rainfall.matrix import RainfallMatrix
+
+HOUR = timedelta(hours=1)
+START = datetime(2004, 9, 17, 0)
+
+CSV = (
+    "Timestamp,a,a notes,b,b notes\r\n"
+    "09/17/2004 00:00,1.0,,N/D,\r\n"
+    "09/17/2004 01:00,,,N/D,\r\n"
+    "09/17/2004 02:00,2.0,,N/D,\r\n"
+    "09/17/2004 03:00,0.5,,N/D,\r\n"
+    "09/17/2004 04:00,0.25,,1.0,\r\n"
+    "09/17/2004 05:00,,,,\r\n"
+    "Total,3.75,,1.0,\r\n"
+)
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("PT6H", timedelta(hours=6)),
+    ("P1D", timedelta(days=1)),
+    ("PT30M", timedelta(minutes=30)),
+    ("P1DT2H", timedelta(days=1, hours=2)),
+    ("PT0H", None),
+    ("6H", None),
+    ("", None),
+    (None, None),
+])
+def test_parse_duration(text, expected):
+    assert parse_duration(text) == expected
+
+
+def test_total():
+    matrix = resample(RainfallMatrix.from_csv(CSV), START, START + 6 * HOUR)
+    assert matrix.timestamps == ["2004-09-17T00:00:00"]
+    # empty cells count as zero, 'N/D' cells are left out
+    assert matrix.row(0) == [3.75, 1.0]
+
+
+def test_buckets():
+    matrix = resample(
+        RainfallMatrix.from_csv(CSV), START, START + 6 * HOUR, width=3 * HOUR)
+    assert matrix.timestamps == ["2004-09-17T00:00:00", "2004-09-17T03:00:00"]
+    assert matrix.column(0) == [3.0, 0.75]
+    # a bucket with only 'N/D' has no data
+    assert matrix.column(1) == [None, 1.0]
+
+
+@pytest.mark.parametrize("how,expected", [
+    ("sum", [3.0, 0.75]),
+    ("max", [2.0, 0.5]),
+    ("mean", [1.0, 0.25]),
+])
+def test_how(how, expected):
+    matrix = resample(
+        RainfallMatrix.from_csv(CSV), START, START + 6 * HOUR, width=3 * HOUR, how=how)
+    assert matrix.column(0) == expected
+
+
+def test_buckets_aligned_to_start():
+    start = START - HOUR
+    matrix = resample(RainfallMatrix.from_csv(CSV), start, START + 6 * HOUR, width=2 * HOUR)
+    assert matrix.timestamps == [
+        "2004-09-16T23:00:00", "2004-09-17T01:00:00", "2004-09-17T03:00:00",
+        "2004-09-17T05:00:00"]
+    assert matrix.column(0) == [1.0, 2.0, 0.75, 0.0]
+
+
+def test_intensity():
+    matrix = resample(
+        RainfallMatrix.from_csv(CSV), START, START + 6 * HOUR,
+        step=HOUR, intensity=2 * HOUR)
+    # the wettest two hours end at 03:00 (2.0 + 0.5)
+    assert matrix.row(0) == [2.5, 1.0]
+
+
+def test_intensity_buckets():
+    matrix = resample(
+        RainfallMatrix.from_csv(CSV), START, START + 6 * HOUR, width=3 * HOUR,
+        step=HOUR, intensity=2 * HOUR)
+    # windows reach back into the previous bucket
+    assert matrix.column(0) == [2.0, 2.5]
+    assert matrix.column(1) == [None, 1.0]
+
+
+def test_empty():
+    matrix = resample(RainfallMatrix.from_csv("Timestamp,a,n\r\n"), START, START + HOUR)
+    assert matrix.nrows == 0
+    assert matrix.ids == ["a"]
@@ -0,0 +1,353 @@
+'''
+test_aioclient.py
+
+The asyncio Teragon client, against a local server that answers each request
+with a scripted raw HTTP response.
+
+'''
+
+import asyncio
+import gzip
+import re
+
+import pytest
+
+from rainfall.aioclient import AsyncTeragonClient, UpstreamError, UpstreamInvalid, UpstreamTimeout
+
+CSV = b"Timestamp,1,1 notes\r\n09/17/2004 03:00,0.25,\r\n"
+
+
+def response(body=CSV, status="200 OK", headers=None):
+    """a raw response with a Content-Length"""
+    headers = headers or ["Content-Type: text/plain; charset=utf-8"]
+    return "HTTP/1.1 {0}\r\n{1}\r\nContent-Length: {2}\r\n\r\n".format(
+        status, "\r\n".join(headers), len(body)).encode('latin-1') + body
+
+
+def chunked(pieces):
+    """a raw chunked response, with a chunk extension and a trailer"""
+    body = b"".join(
+        "{0:x};ext=1\r\n".format(len(p)).encode('ascii') + p + b"\r\n" for p in pieces)
+    return (
+        b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n" +
+        body + b"0\r\nX-Trailer: yes\r\n\r\n")
+
+
+def reply(data, keep=True, wait=0):
+    """an action of the server: send data (optionally waiting first, or
+    afterwards, forever) and keep the connection or close it
+    """
+    async def act(writer):
+        await asyncio.sleep(wait)
+        writer.write(data)
+        await writer.drain()
+        return keep
+    return act
+
+
+def hang(data=b""):
+    """send data, and then nothing more"""
+    async def act(writer):
+        writer.write(data)
+        await writer.drain()
+        await asyncio.sleep(60)
+    return act
+
+
+class ScriptedServer(object):
+    """answers each request with the next of its actions"""
+
+    def __init__(self, actions):
+        self.actions = list(actions)
+        self.requests = []
+        self.connections = 0
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.url = "http://127.0.0.1:{0}/trp:API.raingauge".format(port)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = int(re.search(rb"Content-Length: (\d+)", head).group(1))
+                self.requests.append((head, await reader.readexactly(length)))
+                if not await self.actions.pop(0)(writer):
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+
+# the clients made for the test being run, closed once it's done
+clients = []
+
+
+def client(**kwargs):
+    kwargs.setdefault("read_timeout", 0.2)
+    kwargs.setdefault("connect_timeout", 0.2)
+    kwargs.setdefault("backoff", 0)
+    clients.append(AsyncTeragonClient(**kwargs))
+    return clients[-1]
+
+
+async def close_clients():
+    while clients:
+        await clients.pop().close()
+
+
+def run(actions, fn):
+    """run fn(server) on a new event loop, against a scripted server"""
+    async def main():
+        try:
+            async with ScriptedServer(actions) as server:
+                return await fn(server)
+        finally:
+            await close_clients()
+    return asyncio.run(main())
+
+
+def test_content_length_body():
+    c = client()
+
+    async def fn(server):
+        r = await c.post(server.url, {"gauges": "1,2", "interval": "Hourly"})
+        head, body = server.requests[0]
+        assert body == b"gauges=1%2C2&interval=Hourly"
+        assert head.startswith(b"POST /trp:API.raingauge HTTP/1.1\r\n")
+        return r
+
+    r = run([reply(response())], fn)
+    assert (r.status_code, r.content, r.encoding) == (200, CSV, "utf-8")
+    assert c.stats() == {"requests": 1, "connections": 1, "reused": 0, "retries": 0, "errors": 0}
+
+
+def test_chunked_body():
+    pieces = [CSV[:5], CSV[5:6], CSV[6:]]
+
+    async def fn(server):
+        r = await client().open(server.url, {})
+        return [chunk async for chunk in r.iter_chunks()]
+
+    assert b"".join(run([reply(chunked(pieces))], fn)) == CSV
+
+
+def test_body_to_end_of_connection():
+    data = b"HTTP/1.1 200 OK\r\nConnection: close\r\n\r\n" + CSV
+
+    async def fn(server):
+        return (await client().post(server.url, {})).content
+
+    assert run([reply(data, keep=False)], fn) == CSV
+
+
+def test_keep_alive_reuse():
+    c = client()
+
+    async def fn(server):
+        for _ in range(3):
+            assert (await c.post(server.url, {})).content == CSV
+        return server.connections
+
+    assert run([reply(response())] * 3, fn) == 1
+    assert c.stats()["reused"] == 2
+
+
+def test_closed_keep_alive_connection_is_replaced():
+    c = client()
+
+    async def fn(server):
+        await c.post(server.url, {})
+        # let the server's close reach the client
+        await asyncio.sleep(0.05)
+        assert (await c.post(server.url, {})).content == CSV
+        return server.connections
+
+    # the server closes the connection without saying so
+    assert run([reply(response(), keep=False), reply(response())], fn) == 2
+    assert c.stats()["retries"] == 0
+
+
+def test_retries_server_errors():
+    c = client()
+
+    async def fn(server):
+        return (await c.post(server.url, {})).content
+
+    assert run([reply(response(b"", "503 Service Unavailable")), reply(response())], fn) == CSV
+    assert c.stats()["retries"] == 1
+
+
+def test_gives_up_after_retries():
+    c = client(retries=2)
+
+    async def fn(server):
+        with pytest.raises(UpstreamError):
+            await c.post(server.url, {})
+        return len(server.requests)
+
+    assert run([reply(response(b"", "502 Bad Gateway"))] * 3, fn) == 3
+    assert c.stats()["errors"] == 1
+
+
+@pytest.mark.parametrize("status,body", [
+    ("301 Moved Permanently", b"<html>moved</html>"),
+    ("304 Not Modified", b""),
+    ("404 Not Found", b"<html>not found</html>"),
+])
+def test_other_statuses_are_errors(status, body):
+    c = client()
+
+    async def fn(server):
+        with pytest.raises(UpstreamError) as e:
+            await c.post(server.url, {})
+        assert status.split()[0] in str(e.value)
+        return len(server.requests)
+
+    redirect = response(body, status, ["Location: http://teragon.test/"])
+    # not retried
+    assert run([reply(redirect)], fn) == 1
+
+
+def test_informational_response_without_a_final_one():
+    c = client(retries=0)
+
+    async def fn(server):
+        with pytest.raises(UpstreamError):
+            await c.post(server.url, {})
+
+    run([reply(b"HTTP/1.1 100 Continue\r\n\r\n", keep=False)], fn)
+
+
+def test_timeout_waiting_for_response():
+    c = client(retries=1)
+
+    async def fn(server):
+        with pytest.raises(UpstreamTimeout):
+            await c.post(server.url, {})
+        return len(server.requests)
+
+    assert run([hang(), hang()], fn) == 2
+    assert c.stats()["retries"] == 1
+
+
+def test_timeout_while_reading_body():
+    data = response()
+
+    async def fn(server):
+        r = await client().open(server.url, {})
+        with pytest.raises(UpstreamTimeout):
+            await r.read()
+
+    run([hang(data[:-5])], fn)
+
+
+def test_body_cut_short():
+    data = response()
+
+    async def fn(server):
+        r = await client().open(server.url, {})
+        with pytest.raises(UpstreamError):
+            await r.read()
+
+    run([reply(data[:-5], keep=False)], fn)
+
+
+@pytest.mark.parametrize("cut", [
+    # after a chunk, before its CRLF, and before the last chunk's trailers end
+    b"5\r\nhello\r\n",
+    b"5\r\nhello",
+    b"5\r\nhello\r\n0\r\n",
+])
+def test_chunked_body_cut_short(cut):
+    data = b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n" + cut
+
+    async def fn(server):
+        r = await client().open(server.url, {})
+        with pytest.raises(UpstreamError):
+            await r.read()
+
+    run([reply(data, keep=False)], fn)
+
+
+def test_malformed_chunk_size():
+    data = b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\nhello\r\n0\r\n\r\n"
+
+    async def fn(server):
+        # (depending on when it arrives, the body is read with the headers)
+        with pytest.raises(UpstreamInvalid):
+            await client(retries=0).post(server.url, {})
+
+    run([reply(data, keep=False)], fn)
+
+
+def test_refused_connection():
+    c = client(retries=1)
+
+    async def main():
+        server = await asyncio.start_server(lambda r, w: None, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        server.close()
+        await server.wait_closed()
+        with pytest.raises(UpstreamError):
+            await c.post("http://127.0.0.1:{0}/".format(port), {})
+
+    asyncio.run(main())
+    assert c.stats()["connections"] == 0
+
+
+@pytest.mark.parametrize("encoding,compress", [
+    ("gzip", gzip.compress),
+    ("deflate", __import__("zlib").compress),
+])
+def test_compressed_body(encoding, compress):
+    data = response(compress(CSV), headers=["Content-Encoding: " + encoding])
+
+    async def fn(server):
+        return (await client().post(server.url, {})).content
+
+    assert run([reply(data)], fn) == CSV
+
+
+def test_unsupported_encoding():
+    data = response(b"...", headers=["Content-Encoding: br"])
+
+    async def fn(server):
+        with pytest.raises(UpstreamError):
+            await client().post(server.url, {})
+
+    run([reply(data)], fn)
+
+
+def test_repeated_headers():
+    data = response(headers=[
+        "Content-Type: text/csv; charset=utf-8",
+        "X-Note: a",
+        "X-Note: b",
+    ])
+
+    async def fn(server):
+        return await client().post(server.url, {})
+
+    r = run([reply(data)], fn)
+    assert r.headers["content-type"] == "text/csv; charset=utf-8"
+    assert r.encoding == "utf-8"
+    assert r.headers.getall("x-note") == ["a", "b"]
+
+
+def test_conflicting_content_lengths():
+    data = b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\nContent-Length: 6\r\n\r\nabcdef"
+    c = client(retries=0)
+
+    async def fn(server):
+        with pytest.raises(UpstreamError):
+            await c.post(server.url, {})
+
+    run([reply(data)], fn)
@@ -0,0 +1,64 @@
+'''
+test_basins.py
+
+Aggregation of GARR pixels by basin.
+
+'''
+
+import json
+import os
+
+import pytest
+
+from rainfall.basins import BasinIndex
+from rainfall.matrix import RainfallMatrix
+
+LOOKUP = {
+    "other": ["100-100", "100-101"],
+    "Saw Mill Run": ["134-111", "135-111"],
+    "Chartiers Creek": ["136-111"],
+}
+
+CSV = (
+    "Timestamp,134-111,n,135-111,n,136-111,n,100-100,n\r\n"
+    "09/17/2004 03:00,1.0,,3.0,,N/D,,5.0,\r\n"
+    "09/17/2004 04:00,,,2.0,,0.5,,5.0,\r\n"
+    "09/17/2004 05:00,N/D,,N/D,,,,5.0,\r\n"
+)
+
+
+@pytest.fixture
+def index():
+    return BasinIndex(LOOKUP)
+
+
+def test_other_is_not_a_basin(index):
+    assert index.basins == ["Saw Mill Run", "Chartiers Creek"]
+    assert index.index_vector(("100-100", "134-111", "136-111")) == (-1, 0, 1)
+
+
+@pytest.mark.parametrize("how,expected", [
+    ("mean", {"Saw Mill Run": [2.0, 1.0, None], "Chartiers Creek": [None, 0.5, 0.0]}),
+    ("total", {"Saw Mill Run": [4.0, 2.0, None], "Chartiers Creek": [None, 0.5, 0.0]}),
+    ("max", {"Saw Mill Run": [3.0, 2.0, None], "Chartiers Creek": [None, 0.5, 0.0]}),
+])
+def test_aggregate(index, how, expected):
+    matrix = index.aggregate(RainfallMatrix.from_csv(CSV), how)
+    # pixels outside of every basin are left out
+    assert matrix.ids == ["Saw Mill Run", "Chartiers Creek"]
+    assert matrix.to_indexed(by_location=True) == {
+        basin: dict(zip(matrix.timestamps, values)) for basin, values in expected.items()
+    }
+
+
+def test_only_basins_covered(index):
+    matrix = RainfallMatrix.from_csv(CSV).take_columns(["136-111", "100-100"])
+    assert index.aggregate(matrix).ids == ["Chartiers Creek"]
+
+
+def test_basin_lookup():
+    with open(os.path.join(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))), "data", "lookup_basins_revised.json")) as fp:
+        index = BasinIndex(json.load(fp))
+    assert "other" not in index.basins
+    assert len(index.basins) == 8
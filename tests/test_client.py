@@ -0,0 +1,113 @@
+'''
+test_client.py
+
+The pooled Teragon client: the retry policy mounted on its session, and its
+retries and kept-alive connections against a local server.
+
+'''
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from rainfall.client import TeragonClient
+
+CSV = b"Timestamp,1,1 notes\r\n09/17/2004 03:00,0.25,\r\n"
+
+
+class Handler(BaseHTTPRequestHandler):
+    """answers each POST with the server's next status (200 once there are
+    none left), over kept-alive connections
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        with self.server.lock:
+            self.server.posts += 1
+            status = self.server.statuses.pop(0) if self.server.statuses else 200
+        body = CSV if status == 200 else b"unavailable"
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.statuses = []
+    httpd.posts = 0
+    httpd.lock = threading.Lock()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = "http://127.0.0.1:{0}/trp:API.raingauge".format(httpd.server_address[1])
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_retry_policy_is_mounted():
+    client = TeragonClient(pool_size=7, connect_timeout=2, read_timeout=30, retries=3, backoff=0.25)
+    assert client.timeout == (2, 30)
+    for scheme in ("http://", "https://"):
+        adapter = client._session.get_adapter(scheme + "example.com")
+        assert adapter is client._adapter
+        assert isinstance(adapter, HTTPAdapter)
+        retry = adapter.max_retries
+        assert (retry.total, retry.connect, retry.read, retry.status) == (3, 3, 3, 3)
+        assert retry.backoff_factor == 0.25
+        assert set(retry.status_forcelist) == {500, 502, 503, 504}
+        assert "POST" in retry.allowed_methods
+        assert adapter._pool_maxsize == 7
+
+
+def test_application_client(app):
+    config = app.application.config
+    assert app.teragon.timeout == (
+        config['UPSTREAM_CONNECT_TIMEOUT'], config['UPSTREAM_READ_TIMEOUT'])
+    retry = app.teragon._session.get_adapter(config['URL_GARR']).max_retries
+    assert retry.total == config['UPSTREAM_RETRIES']
+    assert retry.backoff_factor == config['UPSTREAM_BACKOFF']
+
+
+def test_retries_server_errors(server):
+    server.statuses = [503, 502]
+    client = TeragonClient(retries=2, backoff=0)
+    response = client.post(server.url, {"interval": "Hourly"})
+    assert response.content == CSV
+    assert server.posts == 3
+    stats = client.stats()
+    assert (stats["requests"], stats["retries"], stats["errors"]) == (1, 2, 0)
+
+
+def test_gives_up_after_the_retries(server):
+    server.statuses = [503, 503, 503]
+    client = TeragonClient(retries=1, backoff=0)
+    with pytest.raises(requests.RequestException):
+        client.post(server.url, {"interval": "Hourly"})
+    assert server.posts == 2
+    assert client.stats()["errors"] == 1
+
+
+def test_client_errors_are_not_retried(server):
+    server.statuses = [404]
+    client = TeragonClient(retries=2, backoff=0)
+    with pytest.raises(requests.HTTPError):
+        client.post(server.url, {"interval": "Hourly"})
+    assert server.posts == 1
+
+
+def test_connections_are_kept_alive(server):
+    client = TeragonClient(backoff=0)
+    for _ in range(3):
+        assert client.post(server.url, {"interval": "Hourly"}).content == CSV
+    stats = client.stats()
+    assert (stats["requests"], stats["connections"], stats["reused"]) == (3, 1, 2)
@@ -0,0 +1,99 @@
+'''
+test_coalesce.py
+
+Single-flight coalescing of concurrent calls.
+
+'''
+
+import threading
+import time
+
+import pytest
+
+from rainfall.coalesce import SingleFlight
+
+
+def run_concurrently(flight, key, fn, count):
+    """call flight.do from count threads at once, returning their results
+    (or errors)
+    """
+    results = [None] * count
+
+    def call(k):
+        try:
+            results[k] = flight.do(key, fn)
+        except Exception as e:
+            results[k] = e
+
+    threads = [threading.Thread(target=call, args=(k,)) for k in range(count)]
+    for t in threads:
+        t.start()
+    return threads, results
+
+
+def wait_for_callers(flight, count, timeout=5):
+    """wait until count calls have joined (or made) a call"""
+    deadline = time.monotonic() + timeout
+    while sum(flight.stats().values()) < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return {"value": 1}
+
+    threads, results = run_concurrently(flight, "key", fn, 8)
+    # wait for every thread to have joined the call in flight
+    wait_for_callers(flight, 8)
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+    assert flight.stats() == {"calls": 1, "coalesced": 7}
+
+
+def test_errors_are_shared():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise ValueError("upstream failed")
+
+    threads, results = run_concurrently(flight, "key", fn, 4)
+    wait_for_callers(flight, 4)
+    release.set()
+    for t in threads:
+        t.join()
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_sequential_calls_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2
+    assert flight.stats() == {"calls": 2, "coalesced": 0}
+
+
+def test_keys_are_separate():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: flight.do("b", lambda: "b") + "a") == "ba"
+
+
+def test_error_clears_the_call():
+    flight = SingleFlight()
+
+    def fail():
+        raise KeyError("x")
+
+    with pytest.raises(KeyError):
+        flight.do("key", fail)
+    assert flight.do("key", lambda: 1) == 1
@@ -0,0 +1,180 @@
+'''
+test_engine.py
+
+The asyncio upstream engine: parsing responses as they're received, a
+bounded number of chunks at a time, and the errors it raises.
+
+'''
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from rainfall.aioclient import UpstreamInvalid, UpstreamTimeout
+from rainfall.engine import QUEUE_CHUNKS, UpstreamEngine
+from rainfall.matrix import RainfallMatrix
+
+HEADER = "Timestamp,1,1 notes,2,2 notes\r\n"
+ROWS = "".join(
+    "09/17/2004 {0:02d}:00,0.{0},,,\r\n".format(h) for h in range(24))
+CSV = (HEADER + ROWS + "Total,1.0,,0,\r\n").encode('utf-8')
+
+
+class FakeResponse(object):
+    """a response whose body arrives in the given chunks, optionally
+    followed by an error
+    """
+
+    def __init__(self, chunks, error=None):
+        self.encoding = 'utf-8'
+        self.chunks = chunks
+        self.error = error
+        self.sent = 0
+        self.closed = False
+
+    async def iter_chunks(self):
+        try:
+            for chunk in self.chunks:
+                self.sent += 1
+                yield chunk
+                await asyncio.sleep(0)
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.closed = True
+
+    async def read(self):
+        return b"".join([chunk async for chunk in self.iter_chunks()])
+
+
+class FakeClient(object):
+    """answers each payload with the response made for it"""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.responses = []
+
+    async def open(self, url, payload):
+        response = self.respond(payload)
+        self.responses.append(response)
+        return response
+
+    async def close(self):
+        pass
+
+
+class FakeTimings(object):
+
+    def __init__(self):
+        self.stages = {}
+        self.bytes = 0
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def add_bytes(self, count):
+        self.bytes += count
+
+
+def split(body, size):
+    return [body[k:k + size] for k in range(0, len(body), size)]
+
+
+@pytest.fixture
+def engines():
+    started = []
+
+    def start(respond, **kwargs):
+        engine = UpstreamEngine(FakeClient(respond), **kwargs)
+        started.append(engine)
+        return engine
+
+    yield start
+    for engine in started:
+        engine.close()
+
+
+def test_fetch_parses_chunks(engines):
+    engine = engines(lambda payload: FakeResponse(split(CSV, 7)))
+    timings = FakeTimings()
+    matrix = engine.fetch("url", {}, timings).result(5)
+    assert matrix.to_indexed() == RainfallMatrix.from_csv(CSV).to_indexed()
+    assert timings.bytes == len(CSV)
+    assert set(timings.stages) == {"upstream", "csv"}
+
+
+def test_fetch_all_keeps_order(engines):
+    def respond(payload):
+        return FakeResponse([CSV.replace(b"Timestamp,1,", b"Timestamp," + payload["id"].encode() + b",")])
+
+    engine = engines(respond)
+    matrices = engine.fetch_all("url", [{"id": str(k)} for k in range(10, 20)], 3).result(5)
+    assert [m.ids[0] for m in matrices] == [str(k) for k in range(10, 20)]
+
+
+def test_body_waits_for_the_parser(engines):
+    response = FakeResponse(split(CSV, 16))
+    engine = engines(lambda payload: response, parse_workers=1)
+    # hold up the only parsing thread
+    release = threading.Event()
+    engine._parser.submit(release.wait, 5)
+    future = engine.fetch("url", {})
+    time.sleep(0.1)
+    # only a few chunks have been read off the connection
+    assert response.sent <= QUEUE_CHUNKS + 1
+    release.set()
+    assert future.result(5).nrows == 24
+    assert response.sent == len(response.chunks)
+
+
+def test_unparseable_response(engines):
+    bad = (HEADER + "09/17/2004 00:00,abc,,,\r\n").encode('utf-8')
+    response = FakeResponse([bad] + split(ROWS.encode('utf-8'), 16) * 20)
+    engine = engines(lambda payload: response)
+    with pytest.raises(UpstreamInvalid):
+        engine.fetch("url", {}).result(5)
+    # the rest of the body isn't read, and the connection is closed
+    assert response.sent < len(response.chunks)
+    assert response.closed
+
+
+def test_error_while_receiving(engines):
+    engine = engines(lambda payload: FakeResponse(
+        split(CSV, 16)[:3], UpstreamTimeout("stopped sending")))
+    with pytest.raises(UpstreamTimeout):
+        engine.fetch("url", {}).result(5)
+
+
+def test_error_opening(engines):
+    def respond(payload):
+        raise UpstreamTimeout("no response")
+
+    engine = engines(respond)
+    with pytest.raises(UpstreamTimeout):
+        engine.fetch_all("url", [{}, {}], 2).result(5)
+
+
+def test_parser_reads_whole_bodies(engines):
+    engine = engines(lambda payload: FakeResponse(split(CSV, 7)))
+    parsed = []
+
+    def parser(payload):
+        if payload.get("large"):
+            return lambda body, encoding: parsed.append(body) or RainfallMatrix.from_csv(body)
+        return None
+
+    small, large = engine.fetch_all("url", [{}, {"large": True}], 2, parser=parser).result(5)
+    assert parsed == [CSV]
+    assert small.to_indexed() == large.to_indexed() == RainfallMatrix.from_csv(CSV).to_indexed()
+
+
+def test_parser_error(engines):
+    engine = engines(lambda payload: FakeResponse([CSV]))
+
+    def parse(body, encoding):
+        raise ValueError("not a table")
+
+    with pytest.raises(UpstreamInvalid):
+        engine.fetch("url", {}, parser=lambda payload: parse).result(5)
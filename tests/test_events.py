@@ -0,0 +1,124 @@
+'''
+test_events.py
+
+The event catalog, the serialized event datasets, and building them.
+
+'''
+
+import json
+import os
+from array import array
+from datetime import datetime
+
+import pytest
+
+from rainfall.basins import BasinIndex
+from rainfall.events import (EventStore, dump_matrix, load_catalog, load_matrix,
+                             parse_event_time, summarize)
+from rainfall.matrix import RainfallMatrix
+from rainfall.teragon import STEPS
+
+CSV = (
+    "Timestamp,134-111,n,135-111,n\r\n"
+    "09/17/2004 03:00,0.25,,N/D,\r\n"
+    "09/17/2004 04:00,,,0.5,\r\n"
+    "Total,0.25,,0.5,\r\n"
+)
+
+EVENT = {
+    "id": 7, "label": "test", "report": None,
+    "start": datetime(2004, 9, 17, 3), "end": datetime(2004, 9, 17, 5),
+}
+
+
+def test_parse_event_time():
+    assert parse_event_time("2016-09-08 18:00 EDT") == datetime(2016, 9, 8, 18)
+    assert parse_event_time("2016-12-08 18:00 EST") == datetime(2016, 12, 8, 18)
+
+
+def test_load_catalog_widens_to_whole_hours(tmp_path):
+    path = tmp_path / "db.json"
+    path.write_text(json.dumps({"events": [{
+        "id": 1, "dt_start": "2004-09-16 20:30 EDT", "dt_end": "2004-09-18 4:15 EDT",
+        "report": "200409note.pdf", "label": "Hurricane Ivan"
+    }]}))
+    [event] = load_catalog(str(path))
+    assert event["start"] == datetime(2004, 9, 16, 20)
+    assert event["end"] == datetime(2004, 9, 18, 5)
+    assert event["label"] == "Hurricane Ivan"
+
+
+def test_dump_and_load_matrix():
+    matrix = RainfallMatrix.from_csv(CSV)
+    loaded = load_matrix(dump_matrix(matrix))
+    assert loaded.timestamps == matrix.timestamps
+    assert loaded.ids == matrix.ids
+    assert loaded.to_indexed() == matrix.to_indexed()
+    # the same data serializes to the same bytes
+    assert dump_matrix(matrix) == dump_matrix(loaded)
+
+
+def test_dump_and_load_matrix_without_blanks():
+    matrix = RainfallMatrix(["2004-09-17T03:00:00"], ["1"], array('d', [0.5]))
+    loaded = load_matrix(dump_matrix(matrix))
+    assert loaded.blanks is None
+    assert loaded.row(0) == [0.5]
+
+
+def test_summarize():
+    basins = BasinIndex({"other": ["100-100"], "Saw Mill Run": ["134-111", "135-111"]})
+    garr = RainfallMatrix.from_csv(CSV)
+    gauge = RainfallMatrix.from_csv(CSV.replace("134-111", "1").replace("135-111", "2"))
+    summary = summarize(EVENT, garr, gauge, basins, "Hourly")
+    assert summary["basins"] == {
+        "Saw Mill Run": {"total": 0.5, "peak_1h": 0.25, "max_pixel_total": 0.5}}
+    assert summary["gauges"] == {
+        "1": {"total": 0.25, "peak_1h": 0.25}, "2": {"total": 0.5, "peak_1h": 0.5}}
+
+
+@pytest.fixture
+def fetches():
+    return []
+
+
+@pytest.fixture
+def fetch(fetches):
+    def fetch(kind, event, interval):
+        fetches.append((kind, interval))
+        return RainfallMatrix.from_csv(CSV)
+    return fetch
+
+
+def test_build(tmp_path, fetch, fetches):
+    store = EventStore([EVENT], str(tmp_path))
+    basins = BasinIndex({"Saw Mill Run": ["134-111", "135-111"]})
+    assert store.datasets(7) == []
+    assert store.dataset(7, "garr", "Hourly") is None
+    assert store.summary(7) is None
+
+    store.build(7, fetch, basins)
+    assert len(fetches) == 2 * len(STEPS)
+    assert len(store.datasets(7)) == 2 * len(STEPS)
+    assert store.dataset(7, "garr", "Hourly").to_indexed() == \
+        RainfallMatrix.from_csv(CSV).to_indexed()
+    assert store.summary(7)["id"] == 7
+
+
+def test_build_skips_built_datasets(tmp_path, fetch, fetches, monkeypatch):
+    store = EventStore([EVENT], str(tmp_path))
+    basins = BasinIndex({"Saw Mill Run": ["134-111", "135-111"]})
+    store.build(7, fetch, basins)
+    os.remove(os.path.join(str(tmp_path), "7", "gauge-Daily.rfm.gz"))
+    del fetches[:]
+
+    # built datasets aren't read just to see that they're there
+    loaded = []
+    original = EventStore.dataset
+    monkeypatch.setattr(EventStore, "dataset", lambda self, *key: loaded.append(key) or original(self, *key))
+    store = EventStore([EVENT], str(tmp_path))
+    store.build(7, fetch, basins)
+    assert fetches == [("gauge", "Daily")]
+    assert loaded == [(7, "garr", "15-minute"), (7, "gauge", "15-minute")]
+
+    store.build(7, fetch, basins, rebuild=True)
+    assert len(fetches) == 1 + 2 * len(STEPS)
@@ -0,0 +1,133 @@
+'''
+test_features.py
+
+GeoJSON layers with rainfall data embedded in their features, assembled from
+pre-serialized fragments, against building the FeatureCollection as dicts
+and serializing it.
+
+'''
+
+import copy
+import json
+import logging
+import os
+
+import pytest
+
+from rainfall.features import FeatureTemplates
+from rainfall.matrix import RainfallMatrix
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def load(layer):
+    with open(os.path.join(DATA, layer)) as f:
+        return json.load(f)
+
+
+def table(ids):
+    """a table of some locations, with values, 'N/D's and blanks"""
+    lines = ["Timestamp," + ",".join("{0},{0} notes".format(i) for i in ids)]
+    values = ["0.25", "N/D", "", "0", "1.5"]
+    for h in range(3):
+        lines.append("09/17/2004 {0:02d}:00,".format(h) + ",".join(
+            values[(h + k) % len(values)] + "," for k in range(len(ids))))
+    return RainfallMatrix.from_csv("\r\n".join(lines) + "\r\n")
+
+
+def expected(data, id_property, matrix, series):
+    """the layer's FeatureCollection, as dicts: the features of the matrix's
+    locations, with their data
+    """
+    columns = {c: j for j, c in enumerate(matrix.ids)}
+    collection = {k: v for k, v in data.items() if k != "features"}
+    collection["features"] = []
+    for feature in data["features"]:
+        location = (feature.get("properties") or {}).get(id_property)
+        if location is None or str(location) not in columns:
+            continue
+        j = columns[str(location)]
+        feature = copy.deepcopy(feature)
+        if series:
+            value = dict(zip(matrix.timestamps, matrix.column(j)))
+        else:
+            value = matrix.row(0)[j]
+        feature["properties"]["rainfall"] = value
+        collection["features"].append(feature)
+    return collection
+
+
+@pytest.mark.parametrize("layer,id_property,ids", [
+    ("gauges.geojson", "ID", ["1", "2", "3", "10", "33"]),
+    ("grid.geojson", "id", ["134-111", "138-122", "150-130", "999-999"]),
+    ("grid_centroids.geojson", "pixel", ["138-122", "150-130", "134-111"]),
+])
+@pytest.mark.parametrize("series", [False, True])
+def test_render_matches_dicts(layer, id_property, ids, series):
+    data = load(layer)
+    templates = FeatureTemplates(data, id_property)
+    matrix = table(ids)
+    rendered = json.loads(templates.render(matrix, series=series))
+    assert rendered == expected(data, id_property, matrix, series)
+    # N/D and blank values are kept apart
+    values = [f["properties"]["rainfall"] for f in rendered["features"]]
+    if not series:
+        assert None in values and "" in values
+
+
+def test_render_without_rows():
+    data = load("gauges.geojson")
+    matrix = RainfallMatrix.from_csv("Timestamp,1,1 notes,2,2 notes\r\n")
+    rendered = json.loads(FeatureTemplates(data, "ID").render(matrix))
+    assert [f["properties"]["rainfall"] for f in rendered["features"]] == [None, None]
+
+
+def test_features_without_ids_are_logged(caplog):
+    data = load("gauges.geojson")
+    unidentified = [f for f in data["features"] if f["properties"].get("ID") is None]
+    assert unidentified
+    with caplog.at_level(logging.WARNING, logger="rainfall.features"):
+        templates = FeatureTemplates(data, "ID")
+    assert len(templates) == len(data["features"]) - len(unidentified)
+    assert "{0} features".format(len(unidentified)) in caplog.text
+
+
+@pytest.fixture
+def fetched(app, monkeypatch):
+    """replace fetching from Teragon with a table of the requested ids"""
+    payloads = []
+
+    def fetch_matrix(url, data):
+        payloads.append(data)
+        if 'gauges' in data:
+            ids = str(data['gauges']).split(',')
+        else:
+            ids = ["138-122", "150-130"]
+        return table(ids)
+
+    monkeypatch.setattr(app, "fetch_matrix", fetch_matrix)
+    return payloads
+
+
+def test_gauge_features_endpoint(app, fetched):
+    client = app.application.test_client()
+    r = client.get('/api/gauge/features?ids=1,2&dates=2004-09-17T00:00/2004-09-17T03:00')
+    assert r.status_code == 200
+    assert r.mimetype == "application/geo+json"
+    data = json.loads(r.data)
+    # each gauge's total for the window, skipping N/D and blanks
+    assert {f["properties"]["ID"]: f["properties"]["rainfall"] for f in data["features"]} == {
+        1: 0.25, 2: 0.0}
+    assert fetched[0]['gauges'] == '1,2'
+
+
+def test_garr_features_endpoint(app, fetched):
+    client = app.application.test_client()
+    r = client.post('/api/garrd/features?pixels=138-122,150-130&geom=point&bucket=PT1H'
+                    '&dates=2004-09-17T00:00/2004-09-17T03:00')
+    assert r.status_code == 200
+    data = json.loads(r.data)
+    series = {f["properties"]["pixel"]: f["properties"]["rainfall"] for f in data["features"]}
+    assert sorted(series) == ["138-122", "150-130"]
+    assert len(series["138-122"]) == 3
+    assert client.post('/api/garrd/features?basin=all%20basins&basin_agg=sum').status_code == 400
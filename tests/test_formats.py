@@ -0,0 +1,146 @@
+'''
+test_formats.py
+
+The binary formats, decoded against the matrix's indexed rendering (with
+empty cells as 0.0), and their negotiation with the Accept header.
+
+'''
+
+import io
+import json
+import math
+from array import array
+
+import pytest
+
+from rainfall import formats
+from rainfall.matrix import RainfallMatrix
+
+pyarrow = pytest.importorskip("pyarrow")
+import pyarrow.ipc  # noqa: E402
+import pyarrow.parquet  # noqa: E402
+msgpack = pytest.importorskip("msgpack")
+
+DATES = "2004-09-17T00:00/2004-09-17T03:00"
+
+
+def table(ids, rows=3):
+    """a table of some locations, with values, 'N/D's and blanks"""
+    lines = ["Timestamp," + ",".join("{0},{0} notes".format(i) for i in ids)]
+    values = ["0.25", "N/D", "", "0", "1.5"]
+    for h in range(rows):
+        lines.append("09/17/2004 {0:02d}:00,".format(h) + ",".join(
+            values[(h + k) % len(values)] + "," for k in range(len(ids))))
+    return RainfallMatrix.from_csv("\r\n".join(lines) + "\r\n")
+
+
+def indexed(matrix):
+    """the matrix's indexed rendering, as the binary formats have it: empty
+    cells are 0.0, and 'N/D' cells null
+    """
+    return {
+        t: {i: 0.0 if v == '' else v for i, v in row.items()}
+        for t, row in matrix.to_indexed().items()
+    }
+
+
+def from_table(t):
+    """{timestamp: {id: value}} from an Arrow table"""
+    columns = t.to_pydict()
+    timestamps = [ts.isoformat() for ts in columns.pop("timestamp")]
+    return {
+        ts: {i: columns[i][k] for i in columns}
+        for k, ts in enumerate(timestamps)
+    }
+
+
+def from_msgpack(body):
+    """{timestamp: {id: value}} from a msgpack body"""
+    data = msgpack.unpackb(body, raw=False)
+    assert data["dtype"] == "<f8"
+    nrows, ncols = data["shape"]
+    values = array('d', data["values"])
+    assert len(values) == nrows * ncols
+    return {
+        ts: {
+            i: None if math.isnan(values[r * ncols + j]) else values[r * ncols + j]
+            for j, i in enumerate(data["ids"])
+        }
+        for r, ts in enumerate(data["timestamps"])
+    }
+
+
+DECODERS = {
+    "arrow": lambda body: from_table(pyarrow.ipc.open_stream(body).read_all()),
+    "parquet": lambda body: from_table(pyarrow.parquet.read_table(io.BytesIO(body))),
+    "msgpack": from_msgpack,
+}
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet", "msgpack"])
+@pytest.mark.parametrize("ids,rows", [
+    (["1", "2", "3"], 3),
+    (["138-122"], 1),
+    (["1", "2"], 0),
+])
+def test_round_trip(fmt, ids, rows):
+    matrix = table(ids, rows)
+    assert DECODERS[fmt](formats.encode(matrix, fmt)) == indexed(matrix)
+
+
+def test_arrow_schema():
+    t = pyarrow.ipc.open_stream(formats.to_arrow(table(["1", "2"]))).read_all()
+    assert t.column_names == ["timestamp", "1", "2"]
+    assert t.schema.field("timestamp").type == pyarrow.timestamp('s')
+    assert t.schema.field("1").type == pyarrow.float64()
+
+
+@pytest.fixture
+def client(app, monkeypatch):
+    """the test client, with Teragon's data replaced by a table"""
+    monkeypatch.setattr(app, "fetch_matrix", lambda url, data: table(["1", "2"]))
+    return app.application.test_client()
+
+
+@pytest.mark.parametrize("accept,fmt", [
+    ("application/vnd.apache.arrow.stream", "arrow"),
+    ("application/x-parquet", "parquet"),
+    ("application/msgpack", "msgpack"),
+    ("application/json;q=0.5, application/x-msgpack", "msgpack"),
+    ("application/msgpack;q=0.5, application/json", "json"),
+    ("*/*", "json"),
+    ("text/csv", "json"),
+    (None, "json"),
+])
+def test_accept(client, accept, fmt):
+    headers = {"Accept": accept} if accept else {}
+    r = client.get('/api/gauge/?ids=1,2&dates=' + DATES, headers=headers)
+    assert r.status_code == 200
+    if fmt == "json":
+        assert r.mimetype == "application/json"
+        json.loads(r.data)
+    else:
+        assert r.mimetype == formats.MIMETYPES[fmt][0]
+        assert DECODERS[fmt](r.data) == indexed(table(["1", "2"]))
+
+
+def test_format_argument_over_accept(client):
+    r = client.get('/api/gauge/?ids=1,2&format=arrow&dates=' + DATES,
+                   headers={"Accept": "application/msgpack"})
+    assert r.mimetype == "application/vnd.apache.arrow.stream"
+
+
+def test_missing_library(client, monkeypatch):
+    monkeypatch.setattr(formats, "msgpack", None)
+    # not offered for the Accept header
+    r = client.get('/api/gauge/?ids=1,2&dates=' + DATES,
+                   headers={"Accept": "application/msgpack, application/json;q=0.5"})
+    assert r.status_code == 200
+    assert r.mimetype == "application/json"
+    # an error if asked for by name
+    r = client.get('/api/gauge/?ids=1,2&format=msgpack&dates=' + DATES)
+    assert r.status_code == 406
+    assert "msgpack" in json.loads(r.data)["message"]
+    # the other formats are still there
+    r = client.get('/api/gauge/?ids=1,2&format=arrow&dates=' + DATES)
+    assert r.status_code == 200
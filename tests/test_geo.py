@@ -0,0 +1,128 @@
+'''
+test_geo.py
+
+The static GeoJSON layers: their encodings, picked by Accept-Encoding (brotli
+only when it's installed), and conditional requests, through the endpoints.
+
+'''
+
+import gzip
+import json
+import os
+import types
+
+import pytest
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+from rainfall import geo
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def accepting(header):
+    return parse_accept_header(header, Accept)
+
+
+def load(layer):
+    with open(os.path.join(DATA, layer)) as f:
+        return json.load(f)
+
+
+# a stand-in for the brotli module
+fake_brotli = types.SimpleNamespace(compress=lambda body: b"br:" + body[:10])
+
+
+@pytest.mark.parametrize("header,encoding", [
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip, deflate, br", "gzip"),
+    ("br", None),
+    ("br;q=0, gzip", "gzip"),
+])
+def test_encodings_without_brotli(monkeypatch, header, encoding):
+    monkeypatch.setattr(geo, "brotli", None)
+    layer = geo.StaticLayer(os.path.join(DATA, "gauges.geojson"))
+    assert "br" not in layer.representations
+    body, picked, etag = layer.representation(accepting(header))
+    assert picked == encoding
+    if encoding == "gzip":
+        body = gzip.decompress(body)
+    assert json.loads(body) == load("gauges.geojson")
+
+
+@pytest.mark.parametrize("header,encoding", [
+    ("gzip, deflate, br", "br"),
+    ("br", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("identity", None),
+])
+def test_encodings_with_brotli(monkeypatch, header, encoding):
+    monkeypatch.setattr(geo, "brotli", fake_brotli)
+    layer = geo.StaticLayer(os.path.join(DATA, "gauges.geojson"))
+    body, picked, etag = layer.representation(accepting(header))
+    assert picked == encoding
+    # each encoding has its own ETag
+    assert etag == layer.representations[encoding or "identity"][1]
+    assert len({e for b, e in layer.representations.values()}) == 3
+
+
+def test_brotli_body():
+    brotli = pytest.importorskip("brotli")
+    layer = geo.StaticLayer(os.path.join(DATA, "gauges.geojson"))
+    body, picked, etag = layer.representation(accepting("br"))
+    assert picked == "br"
+    assert json.loads(brotli.decompress(body)) == load("gauges.geojson")
+
+
+@pytest.fixture
+def client(app):
+    return app.application.test_client()
+
+
+@pytest.mark.parametrize("url,layer", [
+    ("/api/garrd/geojson", "grid.geojson"),
+    ("/api/garrd/geojson?geom=point", "grid_centroids.geojson"),
+    ("/api/gauge/geojson", "gauges.geojson"),
+])
+def test_layer_endpoint(client, url, layer):
+    r = client.get(url)
+    assert r.status_code == 200
+    assert json.loads(r.data) == load(layer)
+    assert r.headers.get("Content-Encoding") is None
+    assert r.headers["Vary"] == "Accept-Encoding"
+    assert "public" in r.headers["Cache-Control"]
+    etag = r.headers["ETag"]
+
+    # the client's copy is still current
+    r = client.get(url, headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.data == b""
+    assert r.headers["ETag"] == etag
+    r = client.get(url, headers={"If-None-Match": '"stale", ' + etag})
+    assert r.status_code == 304
+    r = client.get(url, headers={"If-None-Match": '"stale"'})
+    assert r.status_code == 200
+
+
+def test_gzip_endpoint(client):
+    plain = client.get("/api/gauge/geojson")
+    r = client.get("/api/gauge/geojson", headers={"Accept-Encoding": "gzip, deflate"})
+    assert r.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(r.data) == plain.data
+    assert r.headers["ETag"] != plain.headers["ETag"]
+    r = client.get("/api/gauge/geojson", headers={
+        "Accept-Encoding": "gzip", "If-None-Match": r.headers["ETag"]})
+    assert r.status_code == 304
+
+
+def test_brotli_endpoint(client):
+    r = client.get("/api/gauge/geojson", headers={"Accept-Encoding": "br"})
+    if geo.brotli is None:
+        # never sent brotli it can't make
+        assert r.headers.get("Content-Encoding") is None
+        assert json.loads(r.data) == load("gauges.geojson")
+    else:
+        assert r.headers["Content-Encoding"] == "br"
+        assert json.loads(geo.brotli.decompress(r.data)) == load("gauges.geojson")
@@ -0,0 +1,114 @@
+'''
+test_ingest.py
+
+The watermarks of responses: the newest data received for the least
+up-to-date of their locations.
+
+'''
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from rainfall.ingest import IngestLog, latest_by_column, watch_rows, watermark
+from rainfall.matrix import RainfallMatrix, iter_csv
+
+URL = "http://teragon/gauge"
+
+
+def lines(rows, ids=("1", "2")):
+    """the lines of a Teragon table with a row per hour from 2020-06-01T00:00"""
+    lines = ["Timestamp," + ",".join("{0},{0} notes".format(i) for i in ids)]
+    for h, values in enumerate(rows):
+        lines.append("06/01/2020 {0:02d}:00,".format(h) + ",".join(v + "," for v in values))
+    return lines
+
+
+def table(rows, ids=("1", "2")):
+    """a Teragon table with a row per hour from 2020-06-01T00:00"""
+    return RainfallMatrix.from_csv(lines(rows, ids))
+
+
+def test_latest_by_column():
+    matrix = table([("0.1", "0.2"), ("", "N/D"), ("N/D", "N/D")])
+    # an empty cell is no rainfall, which counts as data; N/D doesn't
+    assert latest_by_column(matrix) == {
+        "1": "2020-06-01T01:00:00", "2": "2020-06-01T00:00:00"}
+    assert latest_by_column(table([("N/D", "N/D")])) == {}
+
+
+def test_latest_by_column_horizon():
+    matrix = table([("0.1", "0.1")] + [("0.1", "N/D")] * 23, ids=("1", "2"))
+    assert latest_by_column(matrix, timedelta(hours=23)) == {
+        "1": "2020-06-01T23:00:00", "2": "2020-06-01T00:00:00"}
+    assert latest_by_column(matrix, timedelta(hours=22)) == {
+        "1": "2020-06-01T23:00:00"}
+
+
+def test_latest_is_the_least_up_to_date_location():
+    log = IngestLog()
+    log.record(URL, "Hourly", table([("0.1", "0.2"), ("0.1", "N/D"), ("0.3", "N/D")]))
+    assert log.latest(URL, "Hourly", ["1"]) == datetime(2020, 6, 1, 2)
+    assert log.latest(URL, "Hourly", ["1", "2"]) == datetime(2020, 6, 1, 0)
+    # nothing has been received for gauge 3
+    assert log.latest(URL, "Hourly", ["1", "3"]) is None
+    assert log.latest(URL, "Daily", ["1"]) is None
+
+
+def test_latest_only_moves_forward():
+    log = IngestLog()
+    log.record(URL, "Hourly", table([("0.1", "0.2"), ("0.1", "0.2")]))
+    # an older window doesn't move it back
+    log.record(URL, "Hourly", table([("0.1", "0.2")]))
+    log.record(URL, "Hourly", table([("0.1", "0.2"), ("0.1", "0.2"), ("N/D", "0.2")]))
+    assert log.latest(URL, "Hourly", ["1"]) == datetime(2020, 6, 1, 1)
+    assert log.latest(URL, "Hourly", ["2"]) == datetime(2020, 6, 1, 2)
+
+
+def test_watermark():
+    start, end = datetime(2020, 6, 1), datetime(2020, 6, 2)
+    assert watermark(start, end, "Hourly", None) == start
+    # the newest hour of data may still be revised
+    assert watermark(start, end, "Hourly", datetime(2020, 6, 1, 14)) == datetime(2020, 6, 1, 14)
+    assert watermark(start, end, "15-minute", datetime(2020, 6, 1, 14)) == datetime(2020, 6, 1, 13, 15)
+    assert watermark(start, end, "Hourly", datetime(2020, 6, 3)) == datetime(2020, 6, 1, 23)
+
+
+@pytest.mark.parametrize("rows", [
+    [("0.1", "0.2"), ("", "N/D"), ("N/D", "N/D")],
+    [("N/D", "0.2"), ("N/D", ""), ("N/D", "N/D")],
+    [("N/D", "N/D")],
+    [],
+])
+def test_watch_rows_matches_latest_by_column(rows):
+    ids, parsed = iter_csv(lines(rows))
+    latest = {}
+    watched = list(watch_rows(ids, parsed, latest))
+    # the rows are passed through as they are
+    assert watched == list(iter_csv(lines(rows))[1])
+    assert latest == latest_by_column(table(rows))
+
+
+def test_streamed_responses_are_recorded(app, monkeypatch):
+    """data streamed straight from Teragon's response moves the watermark
+    on, as fetched data does
+    """
+    log = IngestLog()
+    monkeypatch.setattr(app, "ingest_log", log)
+    body = "\r\n".join(lines([("0.1", "0.2"), ("0.1", ""), ("0.3", "N/D"), ("N/D", "N/D")]))
+
+    class StreamedResponse(object):
+        def iter_lines(self, decode_unicode=False):
+            return iter(body.splitlines())
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(app, "post_teragon", lambda url, data, stream=False: StreamedResponse())
+    client = app.application.test_client()
+    r = client.get('/api/gauge/?ids=1,2&format=ndjson&dates=2020-06-01T00:00/2020-06-01T04:00')
+    assert r.status_code == 200
+    assert len(r.data.splitlines()) == 4
+    url = app.application.config['URL_GAGE']
+    assert log.latest(url, "Hourly", ["1"]) == datetime(2020, 6, 1, 2)
+    assert log.latest(url, "Hourly", ["2"]) == datetime(2020, 6, 1, 1)
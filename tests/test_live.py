@@ -0,0 +1,132 @@
+'''
+test_live.py
+
+The live window cache: hits, incremental refreshes as the window slides
+forward, and eviction.
+
+'''
+
+from array import array
+from datetime import datetime, timedelta
+
+import pytest
+
+from rainfall.live import LiveCache
+from rainfall.matrix import RainfallMatrix
+from rainfall.teragon import payload_ids, payload_window, payload_with_window
+
+HOUR = timedelta(hours=1)
+URL = "http://teragon.test/gauge"
+NOW = datetime(2020, 6, 1, 12)
+
+
+class FakeTeragon(object):
+    """answers payloads with a row per hour of their window, valued by the
+    hour and the number of the request (so refetched rows can be told apart)
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, url, payload):
+        self.requests.append(payload_window(payload))
+        kind, ids = payload_ids(payload)
+        start, end = payload_window(payload)
+        hours = int((end - start) / HOUR)
+        timestamps = [(start + h * HOUR).isoformat() for h in range(hours)]
+        values = array('d', [
+            (start + h * HOUR).hour + len(self.requests) / 100.0
+            for h in range(hours) for _ in ids
+        ])
+        return RainfallMatrix(timestamps, ids, values)
+
+
+def payload(end, hours=24, gauges=(1, 2)):
+    return payload_with_window(
+        {"interval": "Hourly", "zerofill": False, "gauges": list(gauges)},
+        end - hours * HOUR, end)
+
+
+@pytest.fixture
+def teragon():
+    return FakeTeragon()
+
+
+@pytest.fixture
+def cache(teragon):
+    return LiveCache(teragon, {"Hourly": 60}, max_cells=1000)
+
+
+def test_hit(cache, teragon):
+    first = cache.get(URL, payload(NOW))
+    assert cache.get(URL, payload(NOW)) is first
+    assert len(teragon.requests) == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_slide_forward_fetches_only_the_newest_hours(cache, teragon):
+    first = cache.get(URL, payload(NOW))
+    later = cache.get(URL, payload(NOW + 2 * HOUR))
+    # the newest cached hour is fetched again, with the new hours
+    assert teragon.requests[-1] == (NOW - HOUR, NOW + 2 * HOUR)
+    assert later.matrix.timestamps == [
+        (NOW - 22 * HOUR + h * HOUR).isoformat() for h in range(24)]
+    # the rows kept are the cached ones
+    assert later.matrix.row(0) == first.matrix.row(2)
+    assert later.matrix.row(20) == first.matrix.row(22)
+    assert later.matrix.row(21)[0] == (NOW - HOUR).hour + 0.02
+
+
+def test_stale_entry_is_refreshed(cache, teragon):
+    entry = cache.get(URL, payload(NOW))
+    entry.refreshed -= 61
+    refreshed = cache.get(URL, payload(NOW))
+    assert refreshed is not entry
+    assert teragon.requests[-1] == (NOW - HOUR, NOW)
+
+
+def test_older_window_is_not_served(cache):
+    cache.get(URL, payload(NOW))
+    assert cache.get(URL, payload(NOW - 2 * HOUR)) is None
+
+
+def test_windows_of_other_ids_are_separate(cache, teragon):
+    cache.get(URL, payload(NOW))
+    entry = cache.get(URL, payload(NOW, gauges=(3,)))
+    assert entry.matrix.ids == ["3"]
+    assert len(teragon.requests) == 2
+
+
+def test_render_is_cached(cache):
+    entry = cache.get(URL, payload(NOW))
+    calls = []
+    render = lambda: calls.append(1) or {"rendered": True}
+    assert cache.render(entry, "json", render) is cache.render(entry, "json", render)
+    assert len(calls) == 1
+
+
+def test_eviction(teragon):
+    # each window is 48 cells
+    cache = LiveCache(teragon, {"Hourly": 60}, max_cells=100)
+    cache.get(URL, payload(NOW, gauges=(1, 2)))
+    cache.get(URL, payload(NOW, gauges=(3, 4)))
+    cache.get(URL, payload(NOW, gauges=(5, 6)))
+    assert cache.stats()["entries"] == 2
+    cache.get(URL, payload(NOW, gauges=(1, 2)))
+    assert len(teragon.requests) == 4
+
+
+def test_background_refresh(cache, teragon):
+    entry = cache.get(URL, payload(NOW))
+    entry.refreshed -= 31
+    cache.refresh()
+    assert len(teragon.requests) == 2
+    assert cache.get(URL, payload(NOW)) is not entry
+    assert len(teragon.requests) == 2
+
+
+def test_idle_entries_are_dropped(cache):
+    entry = cache.get(URL, payload(NOW))
+    entry.accessed -= 60 * 5
+    cache.refresh()
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,205 @@
+'''
+test_matrix.py
+
+RainfallMatrix against the original petl pipeline that it replaced: the same
+tables, rendered the same way, for Teragon's CSV with 'N/D' cells, empty
+cells, short rows and the trailing Total row.
+
+'''
+
+import math
+from array import array
+
+import petl as etl
+import pytest
+from dateutil.parser import parse
+
+from rainfall.matrix import RainfallMatrix, decode_lines, iter_csv
+
+CSV = (
+    "Timestamp,134-111,134-111 notes,135-111,135-111 notes,136-111,136-111 notes\r\n"
+    "09/17/2004 03:00,0.25,,N/D,,,\r\n"
+    "09/17/2004 04:00,,,0.5,gauge down,1.125,\r\n"
+    "09/17/2004 05:00,N/D,,,\r\n"
+    "09/17/2004 06:00,0.75\r\n"
+    "Total,1.0,,0.5,,1.125,\r\n"
+)
+
+OTHER_CSV = (
+    "Timestamp,137-111,137-111 notes\r\n"
+    "09/17/2004 04:00,2.0,\r\n"
+    "09/17/2004 07:00,,\r\n"
+    "Total,2.0,\r\n"
+)
+
+
+def petl_table(teragon_csv):
+    """Teragon's CSV through the original petl pipeline: notes columns cut,
+    Total dropped, timestamps in ISO 8601, and 'N/D' as None
+    """
+    table = etl.fromcsv(etl.MemorySource(teragon_csv.encode('utf-8')))
+    header = list(etl.header(table))
+    new_header = ['Timestamp']
+    notes = []
+    for id_col, _ in zip(*[iter(header[1:])] * 2):
+        new_header.extend([id_col, "{0}-n".format(id_col)])
+        notes.append("{0}-n".format(id_col))
+    return etl \
+        .setheader(table, new_header) \
+        .cutout(*notes) \
+        .select('Timestamp', lambda v: v.upper() != 'TOTAL') \
+        .convert('Timestamp', lambda t: parse(t).isoformat()) \
+        .replaceall('N/D', None)
+
+
+def petl_indexed(table):
+    """a petl table rendered as {timestamp: {id: value}}, with values as
+    floats, empty cells as '', and 'N/D' as None
+    """
+    return {
+        row['Timestamp']: {
+            k: float(v) if v else v for k, v in row.items() if k != 'Timestamp'
+        }
+        for row in etl.dicts(table)
+    }
+
+
+def petl_records(table):
+    """a petl table rendered as records, as the original transform did"""
+    return [
+        {
+            "id": row['Timestamp'],
+            "d": [
+                {'id': k, 'v': float(v) if v else v}
+                for k, v in row.items() if k != 'Timestamp'
+            ]
+        }
+        for row in etl.dicts(table)
+    ]
+
+
+def test_from_csv_matches_petl():
+    matrix = RainfallMatrix.from_csv(CSV)
+    table = petl_table(CSV)
+    assert matrix.ids == ["134-111", "135-111", "136-111"]
+    assert matrix.to_indexed() == petl_indexed(table)
+    assert matrix.to_records() == petl_records(table)
+    assert matrix.to_indexed(by_location=True) == petl_indexed(etl.transpose(table))
+
+
+def test_from_csv_missing_values():
+    matrix = RainfallMatrix.from_csv(CSV)
+    # the Total row is dropped
+    assert matrix.timestamps[-1] == "2004-09-17T06:00:00"
+    assert matrix.nrows == 4
+    # 'N/D' is None, an empty cell is '', and cells missing from short rows
+    # are None
+    assert matrix.row(0) == [0.25, None, '']
+    assert matrix.row(2) == [None, '', None]
+    assert matrix.row(3) == [0.75, None, None]
+    assert matrix.column(2) == ['', 1.125, None, None]
+
+
+def test_from_csv_sources_agree():
+    expected = RainfallMatrix.from_csv(CSV).to_indexed()
+    assert RainfallMatrix.from_csv(CSV.encode('utf-8')).to_indexed() == expected
+    assert RainfallMatrix.from_csv(CSV.splitlines(True)).to_indexed() == expected
+
+
+def test_from_csv_without_blanks():
+    matrix = RainfallMatrix.from_csv(
+        "Timestamp,a,a notes\r\n01/01/2020 00:00,N/D,\r\nTotal,0,\r\n")
+    assert matrix.blanks is None
+    assert matrix.row(0) == [None]
+
+
+def test_decode_lines_across_chunks():
+    body = CSV.replace("gauge down", "gauge déjà").encode('utf-8')
+    # every split, including inside a multibyte character
+    for size in (1, 2, 3, 7, 64):
+        chunks = [body[k:k + size] for k in range(0, len(body), size)]
+        assert "".join(decode_lines(chunks)) == body.decode('utf-8')
+    parsed = RainfallMatrix.from_csv(decode_lines([body[:50], body[50:]]))
+    assert parsed.to_indexed() == RainfallMatrix.from_csv(CSV).to_indexed()
+
+
+def test_iter_csv_matches_from_csv():
+    matrix = RainfallMatrix.from_csv(CSV)
+    ids, rows = iter_csv(CSV)
+    assert ids == matrix.ids
+    assert list(rows) == [(ts, matrix.row(i)) for i, ts in enumerate(matrix.timestamps)]
+
+
+def test_vstack_matches_petl():
+    first = "".join(CSV.splitlines(True)[:3])
+    second = CSV.splitlines(True)[0] + "".join(CSV.splitlines(True)[3:])
+    matrix = RainfallMatrix.vstack([
+        RainfallMatrix.from_csv(first), RainfallMatrix.from_csv(second)])
+    table = etl.cat(petl_table(first), petl_table(second))
+    assert matrix.to_indexed() == petl_indexed(table)
+    assert matrix.to_records() == petl_records(table)
+
+
+def test_hstack_aligned_matches_petl():
+    left = RainfallMatrix.from_csv(CSV).take_columns(["134-111"])
+    right = RainfallMatrix.from_csv(CSV).take_columns(["135-111", "136-111"])
+    matrix = RainfallMatrix.hstack([left, right])
+    assert matrix.to_indexed() == petl_indexed(petl_table(CSV))
+
+
+def test_hstack_unaligned_matches_petl():
+    matrix = RainfallMatrix.hstack([
+        RainfallMatrix.from_csv(CSV), RainfallMatrix.from_csv(OTHER_CSV)])
+    # timestamps missing from one of the tables are filled with empty cells
+    table = etl.outerjoin(petl_table(CSV), petl_table(OTHER_CSV), key='Timestamp') \
+        .replaceall(None, '')
+    expected = petl_indexed(table)
+    # ...but the cells that were 'N/D' (or missing from short rows) stay None
+    for ts, row in petl_indexed(petl_table(CSV)).items():
+        for k, v in row.items():
+            if v is None:
+                expected[ts][k] = None
+    assert matrix.timestamps == sorted(expected)
+    assert matrix.to_indexed() == expected
+
+
+def test_take_columns_matches_petl():
+    matrix = RainfallMatrix.from_csv(CSV).take_columns(["136-111", "134-111"])
+    table = etl.cut(petl_table(CSV), 'Timestamp', '136-111', '134-111')
+    assert matrix.ids == ["136-111", "134-111"]
+    assert matrix.to_records() == petl_records(table)
+
+
+def test_take_columns_fills_unknown_ids():
+    matrix = RainfallMatrix.from_csv(CSV).take_columns(["134-111", "999-999"])
+    assert matrix.column(1) == [None] * 4
+
+
+@pytest.mark.parametrize("start,end", [
+    ("2004-09-17T04:00:00", "2004-09-17T06:00:00"),
+    ("2004-09-17T04:00:00", None),
+    ("2004-09-18T00:00:00", None),
+])
+def test_take_rows_matches_petl(start, end):
+    matrix = RainfallMatrix.from_csv(CSV).take_rows(start, end)
+    table = etl.select(
+        petl_table(CSV), 'Timestamp',
+        lambda t: start <= t and (end is None or t < end))
+    assert matrix.to_indexed() == petl_indexed(table)
+    assert len(matrix.values) == matrix.nrows * matrix.ncols
+
+
+def test_zero_blanks():
+    matrix = RainfallMatrix.from_csv(CSV)
+    values = matrix.zero_blanks()
+    assert values[2] == 0.0
+    assert math.isnan(values[1])
+    # the matrix itself is unchanged
+    assert math.isnan(matrix.values[2])
+
+
+def test_empty_table():
+    matrix = RainfallMatrix.from_csv("Timestamp\r\nTotal\r\n")
+    assert (matrix.nrows, matrix.ncols) == (0, 0)
+    assert matrix.to_indexed() == {}
+    assert matrix.values == array('d')
@@ -0,0 +1,112 @@
+'''
+test_metrics.py
+
+Stage timings and their histograms, and the timings of requests to the API
+as published at /metrics, logged, and profiled when they're slow.
+
+'''
+
+import logging
+import os
+import re
+
+import pytest
+
+from rainfall import metrics
+from rainfall.matrix import RainfallMatrix
+from rainfall.metrics import Histogram, Metrics, RequestTimings, count_bucket, stage
+
+CSV = "Timestamp,1,1 notes,2,2 notes\r\n09/17/2004 00:00,0.25,,N/D,\r\n"
+
+
+@pytest.mark.parametrize("count,label", [
+    (0, "0"), (1, "1"), (2, "2-10"), (10, "2-10"), (11, "11-100"),
+    (1000, "101-1000"), (1001, "1001+"), (2313, "1001+"),
+])
+def test_count_bucket(count, label):
+    assert count_bucket(count) == label
+
+
+def test_histogram():
+    h = Histogram("x_seconds", "Some time.", ("stage",), (0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        h.observe(("csv",), value)
+    assert h.render().splitlines() == [
+        "# HELP x_seconds Some time.",
+        "# TYPE x_seconds histogram",
+        'x_seconds_bucket{stage="csv",le="0.1"} 1',
+        'x_seconds_bucket{stage="csv",le="1"} 3',
+        'x_seconds_bucket{stage="csv",le="+Inf"} 4',
+        'x_seconds_sum{stage="csv"} 6.050000',
+        'x_seconds_count{stage="csv"} 4',
+    ]
+
+
+def test_stages_of_the_current_request():
+    # outside of a request, nothing is recorded
+    with stage("csv"):
+        pass
+    timings = RequestTimings()
+    token = metrics.current.set(timings)
+    try:
+        with stage("csv"):
+            pass
+        with stage("csv"):
+            pass
+        with pytest.raises(ValueError):
+            with stage("transform"):
+                raise ValueError()
+        metrics.record_bytes(100)
+    finally:
+        metrics.current.reset(token)
+    assert [name for name, seconds in timings.stages] == ["csv", "csv", "transform"]
+    assert set(timings.summary()) == {"csv", "transform"}
+    assert timings.bytes == [100]
+
+
+def count(text, name, **labels):
+    """the count of a histogram's series"""
+    for line in text.splitlines():
+        match = re.match(r'^{0}_count\{{(.*)\}} (\d+)$'.format(name), line)
+        if match and all('{0}="{1}"'.format(k, v) in match.group(1) for k, v in labels.items()):
+            return int(match.group(2))
+    return 0
+
+
+@pytest.fixture
+def client(app, monkeypatch):
+    """the test client, with fresh metrics, and Teragon's data replaced by a
+    table
+    """
+    monkeypatch.setattr(app, "request_metrics", Metrics())
+    monkeypatch.setattr(app, "fetch_matrix", lambda url, data: RainfallMatrix.from_csv(CSV))
+    return app.application.test_client()
+
+
+URL = '/api/gauge/?ids=1,2&dates=2004-09-17T00:00/2004-09-17T03:00'
+
+
+def test_metrics_endpoint(client):
+    assert client.get(URL).status_code == 200
+    assert client.get(URL).status_code == 200
+    assert client.post('/api/garrd/?ids=123-1000').status_code == 400
+    r = client.get('/metrics')
+    assert r.status_code == 200
+    assert r.mimetype == "text/plain"
+    text = r.data.decode('utf-8')
+    labels = dict(endpoint="/api/gauge/", interval="Hourly", locations="2-10")
+    assert count(text, "rainfall_request_seconds", status="200", **labels) == 2
+    assert count(text, "rainfall_request_seconds", endpoint="/api/garrd/", status="400") == 1
+    for name in ("parse", "transform", "serialize"):
+        assert count(text, "rainfall_stage_seconds", stage=name, **labels) == 2
+
+
+def test_slow_requests(app, client, monkeypatch, caplog, tmp_path):
+    monkeypatch.setitem(app.application.config, 'SLOW_REQUEST_SECONDS', 0)
+    monkeypatch.setitem(app.application.config, 'PROFILE_DIR', str(tmp_path))
+    with caplog.at_level(logging.WARNING):
+        assert client.get(URL).status_code == 200
+    assert any("slow request" in r.getMessage() and "transform" in r.getMessage()
+               for r in caplog.records)
+    profiles = os.listdir(str(tmp_path))
+    assert len(profiles) == 1 and profiles[0].endswith("-200.prof")
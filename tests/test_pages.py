@@ -0,0 +1,84 @@
+'''
+test_pages.py
+
+Cursors, and the payloads of pages of time and of locations.
+
+'''
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from rainfall.pages import (decode_cursor, encode_cursor, location_page,
+                            request_token, time_page, time_span)
+from rainfall.teragon import payload_ids, payload_window, payload_with_window
+
+START = datetime(2020, 1, 1)
+END = datetime(2020, 1, 2)
+
+
+def payload(interval="Hourly", start=START, end=END, pixels="134,111;135,111;136,111"):
+    return payload_with_window(
+        {"interval": interval, "zerofill": "", "pixels": pixels}, start, end)
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor("2020-01-01T06:00:00", 6, 1234, (START, END))
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == ("2020-01-01T06:00:00", 6, 1234, (START, END))
+    assert decode_cursor(encode_cursor(2, 1, 5, (START, END)))[0] == 2
+
+
+@pytest.mark.parametrize("cursor", [
+    "",
+    "not a cursor",
+    encode_cursor("2020-01-01T06:00:00", 6, 1, (START, END))[:-4],
+    encode_cursor("2020-01-01T06:00:00", 0, 1, (START, END)),
+    encode_cursor(None, 6, 1, (START, END)),
+])
+def test_malformed_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_request_token():
+    assert request_token(payload()) == request_token(payload())
+    assert request_token(payload()) != request_token(payload(end=END + timedelta(hours=1)))
+    assert request_token(payload()) != request_token(payload(interval="Daily"))
+    assert request_token(payload()) != request_token(payload(pixels="134,111"))
+
+
+@pytest.mark.parametrize("interval,size,unit,expected", [
+    ("Hourly", 6, None, timedelta(hours=6)),
+    # pages are whole hours
+    ("15-minute", 6, None, timedelta(hours=2)),
+    ("15-minute", 4, None, timedelta(hours=1)),
+    # ...and whole units
+    ("Hourly", 5, timedelta(hours=3), timedelta(hours=6)),
+    ("15-minute", 1, timedelta(minutes=45), timedelta(hours=3)),
+    ("Daily", 2, None, timedelta(days=2)),
+])
+def test_time_span(interval, size, unit, expected):
+    assert time_span(payload(interval), size, unit) == expected
+
+
+def test_time_pages_cover_the_window():
+    span = time_span(payload(), 10)
+    at, pages = START, []
+    while at is not None:
+        page, page_end, at = time_page(payload(), at, span)
+        pages.append(payload_window(page))
+    assert pages == [
+        (START, START + timedelta(hours=10)),
+        (START + timedelta(hours=10), START + timedelta(hours=20)),
+        (START + timedelta(hours=20), END),
+    ]
+
+
+def test_location_pages():
+    page, following = location_page(payload(), 0, 2)
+    assert payload_ids(page)[1] == ["134-111", "135-111"]
+    assert following == 2
+    page, following = location_page(payload(), 2, 2)
+    assert payload_ids(page)[1] == ["136-111"]
+    assert following is None
@@ -0,0 +1,95 @@
+'''
+test_pixels.py
+
+Pixel codes: every pixel of the grid, in each of its formats, encoded and
+decoded again; the edges of the lattice; and ids that aren't pixels.
+
+'''
+
+import csv
+import os
+
+import pytest
+
+from rainfall.pixels import PixelTable, dashed, encode, teragon
+
+GRID = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "grid.csv")
+
+
+@pytest.fixture(scope="module")
+def codes():
+    with open(GRID, newline='') as f:
+        return [int(row['PIXEL']) for row in csv.DictReader(f)]
+
+
+def test_grid_round_trip(codes):
+    for code in codes:
+        column, row = divmod(code, 1000)
+        assert dashed(code) == "{0}-{1}".format(column, row)
+        assert teragon(code) == "{0},{1}".format(column, row)
+        assert encode(dashed(code)) == encode(teragon(code)) == encode(str(code)) == code
+        assert encode(code) == code
+
+
+def test_table_round_trip(codes):
+    table = PixelTable(codes)
+    assert len(table) == len(codes)
+    ids = table.to_dashed(codes)
+    assert ids == [dashed(c) for c in codes]
+    assert [encode(i) for i in ids] == codes
+    argument = table.to_teragon(reversed(codes))
+    assert [encode(i) for i in argument.split(";")] == codes[::-1]
+
+
+@pytest.mark.parametrize("pixel_id,code", [
+    ("0-0", 0),
+    ("0-999", 999),
+    ("1-0", 1000),
+    ("123-999", 123999),
+    ("124-000", 124000),
+    ("124,1", 124001),
+    (" 134-111 ", 134111),
+    ("999999", 999999),
+    ("1000-0", 1000000),
+])
+def test_lattice_edges(pixel_id, code):
+    assert encode(pixel_id) == code
+    column, row = divmod(code, 1000)
+    assert dashed(code) == "{0}-{1}".format(column, row)
+    assert encode(dashed(code)) == code
+
+
+@pytest.mark.parametrize("pixel_id", [
+    # rows past the lattice's, which would be another pixel's code
+    "123-1000",
+    "123,1234",
+    # negative columns, rows, and codes
+    "-1-5",
+    "5--1",
+    -1,
+    # not ids
+    "",
+    "abc",
+    "123-abc",
+    "1-2-3",
+    "123;456",
+])
+def test_not_a_pixel(pixel_id):
+    with pytest.raises(ValueError):
+        encode(pixel_id)
+
+
+def test_table_outside_the_grid(codes):
+    # pixels in the lattice but not in the grid are still formatted
+    table = PixelTable(codes[:10])
+    assert table.to_dashed([codes[0], 999001]) == [dashed(codes[0]), "999-1"]
+    assert table.to_teragon([999001, codes[1]]) == "999,1;" + teragon(codes[1])
+    assert table.to_teragon([]) == ""
+
+
+def test_ids_argument(app):
+    client = app.application.test_client()
+    r = client.post('/api/garrd/?ids=134-111,123-1000')
+    assert r.status_code == 400
+    assert "pixel" in r.get_json()["message"]
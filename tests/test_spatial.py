@@ -0,0 +1,111 @@
+'''
+test_spatial.py
+
+Selecting GARR pixels by point, bounding box and polygon, checked against a
+brute-force search of the grid, and the errors of the selection arguments.
+
+'''
+
+import os
+import random
+
+import pytest
+
+from rainfall.spatial import PixelIndex, geometry_polygons, _polygon_contains
+
+GRID = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "grid.csv")
+
+
+@pytest.fixture(scope="module")
+def index():
+    return PixelIndex(GRID)
+
+
+def test_at_centroid(index):
+    assert index.at(-80.15225, 40.68540) == [134111]
+
+
+def test_at_outside_grid(index):
+    assert index.at(-79.0, 40.0) == []
+
+
+def test_within_bbox_matches_brute_force(index):
+    rng = random.Random(0)
+    minx, miny, maxx, maxy = index.bounds
+    for _ in range(20):
+        x0, x1 = sorted(rng.uniform(minx, maxx) for _ in range(2))
+        y0, y1 = sorted(rng.uniform(miny, maxy) for _ in range(2))
+        expected = [
+            c for c, (x, y) in zip(index.codes, index.centroids)
+            if x0 <= x <= x1 and y0 <= y <= y1
+        ]
+        if expected:
+            assert index.within_bbox(x0, y0, x1, y1) == expected
+
+
+def test_small_bbox_selects_pixel_at_center(index):
+    assert index.within_bbox(-80.1523, 40.6853, -80.1522, 40.6854) == [134111]
+
+
+def test_within_polygon_matches_brute_force(index):
+    triangle = {"type": "Polygon", "coordinates": [[
+        [-80.2, 40.35], [-79.9, 40.55], [-79.85, 40.3], [-80.2, 40.35]]]}
+    rings = geometry_polygons(triangle)[0]
+    expected = [
+        c for c, (x, y) in zip(index.codes, index.centroids)
+        if _polygon_contains(rings, x, y)
+    ]
+    assert expected
+    assert index.within(triangle) == expected
+    # the same as a Feature, or a FeatureCollection
+    feature = {"type": "Feature", "properties": {}, "geometry": triangle}
+    assert index.within(feature) == expected
+    assert index.within({"type": "FeatureCollection", "features": [feature]}) == expected
+
+
+def test_polygon_hole(index):
+    outer = [[-80.2, 40.3], [-79.8, 40.3], [-79.8, 40.6], [-80.2, 40.6], [-80.2, 40.3]]
+    hole = [[-80.1, 40.4], [-79.9, 40.4], [-79.9, 40.5], [-80.1, 40.5], [-80.1, 40.4]]
+    with_hole = set(index.within({"type": "Polygon", "coordinates": [outer, hole]}))
+    without = set(index.within({"type": "Polygon", "coordinates": [outer]}))
+    inside_hole = set(index.within({"type": "Polygon", "coordinates": [hole]}))
+    assert with_hole == without - inside_hole
+
+
+def test_small_polygon_selects_pixels_at_vertices(index):
+    tiny = {"type": "Polygon", "coordinates": [[
+        [-80.1523, 40.6853], [-80.1522, 40.6853], [-80.1522, 40.6854], [-80.1523, 40.6853]]]}
+    assert index.within(tiny) == [134111]
+
+
+@pytest.mark.parametrize("geometry", [
+    {"type": "Point", "coordinates": [-80.0, 40.4]},
+    {"type": "Polygon", "coordinates": []},
+    {"type": "Polygon", "coordinates": [[[-80.0, 40.4], [-80.1, 40.4]]]},
+    {"type": "Polygon"},
+    "POLYGON",
+])
+def test_invalid_geometry(geometry):
+    with pytest.raises(ValueError):
+        geometry_polygons(geometry)
+
+
+@pytest.mark.parametrize("query,name", [
+    ('polygon={"type": "Point", "coordinates": [-80, 40.5]}', "polygon"),
+    ('polygon={"type": "Polygon", "coordinates": [[]]}', "polygon"),
+    ("bbox=-80,40.4", "bbox"),
+    ("bbox=-inf,40.4,inf,40.6", "bbox"),
+    ("point=nan,40.5", "point"),
+    ("point=inf,40.5", "point"),
+    ("point=-80,40.5,1", "point"),
+])
+def test_geometry_errors_name_the_argument(app, query, name):
+    r = app.application.test_client().post('/api/garrd/?' + query)
+    assert r.status_code == 400
+    message = r.get_json()["message"]
+    if isinstance(message, dict):
+        # reqparse's errors, by argument
+        assert list(message) == [name]
+    else:
+        assert message.startswith(name + ": ")
@@ -0,0 +1,26 @@
+'''
+test_startup.py
+
+The worker processes of rainfall.workers re-import the script the app was
+started with, as __mp_main__; they don't load the app's data or start its
+services.
+
+'''
+
+import os
+import runpy
+import threading
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "application.py")
+
+
+def test_spawned_workers_skip_startup():
+    before = set(threading.enumerate())
+    module = runpy.run_path(APP, run_name="__mp_main__")
+    assert not module['SERVING']
+    assert module['transform_pool'] is None
+    assert module['engine'] is None
+    assert module['live_cache'] is None
+    assert module['store'] is None
+    assert 'feature_templates' not in module
+    assert set(threading.enumerate()) == before
@@ -0,0 +1,119 @@
+'''
+test_store.py
+
+RainfallStore: what is stored, what is reported missing, and what is read
+back.
+
+'''
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from rainfall.matrix import RainfallMatrix
+from rainfall.store import RainfallStore
+
+START = datetime(2004, 9, 17, 3)
+END = datetime(2004, 9, 17, 7)
+
+CSV = (
+    "Timestamp,134-111,134-111 notes,135-111,135-111 notes\r\n"
+    "09/17/2004 03:00,0.25,,N/D,\r\n"
+    "09/17/2004 04:00,,,0.5,\r\n"
+    "09/17/2004 06:00,1.0,,,\r\n"
+    "Total,1.25,,0.5,\r\n"
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return RainfallStore(str(tmp_path))
+
+
+def write(store, teragon_csv, start=START, end=END):
+    matrix = RainfallMatrix.from_csv(teragon_csv)
+    store.write("garr", "Hourly", False, matrix, start, end)
+    return matrix
+
+
+def test_everything_missing_at_first(store):
+    assert store.missing("garr", "Hourly", False, ["134-111"], START, END) == [(START, END)]
+
+
+def test_write_then_read(store):
+    write(store, CSV)
+    ids = ["134-111", "135-111"]
+    assert store.missing("garr", "Hourly", False, ids, START, END) == []
+    matrix = store.read("garr", "Hourly", False, ids, START, END)
+    # the 05:00 step Teragon returned no row for is left out
+    assert matrix.timestamps == [
+        "2004-09-17T03:00:00", "2004-09-17T04:00:00", "2004-09-17T06:00:00"]
+    assert matrix.to_indexed() == RainfallMatrix.from_csv(CSV).to_indexed()
+
+
+def test_read_subset_of_ids(store):
+    write(store, CSV)
+    matrix = store.read("garr", "Hourly", False, ["135-111"], START, END)
+    assert matrix.column(0) == [None, 0.5, '']
+
+
+def test_missing_other_ids_and_steps(store):
+    write(store, CSV)
+    later = END + timedelta(hours=2)
+    assert store.missing("garr", "Hourly", False, ["134-111"], START, later) == [(END, later)]
+    assert store.missing("garr", "Hourly", False, ["134-111", "136-111"], START, END) == [(START, END)]
+    # series are kept apart by interval and zerofill
+    assert store.missing("garr", "Hourly", True, ["134-111"], START, END) == [(START, END)]
+    assert store.missing("gauge", "Hourly", False, ["134-111"], START, END) == [(START, END)]
+
+
+def test_recent_steps_are_not_stored(tmp_path):
+    store = RainfallStore(str(tmp_path), settle=timedelta(days=1))
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    start, end = now - timedelta(days=1, hours=3), now
+    until = store.settled_until("Hourly")
+    assert start < until <= end
+    ids = ["134-111"]
+    matrix = RainfallMatrix.from_csv(
+        "Timestamp,134-111,n\r\n" + "".join(
+            "{0},1.0,\r\n".format((start + timedelta(hours=h)).strftime("%m/%d/%Y %H:%M"))
+            for h in range(27)))
+    store.write("garr", "Hourly", False, matrix, start, end)
+    # the unsettled steps are always missing
+    assert store.missing("garr", "Hourly", False, ids, start, end) == [(until, end)]
+
+
+def test_covers(store):
+    assert store.covers("Hourly", START, END)
+    assert not store.covers("Daily", START, END)
+    assert not store.covers("Hourly", START + timedelta(minutes=15), END)
+
+
+def test_repeated_step_keeps_the_first_row(store):
+    repeated = (
+        "Timestamp,134-111,134-111 notes\r\n"
+        "11/07/2004 00:00,0.1,\r\n"
+        "11/07/2004 01:00,0.2,\r\n"
+        "11/07/2004 01:00,0.3,\r\n"
+        "11/07/2004 02:00,0.4,\r\n"
+    )
+    start, end = datetime(2004, 11, 7), datetime(2004, 11, 7, 3)
+    write(store, repeated, start, end)
+    assert store.skipped_rows == 1
+    # the window is stored, so it isn't fetched again
+    assert store.missing("garr", "Hourly", False, ["134-111"], start, end) == []
+    matrix = store.read("garr", "Hourly", False, ["134-111"], start, end)
+    assert matrix.column(0) == [0.1, 0.2, 0.4]
+
+
+def test_off_step_rows_are_skipped(store):
+    off_step = (
+        "Timestamp,134-111,134-111 notes\r\n"
+        "09/17/2004 03:00,0.1,\r\n"
+        "09/17/2004 03:30,0.2,\r\n"
+        "09/17/2004 04:00,0.3,\r\n"
+    )
+    write(store, off_step, START, START + timedelta(hours=2))
+    assert store.skipped_rows == 1
+    matrix = store.read("garr", "Hourly", False, ["134-111"], START, START + timedelta(hours=2))
+    assert matrix.column(0) == [0.1, 0.3]
@@ -0,0 +1,108 @@
+'''
+test_streaming.py
+
+Streamed JSON against the regular response: joined up, the chunks are the
+same document as json.dumps of the indexed or record rendering, keys in the
+same order, for both orientations, with 'N/D' cells, empty cells, and
+tables without rows or locations.
+
+'''
+
+import json
+
+import pytest
+
+from rainfall.matrix import RainfallMatrix
+from rainfall.streaming import json_chunks
+
+# locations out of order, with 'N/D' and empty cells
+CSV = (
+    "Timestamp,136-111,136-111 notes,134-111,134-111 notes,135-111,135-111 notes\r\n"
+    "09/17/2004 03:00,0.25,,N/D,,,\r\n"
+    "09/17/2004 04:00,,,0.5,gauge down,1.125,\r\n"
+    "09/17/2004 05:00,N/D,,,\r\n"
+    "Total,0.25,,0.5,,1.125,\r\n"
+)
+
+MATRICES = {
+    "values": CSV,
+    "no rows": "Timestamp,134-111,134-111 notes\r\n",
+    "no locations": "Timestamp\r\n",
+}
+
+
+def regular(matrix, indexed, by_location):
+    """the non-streamed response's body"""
+    if indexed:
+        return json.dumps(matrix.to_indexed(by_location=by_location))
+    return json.dumps(matrix.to_records(by_location=by_location))
+
+
+def pairs(body):
+    """a JSON document, with its objects as lists of pairs, in order"""
+    return json.loads(body, object_pairs_hook=list)
+
+
+@pytest.mark.parametrize("csv", list(MATRICES.values()), ids=list(MATRICES))
+@pytest.mark.parametrize("indexed", [True, False], ids=["indexed", "records"])
+@pytest.mark.parametrize("by_location", [False, True], ids=["by time", "by location"])
+def test_json_chunks_match_response(csv, indexed, by_location):
+    matrix = RainfallMatrix.from_csv(csv)
+    inner, rows = matrix.iter_rows(by_location=by_location, ordered=indexed)
+    streamed = b"".join(json_chunks(inner, rows, indexed)).decode('utf-8')
+    assert pairs(streamed) == pairs(regular(matrix, indexed, by_location))
+
+
+@pytest.mark.parametrize("indexed", [True, False], ids=["indexed", "records"])
+@pytest.mark.parametrize("by_location", [False, True], ids=["by time", "by location"])
+def test_ndjson_lines(indexed, by_location):
+    matrix = RainfallMatrix.from_csv(CSV)
+    inner, rows = matrix.iter_rows(by_location=by_location, ordered=indexed)
+    body = b"".join(json_chunks(inner, rows, indexed, ndjson=True)).decode('utf-8')
+    assert body.endswith("\n")
+    lines = [pairs(line) for line in body.splitlines()]
+    expected = pairs(regular(matrix, indexed, by_location))
+    if indexed:
+        # a single-key object per line
+        assert [line[0] for line in lines] == expected
+    else:
+        assert lines == expected
+
+
+def test_ndjson_without_rows():
+    matrix = RainfallMatrix.from_csv(MATRICES["no rows"])
+    inner, rows = matrix.iter_rows(ordered=True)
+    assert b"".join(json_chunks(inner, rows, ndjson=True)) == b""
+
+
+class StreamedResponse(object):
+    """Teragon's response, as requests streams it"""
+
+    def __init__(self, text):
+        self.text = text
+        self.closed = False
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self.text.splitlines())
+
+    def close(self):
+        self.closed = True
+
+
+def test_streamed_response(app, monkeypatch):
+    monkeypatch.setattr(app, "fetch_matrix", lambda url, data: RainfallMatrix.from_csv(CSV))
+    responses = []
+
+    def post_teragon(url, data, stream=False):
+        responses.append(StreamedResponse(CSV))
+        return responses[-1]
+
+    monkeypatch.setattr(app, "post_teragon", post_teragon)
+    client = app.application.test_client()
+    url = '/api/gauge/?ids=134,135,136&dates=2004-09-17T03:00/2004-09-17T06:00'
+    whole = client.get(url)
+    streamed = client.get(url + '&format=json-stream')
+    assert whole.status_code == streamed.status_code == 200
+    assert pairs(streamed.data) == pairs(whole.data)
+    # streamed straight from Teragon's response
+    assert len(responses) == 1 and responses[0].closed
@@ -0,0 +1,135 @@
+'''
+test_teragon.py
+
+Splitting payloads into sub-requests, and fanning them out: the merged
+sub-requests' tables against a single request for the whole payload, from a
+stand-in for Teragon that includes the end of the window in its responses,
+as Teragon may.
+
+'''
+
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from rainfall.matrix import RainfallMatrix
+from rainfall.teragon import (STEPS, fan_out, payload_ids, payload_window,
+                              payload_with_window, split_payload)
+
+VALUES = ["0.25", "N/D", "", "0", "1.5", "0.75", "2"]
+
+
+def payload(interval, start, end, ids):
+    p = {"interval": interval, "zerofill": ""}
+    if "-" in ids[0]:
+        p["pixels"] = ";".join(i.replace("-", ",") for i in ids)
+    else:
+        p["gauges"] = ",".join(ids)
+    return payload_with_window(p, start, end)
+
+
+def teragon(payload):
+    """Teragon's table for a payload, with values (including 'N/D' and
+    blanks) that only depend on the timestamp and the location
+    """
+    start, end = payload_window(payload)
+    step = STEPS[payload['interval']]
+    ids = payload_ids(payload)[1]
+    lines = ["Timestamp," + ",".join("{0},{0} notes".format(i) for i in ids)]
+    t = start
+    while t <= end:
+        lines.append(t.strftime("%m/%d/%Y %H:%M,") + ",".join(
+            VALUES[(int(t.timestamp()) // 900 + sum(map(ord, i))) % len(VALUES)] + ","
+            for i in ids))
+        t += step
+    lines.append("Total," + ",".join("0," for i in ids))
+    return RainfallMatrix.from_csv("\r\n".join(lines) + "\r\n")
+
+
+def same(a, b):
+    assert a.ids == b.ids
+    assert a.timestamps == b.timestamps
+    assert a.to_indexed() == b.to_indexed()
+
+
+PIXELS = ["{0}-{1}".format(c, r) for c in range(134, 138) for r in range(111, 114)]
+GAUGES = [str(g) for g in range(1, 12)]
+
+CASES = [
+    # interval, days, ids, max_steps, max_ids
+    ("Hourly", 3, PIXELS, 24, 100),
+    ("Hourly", 3, PIXELS, 1000, 5),
+    ("Hourly", 3, PIXELS, 7, 5),
+    ("15-minute", 1, GAUGES, 10, 4),
+    ("15-minute", 1, GAUGES, 2, 100),
+    ("Daily", 10, GAUGES, 3, 2),
+    ("Hourly", 1, GAUGES, 1000, 100),
+]
+
+
+@pytest.mark.parametrize("interval,days,ids,max_steps,max_ids", CASES)
+def test_split_payload_covers_the_payload(interval, days, ids, max_steps, max_ids):
+    start = datetime(2020, 1, 1, 5)
+    end = start + timedelta(days=days)
+    step = STEPS[interval]
+    split = split_payload(payload(interval, start, end, ids), max_steps, max_ids)
+    # consecutive windows, from the start to the end of the payload's
+    assert split[0][0] == start and split[-1][1] == end
+    for (a, b, _), (c, d, _) in zip(split, split[1:]):
+        assert b == c
+    for a, b, payloads in split:
+        # whole hours, and whole time steps
+        assert (b - a) % step == timedelta(0) or b == end
+        assert (b - a) % timedelta(hours=1) == timedelta(0) or b == end
+        assert b - a <= max(step * max_steps, timedelta(hours=1))
+        assert [payload_window(p) for p in payloads] == [(a, b)] * len(payloads)
+        # the locations, in order, in chunks of at most max_ids
+        chunks = [payload_ids(p)[1] for p in payloads]
+        assert [i for c in chunks for i in c] == ids
+        assert all(len(c) <= max_ids for c in chunks)
+
+
+@pytest.mark.parametrize("interval,days,ids,max_steps,max_ids", CASES)
+@pytest.mark.parametrize("threads", [True, False], ids=["threads", "fetch_all"])
+def test_fan_out_matches_a_single_request(interval, days, ids, max_steps, max_ids, threads):
+    start = datetime(2020, 1, 1, 5)
+    p = payload(interval, start, start + timedelta(days=days), ids)
+    fetched = []
+
+    def fetch(p):
+        fetched.append(p)
+        return teragon(p)
+
+    fetch_all = None if threads else (lambda payloads: [fetch(p) for p in payloads])
+    matrix = fan_out(fetch, p, max_steps, max_ids, parallelism=4, fetch_all=fetch_all)
+    same(matrix, teragon(p))
+    split = split_payload(p, max_steps, max_ids)
+    assert len(fetched) == sum(len(ps) for a, b, ps in split)
+    if len(fetched) == 1:
+        assert fetched[0] is p
+
+
+class Unavailable(Exception):
+    pass
+
+
+@pytest.mark.parametrize("threads", [True, False], ids=["threads", "fetch_all"])
+def test_fan_out_failed_sub_request(threads):
+    start = datetime(2020, 1, 1, 5)
+    p = payload("Hourly", start, start + timedelta(days=3), PIXELS)
+    lock = threading.Lock()
+    fetched = []
+
+    def fetch(sub):
+        with lock:
+            fetched.append(sub)
+            failing = len(fetched) == 3
+        if failing:
+            raise Unavailable(sub)
+        return teragon(sub)
+
+    fetch_all = None if threads else (lambda payloads: [fetch(p) for p in payloads])
+    # no partial table: the sub-request's error is raised
+    with pytest.raises(Unavailable):
+        fan_out(fetch, p, max_steps=24, max_ids=5, parallelism=4, fetch_all=fetch_all)
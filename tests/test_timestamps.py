@@ -0,0 +1,83 @@
+'''
+test_timestamps.py
+
+The fast timestamp parsing against dateutil, which it replaced: Teragon's
+layout, 12-hour times, ISO 8601 (with offsets), and anything else, which
+falls back to dateutil.
+
+'''
+
+from datetime import datetime
+
+import pytest
+from dateutil.parser import parse
+
+from rainfall.timestamps import parse_datetime, to_iso, to_iso_all
+
+
+@pytest.mark.parametrize("text", [
+    # Teragon's layout
+    "09/17/2004 03:15",
+    "9/7/2004 3:05",
+    "12/31/2019 23:45",
+    "01/01/2020 00:00",
+    "09/17/2004 03:15:30",
+    "  09/17/2004 03:15  ",
+    "02/29/2020 12:00",
+    # 12 AM and PM, and others
+    "09/17/2004 12:00 AM",
+    "09/17/2004 12:30 PM",
+    "09/17/2004 12:00:59 am",
+    "09/17/2004 12:15 pm",
+    "09/17/2004 1:00 AM",
+    "09/17/2004 11:59 PM",
+    "09/17/2004 00:15 AM",
+    # ISO 8601, with offsets
+    "2004-09-17T03:15:00",
+    "2004-09-17 03:15",
+    "2004-09-17T03:15:00Z",
+    "2004-09-17T03:15:00-04:00",
+    "2004-09-17T03:15:00+05:30",
+    # other layouts, parsed by dateutil
+    "Sep 17 2004 3:15 PM",
+    "17 September 2004",
+    "2004/09/17",
+    "09/17/04 03:15",
+    "09-17-2004 03:15",
+    # not a month, so taken as the day
+    "13/01/2020 03:00",
+])
+def test_to_iso_matches_dateutil(text):
+    assert to_iso(text) == parse(text).isoformat()
+
+
+@pytest.mark.parametrize("text", [
+    # in Teragon's layout, but not a date or time; dateutil's error
+    "02/30/2020 03:00",
+    "09/17/2004 25:00",
+    "Total",
+    "",
+])
+def test_to_iso_invalid(text):
+    with pytest.raises((ValueError, OverflowError)):
+        parse(text)
+    with pytest.raises((ValueError, OverflowError)):
+        to_iso(text)
+
+
+def test_to_iso_all():
+    texts = ["09/17/2004 03:00", "09/17/2004 12:00 AM", "2004-09-17T03:15:00-04:00"]
+    assert to_iso_all(texts) == [parse(t).isoformat() for t in texts]
+
+
+@pytest.mark.parametrize("text", [
+    "2017-03-03T17:00:00",
+    "2017-03-03T17:00",
+    "2017-03-03T17:00:00+00:00",
+    "2017-03-03T17:00:00Z",
+    "2017-03-03",
+    "March 3, 2017 5 PM",
+])
+def test_parse_datetime_matches_dateutil(text):
+    assert parse_datetime(text) == parse(text)
+    assert isinstance(parse_datetime(text), datetime)
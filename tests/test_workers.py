@@ -0,0 +1,71 @@
+'''
+test_workers.py
+
+The transform pool: parsing Teragon's responses, rendering and encoding
+tables in worker processes, with the data passed through shared memory.
+
+'''
+
+import csv
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from rainfall.matrix import RainfallMatrix
+from rainfall.workers import CHUNK_SIZE, TransformPool
+
+HEADER = "Timestamp,1,1 notes,2,2 notes\r\n"
+
+
+def body(rows):
+    """a 15-minute Teragon table of two gauges"""
+    start = datetime(2004, 9, 17)
+    lines = [HEADER] + [
+        "{0:%m/%d/%Y %H:%M},{1},,{2},\r\n".format(start + k * timedelta(minutes=15), a, b)
+        for k, (a, b) in enumerate(rows)]
+    return "".join(lines + ["Total,1.0,,0,\r\n"]).encode('utf-8')
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = TransformPool(1)
+    yield pool
+    pool.close()
+
+
+def shared_blocks():
+    return set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+
+
+def test_parse_csv(pool):
+    # long enough to be decoded in several chunks
+    data = body([("0.25", ""), ("N/D", "0.5")] * (CHUNK_SIZE // 20))
+    before = shared_blocks()
+    matrix = pool.parse_csv(data)
+    expected = RainfallMatrix.from_csv(data)
+    assert matrix.to_indexed() == expected.to_indexed()
+    assert matrix.to_records(by_location=True) == expected.to_records(by_location=True)
+    # the shared memory is released
+    assert shared_blocks() == before
+
+
+def test_parse_csv_encoding(pool):
+    data = HEADER.replace("1 notes", "1 não") + "09/17/2004 00:00,0.1,,0.2,\r\n"
+    matrix = pool.parse_csv(data.encode('latin-1'), 'ISO-8859-1')
+    assert matrix.to_indexed() == {"2004-09-17T00:00:00": {"1": 0.1, "2": 0.2}}
+
+
+def test_parse_csv_error(pool):
+    before = shared_blocks()
+    with pytest.raises((ValueError, csv.Error)):
+        pool.parse_csv(body([("abc", "0.1")]))
+    assert shared_blocks() == before
+
+
+def test_render_and_encode(pool):
+    matrix = RainfallMatrix.from_csv(body([("0.25", ""), ("N/D", "0.5")]))
+    rendered, stages = pool.render_json(matrix, False, True, {})
+    assert json.loads(rendered) == matrix.to_indexed()
+    assert set(stages) == {"transform", "serialize"}